@@ -0,0 +1,246 @@
+"""
+批量重新匹配 (Vectorized bulk re-matching of open lost reports against found reports).
+
+Used when tuning the matching weights: instead of calling matching.find_matches() once per
+report, all open lost reports and found reports of an area are loaded into column-oriented
+NumPy arrays and scored pairwise in (lost block x found block) chunks, keeping only a running
+top-K per lost report, so memory stays bounded by the block size rather than N x M.
+
+Scores follow matching.score_pair() component by component. The one approximation is the
+description similarity: token sets are feature-hashed into a fixed number of buckets so the
+Jaccard index can be computed with a matrix product.
+
+    flask matches rescore --area yb4 --top-k 5 --weight breed=0.3 --output matches.csv
+"""
+import csv
+import time
+import zlib
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+
+from geo import EARTH_RADIUS_KM, geohash_prefix_range
+from matching import (DEFAULT_RADIUS_KM, DEFAULT_TIME_WINDOW_DAYS, DEFAULT_WEIGHTS, TIME_SLACK,
+                      UNKNOWN_BREEDS, UNKNOWN_GENDERS, color_chars, feature_tokens)
+from models import db, PetLostReport, PetFoundReport
+
+DEFAULT_BLOCK_SIZE = 512
+DEFAULT_FEATURE_DIMS = 256
+
+
+class _Codes:
+    """Maps category values to dense integer codes shared by the lost and found columns."""
+
+    def __init__(self, unknown=()):
+        self.codes = {}
+        self.unknown = set(unknown)
+
+    def __call__(self, value):
+        value = (value or '').strip()
+        if value in self.unknown:
+            return -1
+        return self.codes.setdefault(value, len(self.codes))
+
+
+class ReportColumns:
+    """Column-oriented view of one side (lost or found) of the matching problem."""
+
+    def __init__(self, rows, codes, color_vocab, feature_dims):
+        n = len(rows)
+        self.ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=n)
+        self.pet_type = np.fromiter((codes['pet_type'](row.pet_type) for row in rows), dtype=np.int32, count=n)
+        self.breed = np.fromiter((codes['breed'](row.breed) for row in rows), dtype=np.int32, count=n)
+        self.gender = np.fromiter((codes['gender'](row.gender) for row in rows), dtype=np.int32, count=n)
+        self.lat = np.array([np.nan if row.latitude is None else row.latitude for row in rows], dtype=np.float64)
+        self.lon = np.array([np.nan if row.longitude is None else row.longitude for row in rows], dtype=np.float64)
+        self.time = np.array([row.event_time.timestamp() for row in rows], dtype=np.float64)
+
+        # Set-valued attributes as 0/1 matrices: |A ∩ B| for every pair is then one matrix product
+        self.colors = np.zeros((n, len(color_vocab)), dtype=np.uint8)
+        self.features = np.zeros((n, feature_dims), dtype=np.uint8)
+        for i, row in enumerate(rows):
+            for ch in color_chars(row.color):
+                self.colors[i, color_vocab[ch]] = 1
+            for token in feature_tokens(row.features):
+                self.features[i, zlib.crc32(token.encode('utf-8')) % feature_dims] = 1
+        self.color_counts = self.colors.sum(axis=1, dtype=np.float32)
+        self.feature_counts = self.features.sum(axis=1, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _load_rows(model, time_column, area=None):
+    columns = [model.id, model.pet_type, model.breed, model.gender, model.color, model.features,
+               model.latitude, model.longitude, time_column.label('event_time')]
+    query = db.session.query(*columns)
+    if model is PetLostReport:
+        query = query.filter(PetLostReport.is_found == False)
+    if area:
+        low, high = geohash_prefix_range(area)
+        query = query.filter(model.geohash >= low)
+        if high:
+            query = query.filter(model.geohash < high)
+    return query.order_by(model.id).yield_per(2000).all()
+
+
+def load_columns(area=None, feature_dims=DEFAULT_FEATURE_DIMS):
+    """Load open lost reports and all found reports (optionally of one geohash area) as columns."""
+    lost_rows = _load_rows(PetLostReport, PetLostReport.lost_time, area)
+    found_rows = _load_rows(PetFoundReport, PetFoundReport.found_time, area)
+    codes = {'pet_type': _Codes(), 'breed': _Codes(UNKNOWN_BREEDS), 'gender': _Codes(UNKNOWN_GENDERS)}
+    color_vocab = {}
+    for row in lost_rows + found_rows:
+        for ch in color_chars(row.color):
+            color_vocab.setdefault(ch, len(color_vocab))
+    return (ReportColumns(lost_rows, codes, color_vocab, feature_dims),
+            ReportColumns(found_rows, codes, color_vocab, feature_dims))
+
+
+def _category_similarity(a, b):
+    """1 if equal, 0 if different, 0.5 if either code is unknown (-1)."""
+    unknown = (a < 0) | (b < 0)
+    return np.where(unknown, 0.5, (a == b).astype(np.float32))
+
+
+def _jaccard(a_matrix, a_counts, b_matrix, b_counts):
+    intersection = a_matrix.astype(np.float32) @ b_matrix.astype(np.float32).T
+    union = a_counts[:, None] + b_counts[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def score_block(lost, found, lost_slice, found_slice, weights, radius_km, window_days):
+    """
+    Pairwise scores for lost[lost_slice] x found[found_slice].
+
+    :return: (scores, distances) float arrays of shape (lost block, found block); pairs that are
+             not candidates (other pet type, outside the time window or radius) score -inf.
+    """
+    lt, ft = lost.pet_type[lost_slice, None], found.pet_type[None, found_slice]
+    distances = _haversine_km(lost.lat[lost_slice, None], lost.lon[lost_slice, None],
+                              found.lat[None, found_slice], found.lon[None, found_slice])
+    gap_days = (found.time[None, found_slice] - lost.time[lost_slice, None]) / 86400.0
+
+    with np.errstate(invalid='ignore'):  # NaN distances for reports without coordinates
+        distance_sim = np.where(np.isnan(distances), 0.5, np.clip(1.0 - distances / radius_km, 0.0, None))
+        # As in matching.find_candidates(): only a known distance beyond the radius excludes a pair;
+        # reports without coordinates are not restricted by distance (NaN > radius is False)
+        outside_radius = distances > radius_km
+    scores = (
+        weights['breed'] * _category_similarity(lost.breed[lost_slice, None], found.breed[None, found_slice])
+        + weights['color'] * _jaccard(lost.colors[lost_slice], lost.color_counts[lost_slice],
+                                      found.colors[found_slice], found.color_counts[found_slice])
+        + weights['gender'] * _category_similarity(lost.gender[lost_slice, None], found.gender[None, found_slice])
+        + weights['features'] * _jaccard(lost.features[lost_slice], lost.feature_counts[lost_slice],
+                                         found.features[found_slice], found.feature_counts[found_slice])
+        + weights['distance'] * distance_sim
+        + weights['time'] * np.clip(1.0 - np.maximum(gap_days, 0.0) / window_days, 0.0, None)
+    )
+    slack_days = TIME_SLACK.total_seconds() / 86400.0
+    candidate = (lt == ft) & (gap_days >= -slack_days) & (gap_days <= window_days) & ~outside_radius
+    return np.where(candidate, scores, -np.inf), distances
+
+
+def rank_matches(lost, found, top_k=5, weights=None, radius_km=DEFAULT_RADIUS_KM,
+                 window_days=DEFAULT_TIME_WINDOW_DAYS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Top-K found reports for every lost report, scored in blocks of block_size x (8 * block_size).
+
+    :return: iterator of (lost_id, rank, found_id, score, distance_km) rows, best first per lost report.
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    found_block = block_size * 8
+    for lost_start in range(0, len(lost), block_size):
+        lost_slice = slice(lost_start, min(lost_start + block_size, len(lost)))
+        rows = lost_slice.stop - lost_slice.start
+        best_scores = np.full((rows, top_k), -np.inf)
+        best_index = np.full((rows, top_k), -1, dtype=np.int64)
+        best_distance = np.full((rows, top_k), np.nan)
+
+        for found_start in range(0, len(found), found_block):
+            found_slice = slice(found_start, min(found_start + found_block, len(found)))
+            scores, distances = score_block(lost, found, lost_slice, found_slice, weights, radius_km, window_days)
+            # Merge this block into the running top-K of each lost row
+            all_scores = np.concatenate([best_scores, scores], axis=1)
+            all_index = np.concatenate(
+                [best_index, np.broadcast_to(np.arange(found_slice.start, found_slice.stop), scores.shape)], axis=1)
+            all_distance = np.concatenate([best_distance, distances], axis=1)
+            keep = np.argpartition(-all_scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(all_scores, keep, axis=1)
+            best_index = np.take_along_axis(all_index, keep, axis=1)
+            best_distance = np.take_along_axis(all_distance, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_index = np.take_along_axis(best_index, order, axis=1)
+        best_distance = np.take_along_axis(best_distance, order, axis=1)
+        for row in range(rows):
+            lost_id = int(lost.ids[lost_slice.start + row])
+            for rank in range(top_k):
+                if not np.isfinite(best_scores[row, rank]):
+                    break
+                distance = best_distance[row, rank]
+                yield (lost_id, rank + 1, int(found.ids[best_index[row, rank]]), float(best_scores[row, rank]),
+                       None if np.isnan(distance) else float(distance))
+
+
+# --- flask matches ... ---
+matches_cli = AppGroup('matches', help='批量匹配工具 (Batch matching tools).')
+
+
+def _parse_weights(values):
+    weights = {}
+    for value in values:
+        key, _, number = value.partition('=')
+        if key not in DEFAULT_WEIGHTS:
+            raise click.BadParameter(f'unknown weight {key!r}; expected one of {", ".join(DEFAULT_WEIGHTS)}')
+        try:
+            weights[key] = float(number)
+        except ValueError:
+            raise click.BadParameter(f'weight {key!r} needs a number, got {number!r}')
+    return weights
+
+
+@matches_cli.command('rescore')
+@click.option('--area', help='Only reports whose geohash starts with this prefix (e.g. yb4 for central Harbin).')
+@click.option('--top-k', default=5, show_default=True, help='Matches kept per lost report.')
+@click.option('--radius-km', type=float, help='Candidate radius (default: MATCH_RADIUS_KM).')
+@click.option('--window-days', type=int, help='Candidate time window (default: MATCH_TIME_WINDOW_DAYS).')
+@click.option('--weight', 'weight_overrides', multiple=True, metavar='NAME=VALUE',
+              help='Override a matching weight, e.g. --weight breed=0.3 (repeatable).')
+@click.option('--min-score', type=float, default=0.0, show_default=True, help='Drop matches below this score.')
+@click.option('--block-size', default=DEFAULT_BLOCK_SIZE, show_default=True, help='Lost reports scored per block.')
+@click.option('--feature-dims', default=DEFAULT_FEATURE_DIMS, show_default=True,
+              help='Hash buckets for description tokens.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='CSV file (default: stdout).')
+def rescore(area, top_k, radius_km, window_days, weight_overrides, min_score, block_size, feature_dims, output):
+    """Re-score every open lost report against all found reports and write a ranked match table."""
+    weights = _parse_weights(weight_overrides)
+    radius_km = radius_km or current_app.config.get('MATCH_RADIUS_KM', DEFAULT_RADIUS_KM)
+    window_days = window_days or current_app.config.get('MATCH_TIME_WINDOW_DAYS', DEFAULT_TIME_WINDOW_DAYS)
+
+    started = time.perf_counter()
+    lost, found = load_columns(area, feature_dims)
+    loaded = time.perf_counter()
+
+    writer = csv.writer(output)
+    writer.writerow(['lost_id', 'rank', 'found_id', 'score', 'distance_km'])
+    written = 0
+    for lost_id, rank, found_id, score, distance in rank_matches(
+            lost, found, top_k, weights, radius_km, window_days, block_size):
+        if score < min_score:
+            continue
+        writer.writerow([lost_id, rank, found_id, f'{score:.4f}', '' if distance is None else f'{distance:.3f}'])
+        written += 1
+    finished = time.perf_counter()
+    click.echo(f'{len(lost)} open lost x {len(found)} found reports: {written} matches written '
+               f'(load {loaded - started:.2f}s, score {finished - loaded:.2f}s)', err=True)
@@ -16,12 +16,81 @@ class Config:
     WECHAT_APPID = os.environ.get('WECHAT_APPID')
     WECHAT_APPSECRET = os.environ.get('WECHAT_APPSECRET')
     WECHAT_TOKEN = os.environ.get('WECHAT_TOKEN') or 'your_wechat_token_here' # Token for verifying server URL
+    APP_BASE_URL = os.environ.get('APP_BASE_URL') # e.g. 'https://hebpet.online'; links in WeChat replies (default: request host)
+    # 微信消息重试去重 (wechat.MessageDeduplicator)
+    WECHAT_DEDUP_TTL = 60 # Seconds a reply is remembered for WeChat's retries of the same message
+    WECHAT_DEDUP_MAX_ENTRIES = 4096 # Per process
+    WECHAT_REPLY_BUDGET = float(os.environ.get('WECHAT_REPLY_BUDGET') or 4.5) # Seconds; answer 'success' after this (WeChat waits 5)
+    WECHAT_HANDLER_THREADS = 8 # Handler pool per process
+    WECHAT_API_BASE = os.environ.get('WECHAT_API_BASE') or 'https://api.weixin.qq.com' # e.g. scripts/wechat_stub_server.py in dev
+    # access_token 由所有 worker 共享，只由一个 worker 刷新 (wechat_token.py): 'database', 'redis' or 'memory' (per process)
+    WECHAT_TOKEN_STORE = os.environ.get('WECHAT_TOKEN_STORE') or 'database'
+    WECHAT_TOKEN_STORE_URL = os.environ.get('WECHAT_TOKEN_STORE_URL') or os.environ.get('RESPONSE_CACHE_URL') or 'redis://localhost:6379/0' # For 'redis'
+
+    # --- 匹配通知: 微信模板消息 (notifications.py) ---
+    WECHAT_MATCH_TEMPLATE_ID = os.environ.get('WECHAT_MATCH_TEMPLATE_ID') # Fields first/keyword1-3/remark; unset disables notifications
+    # 'thread': sender thread in each web worker; 'external': only `flask notifications worker`; 'inline': synchronous
+    WECHAT_NOTIFY_MODE = os.environ.get('WECHAT_NOTIFY_MODE') or 'thread'
+    WECHAT_SEND_BATCH_SIZE = 50 # Notifications claimed (and committed) together
+    WECHAT_SEND_CONCURRENCY = 8 # Requests in flight per sender
+    WECHAT_SEND_RATE = float(os.environ.get('WECHAT_SEND_RATE') or 20) # Messages per second per sender
 
     # --- 添加上传文件夹配置 ---
-    UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/uploads')
+    # Served as /static/uploads; other folders (e.g. scripts/bench_http.py) are not reachable over HTTP
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/uploads')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'} # Allowed image extensions
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
 
+    # --- 启事列表分页 ---
+    REPORTS_PAGE_SIZE = int(os.environ.get('REPORTS_PAGE_SIZE') or 20)
+    REPORTS_MAX_PAGE_SIZE = 100 # Hard cap on ?limit= for /reports and /api/reports
+
+    # --- 自动匹配 (matching.py) ---
+    MATCH_RADIUS_KM = float(os.environ.get('MATCH_RADIUS_KM') or 10)
+    MATCH_TIME_WINDOW_DAYS = int(os.environ.get('MATCH_TIME_WINDOW_DAYS') or 60)
+    MATCH_TOP_K = 10
+    MATCH_MIN_SCORE = 0.6 # Matches below this score are not announced to the reporter
+
+    # --- 附近的启事 (geo.nearby) ---
+    NEARBY_DEFAULT_RADIUS_KM = 3
+    NEARBY_MAX_RADIUS_KM = 50
+
+    # --- 后台图片处理 (image_jobs.py) ---
+    # 'thread': runner thread in each web worker; 'external': only `flask images worker`; 'inline': synchronous
+    IMAGE_PROCESSING_MODE = os.environ.get('IMAGE_PROCESSING_MODE') or 'thread'
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 2) # Pillow processes per runner
+    # 列表页缩略图: 每张照片生成这些宽度的 WebP (+JPEG/PNG 兜底)，模板输出 srcset (见 images.py)
+    IMAGE_DERIVATIVE_WIDTHS = (160, 480, 1024)
+    IMAGE_DERIVATIVE_FORMATS = tuple(filter(None, (os.environ.get('IMAGE_DERIVATIVE_FORMATS') or 'webp').split(','))) # e.g. 'avif,webp'
+
+    # --- 列表/搜索响应缓存 (response_cache.py) ---
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or 'memory' # 'memory', 'redis' or 'none'
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL') or 'redis://localhost:6379/0' # For 'redis'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL') or 60) # Seconds; also bounds staleness across workers with 'memory'
+    RESPONSE_CACHE_MAX_ENTRIES = 512 # Per process, for 'memory'
+    RECENT_REPORTS_SIZE = 5 # Reports in the sidebar of the report forms (recent_reports.py)
+    RECENT_REPORTS_TTL = 300 # Seconds; bounds staleness of the sidebar across workers with 'memory'
+    UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600 # Seconds; upload and thumbnail names never change (uploads.py)
+
+    # --- 性能指标 (metrics.py) ---
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or '1') != '0' # Serve GET /metrics (Prometheus text format)
+    SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS') or 0.1) # Log statements slower than this, with their parameters
+
+    # --- 日志 (structured_logging.py) ---
+    LOG_ASYNC = (os.environ.get('LOG_ASYNC') or '1') != '0' # Write records from a listener thread, off the request path
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text' # 'text' or 'json' (one object per line)
+    LOG_QUEUE_SIZE = 10000 # Records waiting for the listener; further records are dropped, not waited for
+    # 高频事件只保留 1/n: 'wechat.message=10,image.processed=10'
+    LOG_SAMPLE_RATES = {event: int(n) for event, _, n in (item.partition('=') for item in
+                        (os.environ.get('LOG_SAMPLE_RATES') or 'wechat.message=10').split(',') if item)}
+
+    # --- SQLite 生产配置 (db_engines.py): WAL + 只读连接池; 仅用于 SQLite 文件库 ---
+    SQLITE_TUNING = (os.environ.get('SQLITE_TUNING') or '1') != '0'
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT') or 10) # Seconds a writer waits for the lock
+    SQLITE_CACHE_SIZE_KB = 20000 # Page cache per connection
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024 # Bytes of the file read through mmap
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE') or 8) # Read-only connections per process
+
     # Add other configurations as needed, e.g., image storage
 
     # --- 腾讯地图 API Key ---
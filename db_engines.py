@@ -0,0 +1,118 @@
+"""
+SQLite 生产配置 (SQLite engine profile: WAL, pragmas and a separate read pool).
+
+With the default rollback journal, a writer needs every reader of the file gone before it can
+commit, and readers wait for the writer: concurrent submissions from several gunicorn workers
+end in "database is locked". For a SQLite file database (SQLITE_TUNING, on by default):
+
+* every connection gets journal_mode=WAL (readers and the writer no longer block each other;
+  the mode is stored in the file), synchronous=NORMAL (fsync at checkpoints, not at every
+  commit - a power loss can drop the last transactions but not corrupt the file), busy_timeout
+  (a writer waits for the lock instead of failing), cache_size, mmap_size and temp_store;
+* a second engine, the 'read' bind, holds a pool of query_only connections. ReadWriteSession
+  sends a transaction's SELECTs there until it writes; from its first flush or DML statement on,
+  the whole transaction uses the writer, so it always reads its own changes.
+
+Transactions are begun explicitly on every SQLite engine: pysqlite on its own only sends BEGIN
+before INSERT/UPDATE/DELETE and none before a SAVEPOINT, whose RELEASE then commits everything
+(begin_nested() would not work). With the read pool, the writer begins with BEGIN IMMEDIATE - it
+only opens a transaction to write, and taking the lock up front lets busy_timeout wait for it
+instead of failing when a read snapshot would have to be upgraded.
+
+WAL needs all processes on one host (no network file systems) and leaves app.db-wal / app.db-shm
+next to the database file. In-memory databases are left alone.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+from flask_sqlalchemy.session import Session
+
+READ_BIND = 'read'
+DEFAULT_BUSY_TIMEOUT = 10 # Seconds
+DEFAULT_CACHE_SIZE_KB = 20000 # Per connection
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_READ_POOL_SIZE = 8
+
+
+class ReadWriteSession(Session):
+    """
+    Session sending plain SELECTs to the READ_BIND engine, when configured, until the
+    transaction writes; everything else (flushes, INSERT/UPDATE/DELETE, text SQL) goes to the
+    bound engine as usual.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get('wrote') and isinstance(clause, Select) \
+                and clause._for_update_arg is None:
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        self.info['wrote'] = True # This transaction uses the writer from now on
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(ReadWriteSession, 'after_transaction_end')
+def _reset_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
+
+
+def _is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+        and 'mode=memory' not in url.database
+
+
+def configure_sqlite(app):
+    """Before db.init_app(): add the READ_BIND engine for a SQLite file database (SQLITE_TUNING)."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not app.config.get('SQLITE_TUNING', True) or not _is_sqlite_file(uri):
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[READ_BIND] = {'url': uri, 'pool_size': app.config.get('SQLITE_READ_POOL_SIZE', DEFAULT_READ_POOL_SIZE)}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_sqlite(app, db):
+    """
+    After db.init_app(): begin transactions explicitly on the SQLite engines, and set the pragmas
+    on each new connection of the engines configure_sqlite() set up.
+    """
+    with app.app_context():
+        engines = db.engines
+        for key, engine in engines.items():
+            if engine.dialect.name == 'sqlite':
+                _explicit_transactions(engine, 'BEGIN IMMEDIATE' if key is None and READ_BIND in engines else 'BEGIN')
+        if READ_BIND not in engines:
+            return
+        pragmas = [
+            f"busy_timeout = {int(app.config.get('SQLITE_BUSY_TIMEOUT', DEFAULT_BUSY_TIMEOUT) * 1000)}",
+            'synchronous = NORMAL',
+            f"cache_size = -{int(app.config.get('SQLITE_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB))}", # Negative: KiB
+            f"mmap_size = {int(app.config.get('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE))}",
+            'temp_store = MEMORY',
+        ]
+        # Either engine may open the file first; journal_mode must come before query_only
+        _on_connect(engines[None], ['journal_mode = WAL', *pragmas])
+        _on_connect(engines[READ_BIND], ['journal_mode = WAL', *pragmas, 'query_only = ON'])
+
+
+def _on_connect(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(f'PRAGMA {pragma}')
+        finally:
+            cursor.close()
+
+
+def _explicit_transactions(engine, begin_statement):
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None # No implicit BEGIN/COMMIT from the driver
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql(begin_statement)
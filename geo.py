@@ -0,0 +1,150 @@
+"""
+地理计算工具 (Geographic helpers for radius queries).
+"""
+import math
+
+from sqlalchemy import and_, or_
+
+EARTH_RADIUS_KM = 6371.0088
+CANDIDATE_FACTOR = 2 # nearby(): rows fetched per result when ordering by the approximate distance in SQL
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two (lat, lon) points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Smallest lat/lon box containing the circle of radius_km around (lat, lon).
+
+    :return: (min_lat, max_lat, min_lon, max_lon). Near the poles the longitude span is the full range;
+             the box does not wrap at the antimeridian (irrelevant for our coverage area).
+    """
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, lat - d_lat), min(90.0, lat + d_lat)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6 or max_lat >= 90.0 or min_lat <= -90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    d_lon = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return min_lat, max_lat, lon - d_lon, lon + d_lon
+
+
+# --- Geohash ---
+# Reports store a precision-9 geohash (~5 m cells). A radius query picks the precision whose
+# cells are at least as large as the radius, so the 3x3 block of cells around the centre
+# covers the whole circle, and turns each cell into a string range on the indexed column.
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Encode a (lat, lon) point as a geohash string of the given length."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(lat_degrees, lon_degrees) spanned by one geohash cell of this precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_geohashes(lat, lon, radius_km):
+    """
+    Geohash prefixes whose cells together cover the circle of radius_km around (lat, lon).
+
+    :return: sorted list of distinct prefixes (the centre cell and its 8 neighbours).
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        d_lat, d_lon = geohash_cell_size(candidate)
+        if min(d_lat * _KM_PER_DEGREE, d_lon * _KM_PER_DEGREE * cos_lat) >= radius_km:
+            precision = candidate
+            break
+    d_lat, d_lon = geohash_cell_size(precision)
+    prefixes = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            cell_lat = min(90.0, max(-90.0, lat + dy * d_lat))
+            cell_lon = (lon + dx * d_lon + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(cell_lat, cell_lon, precision))
+    return sorted(prefixes)
+
+
+def geohash_prefix_range(prefix):
+    """
+    Half-open string range [low, high) containing every geohash that starts with prefix.
+
+    high is the next prefix in geohash order (None if there is none), which only uses lower-case
+    letters and digits so it compares the same under byte-wise and locale-aware collations.
+    """
+    chars = list(prefix)
+    while chars:
+        position = GEOHASH_ALPHABET.index(chars[-1])
+        if position + 1 < len(GEOHASH_ALPHABET):
+            chars[-1] = GEOHASH_ALPHABET[position + 1]
+            return prefix, ''.join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def geohash_clause(model, lat, lon, radius_km):
+    """WHERE clause selecting rows of `model` whose geohash lies in a cell covering the circle."""
+    ranges = []
+    for prefix in covering_geohashes(lat, lon, radius_km):
+        low, high = geohash_prefix_range(prefix)
+        ranges.append(and_(model.geohash >= low, model.geohash < high) if high else model.geohash >= low)
+    return or_(*ranges)
+
+
+def nearby(query, model, lat, lon, radius_km, limit=None):
+    """
+    Reports from `query` within radius_km of (lat, lon), nearest first.
+
+    Candidates are pruned through the indexed geohash column and the circle's bounding box, and
+    with a limit the database orders them by an equirectangular distance (squared degrees, the
+    longitude scaled by cos(lat)) and returns only the nearest CANDIDATE_FACTOR * limit; these are
+    refined with the exact haversine distance. At the largest radius the covering cells span a
+    whole city, so rows are neither loaded nor sorted in Python beyond those candidates.
+    :return: list of (report, distance_km) tuples.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    query = query.filter(geohash_clause(model, lat, lon, radius_km),
+                         model.latitude.between(min_lat, max_lat), model.longitude.between(min_lon, max_lon))
+    if limit:
+        cos_lat = math.cos(math.radians(lat))
+        # Within NEARBY_MAX_RADIUS_KM the approximation ranks like haversine except for near-ties
+        approximate = (model.latitude - lat) * (model.latitude - lat) + \
+            (model.longitude - lon) * cos_lat * (model.longitude - lon) * cos_lat
+        query = query.order_by(approximate, model.id).limit(CANDIDATE_FACTOR * limit)
+    results = []
+    for report in query:
+        distance_km = haversine_km(lat, lon, report.latitude, report.longitude)
+        if distance_km <= radius_km:
+            results.append((report, distance_km))
+    results.sort(key=lambda item: item[1])
+    return results[:limit] if limit else results
@@ -0,0 +1,379 @@
+"""
+后台图片处理队列 (Background image processing for uploaded photos).
+
+The upload routes only save the raw files and add one ImageJob row per photo in the same
+transaction as the report, so the form submit no longer waits for Pillow. A runner then
+claims jobs from the table and compresses them / writes their thumbnails (images.process_upload)
+in a process pool:
+
+* IMAGE_PROCESSING_MODE = 'thread'   - a runner thread is started lazily inside each web worker
+* IMAGE_PROCESSING_MODE = 'external' - jobs are only processed by `flask images worker`
+* IMAGE_PROCESSING_MODE = 'inline'   - jobs run synchronously right after the commit (tests/dev)
+
+Jobs are claimed with a conditional UPDATE, so several runners (gunicorn workers, external
+workers) can poll the same table without processing a job twice. A claimed job holds a lease
+until `available_at`; if its runner dies the lease expires and another runner picks it up.
+Failed jobs are retried with exponential backoff up to MAX_ATTEMPTS.
+
+Uploads are deduplicated by uploads.py: a job for a stored file that has already been processed
+just copies its derivatives, and a file is never claimed while another job is processing it.
+"""
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from PIL import UnidentifiedImageError
+
+from images import timed_process_upload, photo_filename, DERIVATIVE_WIDTHS, DERIVATIVE_FORMATS
+from metrics import observe_image_processing
+from models import db, ImageJob, StoredFile, PhotoHash, PetLostReport, PetFoundReport
+from perceptual_hash import hash_bands
+from uploads import delete_stored_file
+
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 10
+LEASE_SECONDS = 300
+POLL_SECONDS = 5
+
+REPORT_MODELS = {'lost': PetLostReport, 'found': PetFoundReport}
+# Retrying cannot fix a file that is missing or not an image
+PERMANENT_ERRORS = (UnidentifiedImageError, FileNotFoundError)
+
+
+def enqueue_image_jobs(report, report_type, filenames):
+    """
+    Queue compression of the saved upload files for `report` in the current session.
+
+    Stored files that were processed for an earlier upload get a job that is already done,
+    carrying their derivatives and perceptual hashes, so duplicates skip compression entirely.
+    The report must already be flushed (have an id); the caller commits report and jobs together.
+    """
+    processed = {filename: (variants, signature) for filename, variants, signature in db.session.execute(
+        db.select(StoredFile.filename, StoredFile.variants, StoredFile.signature)
+        .where(StoredFile.filename.in_(filenames), StoredFile.variants.isnot(None),
+               StoredFile.signature.isnot(None))).all()} if filenames else {}
+    for filename in filenames:
+        if filename in processed:
+            variants, signature = processed[filename]
+            db.session.add(ImageJob(report_type=report_type, report_id=report.id, filename=filename,
+                                    status=ImageJob.STATUS_DONE, variants=variants))
+            record_photo_hash(report_type, report.id, filename, json.loads(signature))
+        else:
+            db.session.add(ImageJob(report_type=report_type, report_id=report.id, filename=filename))
+    if processed:
+        report.photo_variants = {**report.photo_variants,
+                                 **{filename: json.loads(variants) for filename, (variants, _) in processed.items()}}
+    if any(filename not in processed for filename in filenames):
+        report.photos_processing = True
+
+
+def claim_jobs(limit):
+    """Atomically claim up to `limit` due jobs for this runner and return them."""
+    now = datetime.utcnow()
+    # Another job holds an unexpired lease on the same file (a duplicate upload being processed)
+    other = db.aliased(ImageJob)
+    file_busy = db.exists().where(other.filename == ImageJob.filename, other.id != ImageJob.id,
+                                  other.status == ImageJob.STATUS_RUNNING, other.available_at > now)
+    due = db.session.execute(
+        db.select(ImageJob.id, ImageJob.filename)
+        .where(ImageJob.status.in_([ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING]),
+               ImageJob.available_at <= now, ~file_busy)
+        .order_by(ImageJob.id).limit(limit)).all()
+    claimed, claimed_files = [], set()
+    for job_id, filename in due:
+        if filename in claimed_files:
+            continue # Left for after this batch, when it can reuse the derivatives
+        # Only one runner can win: the first UPDATE pushes available_at out to the lease expiry
+        result = db.session.execute(
+            db.update(ImageJob)
+            .where(ImageJob.id == job_id,
+                   ImageJob.status.in_([ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING]),
+                   ImageJob.available_at <= now, ~file_busy)
+            .values(status=ImageJob.STATUS_RUNNING, attempts=ImageJob.attempts + 1,
+                    available_at=now + timedelta(seconds=LEASE_SECONDS), updated_at=now))
+        if result.rowcount == 1:
+            claimed.append(job_id)
+            claimed_files.add(filename)
+    db.session.commit()
+    return [db.session.get(ImageJob, job_id) for job_id in claimed]
+
+
+def _stored_result(job):
+    """(variants, signature) of the job's file if a duplicate upload of it has been processed already."""
+    row = db.session.execute(
+        db.select(StoredFile.variants, StoredFile.signature).where(StoredFile.filename == job.filename)).first()
+    if row is None or not row.variants or not row.signature:
+        return None
+    return json.loads(row.variants), json.loads(row.signature)
+
+
+def record_photo_hash(report_type, report_id, filename, signature):
+    """Add the PhotoHash row of one report photo to the session, unless it already has one."""
+    exists = db.session.execute(db.select(PhotoHash.id).where(
+        PhotoHash.report_type == report_type, PhotoHash.report_id == report_id,
+        PhotoHash.filename == filename)).first()
+    if exists:
+        return
+    bands = hash_bands(signature['phash'])
+    db.session.add(PhotoHash(report_type=report_type, report_id=report_id, filename=filename,
+                             phash=signature['phash'], dhash=signature['dhash'], colors=signature['colors'],
+                             **{f'phash_band{band}': value for band, value in enumerate(bands)}))
+
+
+def finish_job(job_id, error=None, result=None):
+    """
+    Record the outcome of a claimed job, scheduling a retry for transient errors.
+
+    :param result: (variants, signature) returned by images.process_upload when there was no error.
+    """
+    job = db.session.get(ImageJob, job_id)
+    if job is None:
+        return
+    if error is None:
+        variants, signature = result
+        job.status = ImageJob.STATUS_DONE
+        job.last_error = None
+        job.variants = json.dumps(variants) if variants else None
+        db.session.execute(db.update(StoredFile).where(StoredFile.filename == job.filename)
+                           .values(variants=job.variants, signature=json.dumps(signature)))
+        record_photo_hash(job.report_type, job.report_id, job.filename, signature)
+    elif isinstance(error, PERMANENT_ERRORS) or job.attempts >= MAX_ATTEMPTS:
+        job.status = ImageJob.STATUS_FAILED
+        job.last_error = f'{type(error).__name__}: {error}'
+        current_app.logger.error(f"Image job {job.id} for {job.filename} failed after {job.attempts} attempt(s): {error}")
+    else:
+        job.status = ImageJob.STATUS_PENDING
+        job.last_error = f'{type(error).__name__}: {error}'
+        job.available_at = datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+        current_app.logger.warning('Image job %s for %s failed (attempt %d), will retry: %s', job.id, job.filename, job.attempts, error)
+    db.session.commit()
+    _refresh_report_state(job.report_type, job.report_id)
+
+
+def _refresh_report_state(report_type, report_id):
+    """
+    Copy the derivatives of the report's finished jobs onto the report, and clear its
+    photos_processing flag once none of its jobs are outstanding.
+
+    Rebuilt from all of the report's jobs each time, so runners finishing jobs of the same
+    report concurrently cannot lose each other's updates.
+    """
+    report = db.session.get(REPORT_MODELS[report_type], report_id)
+    if report is None:
+        return
+    jobs = db.session.execute(
+        db.select(ImageJob.filename, ImageJob.status, ImageJob.variants)
+        .where(ImageJob.report_type == report_type, ImageJob.report_id == report_id)).all()
+    report.photo_variants = {filename: json.loads(variants) for filename, status, variants in jobs
+                             if status == ImageJob.STATUS_DONE and variants}
+    report.photos_processing = any(status in (ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING)
+                                   for _, status, _ in jobs)
+    db.session.commit()
+
+
+def _job_path(job):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], job.filename)
+
+
+def _process_args(job):
+    """Picklable arguments for images.process_upload (pool workers have no app config)."""
+    return (_job_path(job),
+            tuple(current_app.config.get('IMAGE_DERIVATIVE_WIDTHS', DERIVATIVE_WIDTHS)),
+            tuple(current_app.config.get('IMAGE_DERIVATIVE_FORMATS', DERIVATIVE_FORMATS)))
+
+
+def run_pending_jobs(limit=None):
+    """Process due jobs synchronously in this process. Returns the number of jobs processed."""
+    processed = 0
+    while limit is None or processed < limit:
+        jobs = claim_jobs(1)
+        if not jobs:
+            break
+        job = jobs[0]
+        try:
+            result = _stored_result(job)
+            if result is None:
+                result, seconds = timed_process_upload(*_process_args(job))
+                observe_image_processing(seconds)
+        except Exception as e:
+            finish_job(job.id, e)
+        else:
+            finish_job(job.id, result=result)
+        processed += 1
+    return processed
+
+
+class ImageJobRunner:
+    """Polls the job table and compresses claimed photos in a process pool."""
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        self.max_workers = max_workers or app.config.get('IMAGE_WORKERS', 2)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def _new_pool(self):
+        # 'spawn' rather than fork: the web worker is multi-threaded and holds DB connections
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='image-job-runner', daemon=True)
+        self._thread.start()
+        return self
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run(self):
+        """Main loop; returns after stop() is called."""
+        self._pool = self._new_pool()
+        inflight = {}
+        with self.app.app_context():
+            try:
+                while not self._stop.is_set():
+                    free = self.max_workers - len(inflight)
+                    if free > 0:
+                        for job in claim_jobs(free):
+                            result = _stored_result(job)
+                            if result:
+                                finish_job(job.id, result=result)
+                            else:
+                                inflight[self._pool.submit(timed_process_upload, *_process_args(job))] = job.id
+                    if inflight:
+                        done, _ = wait(inflight, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            error = future.exception()
+                            result = None
+                            if error is None:
+                                result, seconds = future.result()
+                                observe_image_processing(seconds)
+                            finish_job(inflight.pop(future), error, result)
+                            if isinstance(error, BrokenProcessPool):
+                                # A worker process died (e.g. OOM on a huge image); start a fresh pool
+                                for other in list(inflight):
+                                    finish_job(inflight.pop(other), error)
+                                self._pool.shutdown(wait=False)
+                                self._pool = self._new_pool()
+                                break
+                    else:
+                        self._wake.wait(POLL_SECONDS)
+                        self._wake.clear()
+                    db.session.remove()
+            except Exception as e:
+                current_app.logger.error(f"Image job runner stopped unexpectedly: {e}", exc_info=True)
+            finally:
+                self._pool.shutdown(wait=True)
+
+
+_runner = None
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def _get_runner(app):
+    """The runner thread of this process, started on first use (and again after a fork)."""
+    global _runner, _runner_pid
+    with _runner_lock:
+        if _runner is None or _runner_pid != os.getpid() or not _runner.is_alive():
+            _runner = ImageJobRunner(app).start()
+            _runner_pid = os.getpid()
+        return _runner
+
+
+def dispatch_image_jobs():
+    """Hand newly committed jobs to whatever processes them under IMAGE_PROCESSING_MODE."""
+    mode = current_app.config.get('IMAGE_PROCESSING_MODE', 'thread')
+    if mode == 'inline':
+        run_pending_jobs()
+    elif mode == 'thread':
+        _get_runner(current_app._get_current_object()).wake()
+    # 'external': a `flask images worker` process polls the table
+
+
+# --- flask images ... ---
+images_cli = AppGroup('images', help='后台图片处理 (Background image processing).')
+
+
+@images_cli.command('worker')
+@click.option('--workers', type=int, help='Pool processes (default: IMAGE_WORKERS).')
+def worker(workers):
+    """Run an image job runner in the foreground until interrupted."""
+    runner = ImageJobRunner(current_app._get_current_object(), workers)
+    click.echo(f'Processing image jobs with {runner.max_workers} worker processes (Ctrl+C to stop)', err=True)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+@images_cli.command('process')
+def process():
+    """Process all currently due jobs in this process, then exit."""
+    click.echo(f'{run_pending_jobs()} image jobs processed', err=True)
+
+
+@images_cli.command('status')
+def status():
+    """Show job counts by status."""
+    rows = db.session.execute(db.select(ImageJob.status, db.func.count(ImageJob.id)).group_by(ImageJob.status)).all()
+    for job_status, count in sorted(rows):
+        click.echo(f'{job_status:8} {count}')
+
+
+@images_cli.command('retry-failed')
+def retry_failed():
+    """Put failed jobs back in the queue with a fresh attempt budget."""
+    result = db.session.execute(
+        db.update(ImageJob).where(ImageJob.status == ImageJob.STATUS_FAILED)
+        .values(status=ImageJob.STATUS_PENDING, attempts=0, available_at=datetime.utcnow()))
+    db.session.commit()
+    click.echo(f'{result.rowcount} failed jobs requeued', err=True)
+
+
+@images_cli.command('backfill')
+def backfill():
+    """Queue processing for stored photos that have no derivatives or perceptual hashes yet."""
+    queued = 0
+    for report_type, model in REPORT_MODELS.items():
+        known = {(report_id, filename) for report_id, filename in db.session.execute(
+            db.select(ImageJob.report_id, ImageJob.filename).where(
+                ImageJob.report_type == report_type,
+                ImageJob.status.in_([ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING]))).all()}
+        hashed = {(report_id, filename) for report_id, filename in db.session.execute(
+            db.select(PhotoHash.report_id, PhotoHash.filename).where(PhotoHash.report_type == report_type)).all()}
+        for report in db.session.execute(db.select(model).where(model._photo_urls.isnot(None))).scalars():
+            variants = report.photo_variants
+            filenames = [photo_filename(url) for url in report.photo_urls]
+            missing = [name for name in filenames
+                       if (name not in variants or (report.id, name) not in hashed) and (report.id, name) not in known]
+            if missing:
+                enqueue_image_jobs(report, report_type, missing)
+                queued += len(missing)
+    db.session.commit()
+    click.echo(f'{queued} image jobs queued; run `flask images worker` or `flask images process`', err=True)
+
+
+@images_cli.command('gc')
+def gc():
+    """Delete stored uploads (and their derivatives) that no report references any more."""
+    unreferenced = db.session.execute(db.select(StoredFile).where(StoredFile.refcount <= 0)).scalars().all()
+    for stored in unreferenced:
+        delete_stored_file(stored)
+    db.session.commit()
+    click.echo(f'{len(unreferenced)} unreferenced stored files deleted', err=True)
@@ -0,0 +1,244 @@
+"""
+图片处理 (Uploaded image compression and thumbnail derivatives).
+
+Every upload is compressed in place to at most 1024px wide, then downscaled copies are written
+next to it for each width in DERIVATIVE_WIDTHS: a WebP (and optionally AVIF) file plus a
+JPEG/PNG fallback. Templates turn them into <picture>/srcset markup via photo_sources(), so the
+list page fetches ~160px thumbnails instead of the full-size files.
+
+Kept free of Flask app/model imports so that process-pool workers (image_jobs.py) can import
+and run it without building the whole application.
+"""
+import logging
+import math
+import os
+import posixpath
+import time
+
+from flask import current_app, has_app_context, url_for
+from PIL import Image, ImageOps
+
+from perceptual_hash import image_signature
+
+DERIVATIVE_WIDTHS = (160, 480, 1024)
+# Modern formats written in addition to the JPEG/PNG fallback, best first ('avif' is slow to encode)
+DERIVATIVE_FORMATS = ('webp',)
+DERIVATIVE_QUALITY = 80
+FORMAT_EXTENSIONS = {'webp': '.webp', 'avif': '.avif', 'JPEG': '.jpg', 'PNG': '.png'}
+
+EXIF_ORIENTATION = 0x0112
+# EXIF orientations 5-8 rotate the picture by 90 degrees: the stored width is the displayed height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _logger():
+    # Inside the web app log through app.logger (queued, see structured_logging.py); in pool workers use a plain logger
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def open_image(image_path, max_width=None):
+    """
+    Open an upload upright (EXIF orientation applied), ready to be resized to max_width.
+
+    For JPEGs, Image.draft() makes libjpeg decode at 1/2, 1/4 or 1/8 scale (DCT scaling) to the
+    smallest size still at least max_width wide, instead of decoding every pixel of a phone photo
+    only to throw most of them away in the resize. PNG/GIF/WebP are decoded in full.
+    :param max_width: None decodes at full size.
+    :return: (image, format of the file) - the transposed image no longer carries .format itself.
+    """
+    img = Image.open(image_path)
+    original_format = img.format
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    if max_width and original_format == 'JPEG':
+        width, height = img.size
+        display_width = height if orientation in TRANSPOSED_ORIENTATIONS else width
+        if display_width > max_width:
+            scale = max_width / display_width
+            img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+    return img, original_format
+
+
+def compress_image_file(image_path, max_width=1024, quality_jpeg=85, fast_decode=True):
+    """
+    Resizes the image to at most max_width and re-saves it with format-appropriate quality,
+    overwriting the original file. Raises on failure.
+
+    :param fast_decode: Use reduced-size JPEG decoding (see open_image); False decodes in full.
+    :return: dict of the save parameters used.
+    """
+    img, original_format = open_image(image_path, max_width if fast_decode else None)
+    img, save_params = _compress(img, original_format, image_path, max_width, quality_jpeg)
+    img.save(image_path, **save_params)
+    _logger().debug('Compressed and saved image %s with parameters: %s', image_path, save_params)
+    return save_params
+
+
+def _compress(img, original_format, image_path, max_width, quality_jpeg):
+    """The resized image and the save parameters compress_image_file() writes it with."""
+    logger = _logger()
+
+    # Ensure image is in a mode that supports saving (e.g., convert P mode with palette to RGBA)
+    if img.mode == 'P': # Palette mode
+        img = img.convert("RGBA")
+    elif img.mode == 'LA': # Luminance Alpha
+         img = img.convert("RGBA")
+    elif img.mode not in ("RGB", "RGBA", "L"): # L is grayscale
+        logger.warning('Image %s has an unsupported mode %s for direct saving, attempting conversion to RGBA.', image_path, img.mode)
+        img = img.convert("RGBA")
+        original_format = 'PNG' # After conversion to RGBA, PNG is a safer bet for saving
+
+    current_width, current_height = img.size
+    if current_width > max_width:
+        ratio = max_width / current_width
+        new_height = int(current_height * ratio)
+        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+        logger.debug('Resized image %s from %dx%d to %dx%d', image_path, current_width, current_height, max_width, new_height)
+
+    save_params = {}
+    fmt = original_format.upper() if original_format else ''
+
+    if fmt in ['JPEG', 'JPG']:
+        save_params['format'] = 'JPEG'
+        save_params['quality'] = quality_jpeg
+        save_params['optimize'] = True
+    elif fmt == 'PNG':
+        save_params['format'] = 'PNG'
+        save_params['optimize'] = True
+    elif fmt == 'GIF':
+        save_params['format'] = 'GIF'
+    elif fmt == 'WEBP':
+        save_params['format'] = 'WEBP'
+        save_params['quality'] = quality_jpeg
+    else:
+        if img.mode == "RGBA" and fmt not in ['PNG', 'WEBP']:
+             logger.warning('Image %s (format: %s, mode: %s) was likely converted or is unhandled; saving as PNG.', image_path, fmt, img.mode)
+             save_params['format'] = 'PNG'
+             save_params['optimize'] = True
+        elif fmt:
+            save_params['format'] = original_format
+            logger.info("Image %s format '%s' not explicitly handled for quality/optimization, saving with original format.", image_path, fmt)
+        else:
+            logger.warning('Image %s has unknown format. Saving as PNG as a fallback.', image_path)
+            save_params['format'] = 'PNG'
+            save_params['optimize'] = True
+
+    if save_params.get('format') == 'JPEG' and img.mode == 'RGBA':
+        img = img.convert('RGB')
+        logger.debug('Converted RGBA image %s to RGB for JPEG saving.', image_path)
+
+    return img, save_params
+
+
+def derivative_filename(filename, width, extension):
+    """'20250501_ab12.jpg', 160, '.webp' -> '20250501_ab12_w160.webp'"""
+    stem, _ = os.path.splitext(filename)
+    return f'{stem}_w{width}{extension}'
+
+
+def process_upload(image_path, widths=DERIVATIVE_WIDTHS, formats=DERIVATIVE_FORMATS, quality=DERIVATIVE_QUALITY,
+                   quality_jpeg=85, fast_decode=True):
+    """
+    Compress an upload in place to max(widths), write its downscaled derivatives next to it and
+    compute its perceptual signature from the same decoded image. Raises on failure (used
+    directly by background jobs).
+
+    Widths larger than the image collapse into one entry at its native width, whose fallback is
+    the compressed original itself. Each smaller width is resized from the next larger one.
+    The compressed original replaces the upload only once everything else has been written, so a
+    failed attempt leaves the upload untouched and its retry does not compress it a second time.
+    :return: (variants, signature), both JSON-ready.
+             variants: {str(pixel width): {'fallback': filename, <format>: filename, ...}} with
+             filenames relative to the directory of image_path;
+             signature: perceptual_hash.image_signature() of the photo.
+    """
+    max_width = max(widths)
+    img, original_format = open_image(image_path, max_width if fast_decode else None)
+    img, save_params = _compress(img, original_format, image_path, max_width, quality_jpeg)
+    compressed_path = image_path + '.compressed'
+    try:
+        img.save(compressed_path, **save_params)
+
+        folder, filename = os.path.split(image_path)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        fallback_format = 'PNG' if has_alpha else 'JPEG'
+        variants = {}
+        frame = img
+        for width in sorted({min(width, img.width) for width in widths}, reverse=True):
+            if width < frame.width:
+                frame = frame.resize((width, max(1, round(frame.height * width / frame.width))), Image.Resampling.LANCZOS)
+            entry = {}
+            if frame is img:
+                entry['fallback'] = filename
+            else:
+                fallback = frame if has_alpha or frame.mode in ('RGB', 'L') else frame.convert('RGB')
+                entry['fallback'] = derivative_filename(filename, width, FORMAT_EXTENSIONS[fallback_format])
+                fallback.save(os.path.join(folder, entry['fallback']), format=fallback_format,
+                              **({'quality': quality, 'optimize': True} if fallback_format == 'JPEG' else {'optimize': True}))
+            for fmt in formats:
+                entry[fmt] = derivative_filename(filename, width, FORMAT_EXTENSIONS[fmt])
+                frame.save(os.path.join(folder, entry[fmt]), format=fmt.upper(), quality=quality)
+            variants[str(width)] = entry
+        signature = image_signature(img)
+        os.replace(compressed_path, image_path)
+    except BaseException:
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+    _logger().info('Processed image %s: %d sizes, formats %s', image_path, len(variants), ', '.join(formats) or 'none',
+                   extra={'sample': 'image.processed'})
+    return variants, signature
+
+
+def timed_process_upload(*args, **kwargs):
+    """process_upload() plus the seconds it took, measured inside the pool worker: ((variants, signature), seconds)."""
+    started = time.perf_counter()
+    result = process_upload(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def photo_filename(photo_url):
+    """
+    Upload filename (relative to UPLOAD_FOLDER) of a report's photo entry. Entries are filenames;
+    databases not yet upgraded past migration b5e82f4d1c36 still hold URLs ('/static/uploads/<filename>'
+    for lost reports, the full external URL for found reports), which are accepted too.
+    """
+    return photo_url.split('/uploads/', 1)[1] if '/uploads/' in photo_url else photo_url
+
+
+def photo_sources(report):
+    """
+    Template helper: one dict per photo of `report` for <picture> markup.
+
+    Keys: href (full-size file), src (smallest fallback), srcset (fallback widths) and sources,
+    a list of (mime type, srcset) for the modern formats. Photos whose derivatives are not ready
+    yet only get href/src pointing at the original.
+    """
+    variants_by_photo = report.photo_variants
+    photos = []
+    for photo_url in report.photo_urls:
+        filename = photo_filename(photo_url)
+        href = url_for('static', filename=f'uploads/{filename}')
+        variants = variants_by_photo.get(filename)
+        if not variants:
+            photos.append({'href': href, 'src': href, 'srcset': None, 'sources': []})
+            continue
+        folder = posixpath.dirname(filename)
+        smallest = variants[min(variants, key=int)]
+        photos.append({
+            'href': href,
+            'src': _upload_url(folder, smallest['fallback']),
+            'srcset': _srcset(folder, variants, 'fallback'),
+            'sources': [(f'image/{fmt}', _srcset(folder, variants, fmt)) for fmt in ('avif', 'webp') if fmt in smallest],
+        })
+    return photos
+
+
+def _upload_url(folder, name):
+    return url_for('static', filename=posixpath.join('uploads', folder, name))
+
+
+def _srcset(folder, variants, kind):
+    return ', '.join(f'{_upload_url(folder, variants[width][kind])} {width}w'
+                     for width in sorted(variants, key=int) if kind in variants[width])
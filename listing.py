@@ -0,0 +1,156 @@
+"""
+启事列表查询 (Report listing queries).
+
+Builds the filtered lost/found queries used by the H5 list page and the JSON API,
+and pages through them with keyset pagination on (created_at, id) so that the
+cost of a page does not depend on how deep into the list the user has scrolled.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import db, PetLostReport, PetFoundReport, ReportVersion
+from search import fulltext_clause
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Every query parameter a list response depends on (response_cache.py keys on exactly these)
+LIST_QUERY_PARAMS = ('report_type', 'pet_type', 'location', 'color', 'status', 'lost_cursor', 'found_cursor', 'limit')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client supplies a cursor we did not issue."""
+
+
+def encode_cursor(report):
+    """Encode the (created_at, id) position of a report as an opaque URL-safe token."""
+    payload = json.dumps([report.created_at.isoformat(), report.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor() back into (created_at, id)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at_str, report_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at_str), int(report_id)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def clamp_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse a client-supplied page size, falling back to the default and capping at maximum."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def build_lost_query(search_params, report_type='all'):
+    """Filtered PetLostReport query for the given search params (no ordering applied)."""
+    query = PetLostReport.query
+    status_filter = search_params.get('status')  # '', 'lost', 'found'
+    if status_filter == 'lost':
+        query = query.filter(PetLostReport.is_found == False)
+    elif status_filter == 'found':
+        query = query.filter(PetLostReport.is_found == True)
+    elif report_type == 'lost':
+        # 只查看寻宠启事且未指定状态时，默认只显示仍在寻找中的
+        query = query.filter(PetLostReport.is_found == False)
+
+    pet_type = search_params.get('pet_type')
+    location_query = search_params.get('location')
+    color = search_params.get('color')
+    if pet_type:
+        query = query.filter(PetLostReport.pet_type == pet_type)
+    if location_query:
+        location_clause = fulltext_clause(PetLostReport, location_query, field='search_location')
+        if location_clause is not None:
+            query = query.filter(location_clause)
+    if color:
+        query = query.filter(PetLostReport.color.ilike(f'%{color}%'))
+    return query
+
+
+def build_found_query(search_params):
+    """Filtered PetFoundReport query for the given search params (no ordering applied)."""
+    query = PetFoundReport.query
+    pet_type = search_params.get('pet_type')
+    location_query = search_params.get('location')
+    color = search_params.get('color')
+    if pet_type:
+        query = query.filter(PetFoundReport.pet_type == pet_type)
+    if location_query:
+        location_clause = fulltext_clause(PetFoundReport, location_query, field='search_location')
+        if location_clause is not None:
+            query = query.filter(location_clause)
+    if color:
+        query = query.filter(PetFoundReport.color.ilike(f'%{color}%'))
+    # 'status' filter typically doesn't apply to found_reports in the same way
+    return query
+
+
+def keyset_query(query, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Apply keyset ordering/limit to `query`: (created_at desc, id desc), starting after `cursor`.
+
+    Fetches limit + 1 rows so the caller can tell whether another page exists without a COUNT(*).
+    """
+    if cursor:
+        created_at, report_id = decode_cursor(cursor)
+        # Row-value comparison lets SQLite/PostgreSQL seek straight into the (…, created_at, id) index
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, report_id))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def keyset_page(query, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of `query` ordered by (created_at desc, id desc).
+
+    :param cursor: Token from a previous page's next_cursor, or None for the first page.
+    :return: (items, next_cursor); next_cursor is None on the last page.
+    """
+    rows = keyset_query(query, model, cursor=cursor, limit=limit).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def fetch_report_pages(search_params, report_type='all', limit=DEFAULT_PAGE_SIZE):
+    """
+    Fetch the current page of lost and/or found reports for a list request.
+
+    Each report type pages independently using the `lost_cursor` / `found_cursor` params.
+    :return: dict with 'lost' and 'found' keys, each (items, next_cursor).
+    """
+    pages = {'lost': ([], None), 'found': ([], None)}
+    if report_type in ('lost', 'all'):
+        pages['lost'] = keyset_page(build_lost_query(search_params, report_type), PetLostReport,
+                                    cursor=search_params.get('lost_cursor'), limit=limit)
+    if report_type in ('found', 'all'):
+        pages['found'] = keyset_page(build_found_query(search_params), PetFoundReport,
+                                     cursor=search_params.get('found_cursor'), limit=limit)
+    return pages
+
+
+def report_version(report_type='all'):
+    """
+    Cheap version of the report tables a list response is built from: the ReportVersion rows
+    (a primary-key read), bumped by every committed insert, update or deletion of a report.
+    Any change to a table changes the version of all its listings, filtered or not.
+    :return: (token string, time of the latest change or None)
+    """
+    report_types = [key for key in ('lost', 'found') if report_type in (key, 'all')]
+    rows = db.session.execute(db.select(ReportVersion.report_type, ReportVersion.version, ReportVersion.updated_at)
+                              .where(ReportVersion.report_type.in_(report_types))).all()
+    versions = {key: (version, updated_at) for key, version, updated_at in rows}
+    parts, last_modified = [], None
+    for key in report_types:
+        version, updated_at = versions.get(key, (0, None))
+        parts.append(f'{key}:{version}')
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    return ';'.join(parts), last_modified
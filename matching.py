@@ -0,0 +1,246 @@
+"""
+寻宠/招领自动匹配 (Lost <-> found report matching).
+
+For a new lost (found) report, candidate found (lost) reports are retrieved through the
+(pet_type, found_time) / (pet_type, is_found, lost_time) indexes within a time window, nearest in
+time first, and a lat/lon bounding box (reports without coordinates are kept), then scored on
+breed, color, gender, description text, distance and time gap. Only the bounded candidate set is scored, never the whole opposite table.
+
+find_similar_photos() matches on the photos instead: near-identical pictures are looked up
+through the perceptual hash band indexes (see perceptual_hash.py).
+"""
+import heapq
+import itertools
+from collections import namedtuple
+from datetime import timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, or_
+
+from geo import bounding_box, haversine_km
+from models import db, PetLostReport, PetFoundReport, PhotoHash
+from perceptual_hash import (PHASH_BANDS, HASH_BITS, band_neighbours, color_similarity as photo_color_similarity,
+                             hamming, hash_bands)
+from segmenter import segment
+
+DEFAULT_RADIUS_KM = 10.0
+DEFAULT_TIME_WINDOW_DAYS = 60
+# A found report may be filed a little before the owner gets round to filing the lost report
+TIME_SLACK = timedelta(days=1)
+DEFAULT_TOP_K = 10
+MAX_CANDIDATES = 500
+
+# Weights of each similarity component; they sum to 1 so scores fall in [0, 1]
+DEFAULT_WEIGHTS = {
+    'breed': 0.20,
+    'color': 0.20,
+    'gender': 0.10,
+    'features': 0.20,
+    'distance': 0.20,
+    'time': 0.10,
+}
+
+UNKNOWN_BREEDS = {'', '其他品种', '未知', '不确定'}
+UNKNOWN_GENDERS = {'', '未知', '不确定'}
+COLOR_IGNORED_CHARS = set('色 ，,、')
+
+Match = namedtuple('Match', ['report', 'score', 'distance_km', 'components'])
+
+# --- 照片相似度 (perceptual_hash.py) ---
+DEFAULT_PHOTO_DISTANCE = 10 # Max pHash Hamming distance (of 64 bits) for two photos to count as similar
+MAX_PHOTO_DISTANCE = 15 # Bounds the per-band probe lists: 4 bands x 697 values at radius 3
+PHOTO_WEIGHTS = {'phash': 0.6, 'dhash': 0.2, 'colors': 0.2}
+
+PhotoMatch = namedtuple('PhotoMatch', ['report', 'photo', 'matched_photo', 'distance', 'score'])
+
+
+def _config(key, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+def feature_tokens(text):
+    """Set of segmenter tokens in a description, compared with Jaccard similarity."""
+    return set(segment(text).split())
+
+
+def color_chars(color):
+    """Set of hue characters in a color description ("橘白色" -> {"橘", "白"})."""
+    return {ch for ch in (color or '') if ch not in COLOR_IGNORED_CHARS}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def breed_similarity(breed_a, breed_b):
+    """1 for the same breed, 0 for different known breeds, 0.5 if either side is unknown."""
+    a, b = (breed_a or '').strip(), (breed_b or '').strip()
+    if a in UNKNOWN_BREEDS or b in UNKNOWN_BREEDS:
+        return 0.5
+    return 1.0 if a == b else 0.0
+
+
+def color_similarity(color_a, color_b):
+    """Character overlap of the color descriptions ("橘白" vs "白橘色" share both hues)."""
+    return _jaccard(color_chars(color_a), color_chars(color_b))
+
+
+def gender_similarity(gender_a, gender_b):
+    a, b = (gender_a or '').strip(), (gender_b or '').strip()
+    if a in UNKNOWN_GENDERS or b in UNKNOWN_GENDERS:
+        return 0.5
+    return 1.0 if a == b else 0.0
+
+
+def distance_similarity(distance_km, radius_km):
+    """Linear decay from 1 at the same spot to 0 at the search radius; 0.5 if unknown."""
+    if distance_km is None:
+        return 0.5
+    return max(0.0, 1.0 - distance_km / radius_km)
+
+
+def time_similarity(lost_time, found_time, window_days):
+    """Linear decay with the lost -> found gap; a found time before the lost time scores as gap 0."""
+    if not lost_time or not found_time:
+        return 0.5
+    gap_days = max(0.0, (found_time - lost_time).total_seconds() / 86400)
+    return max(0.0, 1.0 - gap_days / window_days)
+
+
+def score_pair(lost, found, radius_km=DEFAULT_RADIUS_KM, window_days=DEFAULT_TIME_WINDOW_DAYS,
+               weights=None, lost_tokens=None, found_tokens=None):
+    """
+    Score one lost/found pair.
+
+    :return: (score, distance_km, components) where components maps each weight key to its similarity.
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    distance_km = None
+    if None not in (lost.latitude, lost.longitude, found.latitude, found.longitude):
+        distance_km = haversine_km(lost.latitude, lost.longitude, found.latitude, found.longitude)
+    components = {
+        'breed': breed_similarity(lost.breed, found.breed),
+        'color': color_similarity(lost.color, found.color),
+        'gender': gender_similarity(lost.gender, found.gender),
+        'features': _jaccard(lost_tokens if lost_tokens is not None else feature_tokens(lost.features),
+                             found_tokens if found_tokens is not None else feature_tokens(found.features)),
+        'distance': distance_similarity(distance_km, radius_km),
+        'time': time_similarity(lost.lost_time, found.found_time, window_days),
+    }
+    score = sum(weights[key] * value for key, value in components.items())
+    return score, distance_km, components
+
+
+def find_candidates(report, radius_km=DEFAULT_RADIUS_KM, window_days=DEFAULT_TIME_WINDOW_DAYS):
+    """
+    Opposite-type reports that could match `report`, closest in time first: up to MAX_CANDIDATES.
+
+    The time window is read outwards from the report's own time, as two index-ordered queries -
+    the candidates before it (descending) and after it (ascending) - merged on the absolute time
+    gap, so the cap keeps the candidates nearest in time on either side. Candidates without
+    coordinates are kept (their distance scores as unknown); with coordinates they must lie in
+    the bounding box of the search radius.
+    """
+    window = timedelta(days=window_days)
+    if isinstance(report, PetLostReport):
+        model, column, pivot = PetFoundReport, PetFoundReport.found_time, report.lost_time
+        earliest, latest = pivot - TIME_SLACK, pivot + window
+        query = PetFoundReport.query.filter(PetFoundReport.pet_type == report.pet_type)
+    else:
+        model, column, pivot = PetLostReport, PetLostReport.lost_time, report.found_time
+        earliest, latest = pivot - window, pivot + TIME_SLACK
+        query = PetLostReport.query.filter(PetLostReport.pet_type == report.pet_type, PetLostReport.is_found == False)
+
+    if report.latitude is not None and report.longitude is not None:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(report.latitude, report.longitude, radius_km)
+        query = query.filter(or_(and_(model.latitude.between(min_lat, max_lat), model.longitude.between(min_lon, max_lon)),
+                                 model.latitude.is_(None), model.longitude.is_(None)))
+    before = query.filter(column >= earliest, column < pivot).order_by(column.desc()).limit(MAX_CANDIDATES)
+    after = query.filter(column >= pivot, column <= latest).order_by(column).limit(MAX_CANDIDATES)
+    time_of = (lambda candidate: candidate.found_time) if model is PetFoundReport else (lambda candidate: candidate.lost_time)
+    merged = heapq.merge(before, after, key=lambda candidate: abs(time_of(candidate) - pivot))
+    return list(itertools.islice(merged, MAX_CANDIDATES))
+
+
+def find_matches(report, top_k=None, radius_km=None, window_days=None, weights=None):
+    """
+    Rank the opposite-type reports most likely to be the same pet as `report`.
+
+    :param report: A PetLostReport or PetFoundReport (must have pet_type and lost_time/found_time).
+    :return: up to top_k Match tuples, best first. Candidates outside radius_km are dropped.
+    """
+    top_k = top_k or _config('MATCH_TOP_K', DEFAULT_TOP_K)
+    radius_km = radius_km or _config('MATCH_RADIUS_KM', DEFAULT_RADIUS_KM)
+    window_days = window_days or _config('MATCH_TIME_WINDOW_DAYS', DEFAULT_TIME_WINDOW_DAYS)
+
+    report_tokens = feature_tokens(report.features)
+    is_lost = isinstance(report, PetLostReport)
+    matches = []
+    for candidate in find_candidates(report, radius_km, window_days):
+        lost, found = (report, candidate) if is_lost else (candidate, report)
+        candidate_tokens = feature_tokens(candidate.features)
+        score, distance_km, components = score_pair(
+            lost, found, radius_km, window_days, weights,
+            lost_tokens=report_tokens if is_lost else candidate_tokens,
+            found_tokens=candidate_tokens if is_lost else report_tokens)
+        if distance_km is not None and distance_km > radius_km:
+            continue  # inside the bounding box but outside the circle
+        matches.append(Match(candidate, score, distance_km, components))
+    return heapq.nlargest(top_k, matches, key=lambda match: match.score)
+
+
+def similar_photo_candidates(report_type, phash, max_distance):
+    """
+    Multi-index hashing lookup: PhotoHash rows of report_type that may lie within max_distance of phash.
+
+    Every band is probed with all values within max_distance // PHASH_BANDS bits of the query's
+    band through its (report_type, phash_bandN) index; by the pigeonhole principle this returns
+    every row within max_distance (plus some farther ones, filtered by the caller).
+    """
+    radius = max_distance // PHASH_BANDS
+    # report_type is repeated in every branch so that SQLite plans a MULTI-INDEX OR over the band indexes
+    clauses = [and_(PhotoHash.report_type == report_type,
+                    getattr(PhotoHash, f'phash_band{band}').in_(band_neighbours(value, radius)))
+               for band, value in enumerate(hash_bands(phash))]
+    return db.session.execute(db.select(PhotoHash).where(or_(*clauses))).scalars()
+
+
+def find_similar_photos(report, max_distance=DEFAULT_PHOTO_DISTANCE, limit=DEFAULT_TOP_K):
+    """
+    Opposite-type reports with photos visually similar to any photo of `report`.
+
+    Candidates come from the pHash band indexes (sublinear in the number of stored photos), are
+    filtered on the exact pHash Hamming distance, and ranked by PHOTO_WEIGHTS over the pHash,
+    dHash and color signature similarities. Lost reports already marked found are skipped.
+    This finds the same or near-identical pictures (reposts, crops, recompressions) of a pet,
+    not arbitrary photos of a similar-looking one.
+    :return: up to `limit` PhotoMatch tuples, best first, one per report.
+    """
+    max_distance = min(max_distance, MAX_PHOTO_DISTANCE)
+    is_lost = isinstance(report, PetLostReport)
+    report_type, target_type, target_model = ('lost', 'found', PetFoundReport) if is_lost else ('found', 'lost', PetLostReport)
+    probes = db.session.execute(db.select(PhotoHash).where(
+        PhotoHash.report_type == report_type, PhotoHash.report_id == report.id)).scalars().all()
+
+    best = {} # target report id -> (score, distance, probe photo, matched photo)
+    for probe in probes:
+        for candidate in similar_photo_candidates(target_type, probe.phash, max_distance):
+            distance = hamming(probe.phash, candidate.phash)
+            if distance > max_distance:
+                continue
+            score = (PHOTO_WEIGHTS['phash'] * (1 - distance / HASH_BITS)
+                     + PHOTO_WEIGHTS['dhash'] * (1 - hamming(probe.dhash, candidate.dhash) / HASH_BITS)
+                     + PHOTO_WEIGHTS['colors'] * photo_color_similarity(probe.colors, candidate.colors))
+            if candidate.report_id not in best or score > best[candidate.report_id][0]:
+                best[candidate.report_id] = (score, distance, probe.filename, candidate.filename)
+
+    if not best:
+        return []
+    reports = target_model.query.filter(target_model.id.in_(best))
+    if target_model is PetLostReport:
+        reports = reports.filter(PetLostReport.is_found == False)
+    matches = [PhotoMatch(target, best[target.id][2], best[target.id][3], best[target.id][1], best[target.id][0])
+               for target in reports]
+    return heapq.nlargest(limit, matches, key=lambda match: match.score)
@@ -0,0 +1,296 @@
+"""
+性能指标 (Request-level performance metrics).
+
+init_metrics(app) records, per process:
+
+* http_request_duration_seconds{endpoint,method,status} - latency of every request (histogram);
+* http_request_db_queries{endpoint} / http_request_db_seconds{endpoint} - number of SQL
+  statements a request issued and the time spent in them, from SQLAlchemy engine events;
+* db_query_duration_seconds - latency of every statement, including those of background
+  threads; statements slower than SLOW_QUERY_SECONDS are logged with their bound parameters
+  and counted in db_slow_queries_total;
+* image_processing_seconds - Pillow time per photo in the image job pool (image_jobs.py);
+* counters kept by other components: response cache hits/misses, WeChat retries answered from
+  the dedup cache, access_token refreshes, log records dropped by the log queue.
+
+GET /metrics serves them in the Prometheus text format (METRICS_ENABLED). Each gunicorn worker
+keeps its own numbers and a scrape reaches one worker; restrict the endpoint at the proxy.
+
+In tests, count_queries() asserts how many statements a block (e.g. a test client request) runs:
+
+    with count_queries() as queries:
+        client.get('/reports')
+    assert queries.count <= 3, queries.statements
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_QUERY_SECONDS = 0.1
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+IMAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+MAX_LOGGED_PARAMS = 500 # Characters of bound parameters in the slow query log
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.type = 'counter'
+        self.labelnames = labelnames
+        self._values = {} # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = 'histogram'
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [count per bucket (non-cumulative) ..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            all_series = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(all_series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': str(bound)}, cumulative
+            yield f'{self.name}_sum', labels, series[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = [] # Callables returning [(name, type, help, [(labels, value), ...]), ...]
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        families = [(metric.name, metric.type, metric.help, metric.samples()) for metric in self._metrics]
+        for collect in self._collectors:
+            families.extend((name, kind, help, ((name, labels, value) for labels, value in values))
+                            for name, kind, help, values in collect())
+        for name, kind, help, samples in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{sample_name}{_labels(labels)} {_number(value)}' for sample_name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """The standard metrics of the app (app.extensions['metrics'])."""
+
+    def __init__(self, slow_query_seconds=DEFAULT_SLOW_QUERY_SECONDS):
+        self.slow_query_seconds = slow_query_seconds
+        self.registry = registry = MetricsRegistry()
+        self.request_latency = registry.histogram(
+            'http_request_duration_seconds', 'Request latency.', ('endpoint', 'method', 'status'))
+        self.request_queries = registry.histogram(
+            'http_request_db_queries', 'SQL statements issued per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_query_seconds = registry.histogram(
+            'http_request_db_seconds', 'Time spent in SQL statements per request.', ('endpoint',))
+        self.query_latency = registry.histogram(
+            'db_query_duration_seconds', 'SQL statement latency.', (), QUERY_BUCKETS)
+        self.slow_queries = registry.counter(
+            'db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_SECONDS.')
+        self.image_processing = registry.histogram(
+            'image_processing_seconds', 'Pillow time to compress one photo and write its thumbnails.', (), IMAGE_BUCKETS)
+
+    def observe_query(self, statement, parameters, seconds):
+        self.query_latency.observe(seconds)
+        if seconds >= self.slow_query_seconds:
+            self.slow_queries.inc()
+            current_app.logger.warning('Slow query (%.0f ms): %s params=%.*r', seconds * 1000, statement,
+                                       MAX_LOGGED_PARAMS, parameters)
+
+
+def get_metrics():
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+
+def observe_image_processing(seconds):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.image_processing.observe(seconds)
+
+
+# --- SQL 语句计数: 引擎事件 -> 当前上下文中的所有 QueryStats ---
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements.append(statement)
+
+
+_active_stats = contextvars.ContextVar('active_query_stats', default=())
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run in this context (including test client requests) into a QueryStats."""
+    stats = QueryStats()
+    token = _active_stats.set(_active_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active_stats.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    for stats in _active_stats.get():
+        stats.add(statement, seconds)
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe_query(statement, parameters, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_query_timer(exception_context):
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+# --- 请求计时 ---
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = QueryStats()
+    g.metrics_token = _active_stats.set(_active_stats.get() + (g.metrics_queries,))
+
+
+def _record_request(response):
+    if 'metrics_started' not in g:
+        return response # An earlier before_request handler answered the request
+    metrics = current_app.extensions['metrics']
+    endpoint = request.endpoint or 'unmatched' # 404s: one series, not one per URL
+    metrics.request_latency.observe(time.perf_counter() - g.metrics_started,
+                                    endpoint=endpoint, method=request.method, status=str(response.status_code))
+    metrics.request_queries.observe(g.metrics_queries.count, endpoint=endpoint)
+    metrics.request_query_seconds.observe(g.metrics_queries.seconds, endpoint=endpoint)
+    g.metrics_recorded = True
+    return response
+
+
+def _end_request(exception):
+    token = g.pop('metrics_token', None)
+    if token is None:
+        return
+    _active_stats.reset(token)
+    if not g.get('metrics_recorded'): # Unhandled exception: after_request did not run
+        metrics = current_app.extensions['metrics']
+        metrics.request_latency.observe(time.perf_counter() - g.metrics_started,
+                                        endpoint=request.endpoint or 'unmatched', method=request.method, status='500')
+
+
+def _component_counters(app):
+    """Counters kept by the response cache, the WeChat dedup cache, the access_token manager and the log queue."""
+    def collect():
+        families = []
+        cache = app.extensions.get('response_cache')
+        if cache is not None:
+            families.append(('response_cache_requests_total', 'counter', 'Response cache lookups by result.',
+                             [({'result': 'hit'}, cache.hits), ({'result': 'miss'}, cache.misses)]))
+        dedup = app.extensions.get('wechat_dedup')
+        if dedup is not None:
+            families.append(('wechat_duplicate_messages_total', 'counter',
+                             'WeChat retries answered without handling the message again.', [({}, dedup.duplicates)]))
+            families.append(('wechat_late_replies_total', 'counter',
+                             "Messages answered 'success' after WECHAT_REPLY_BUDGET.", [({}, dedup.late)]))
+        client = app.extensions.get('wechat_client')
+        if client is not None:
+            families.append(('wechat_access_token_requests_total', 'counter', 'access_token lookups by outcome.',
+                             [({'outcome': outcome}, value) for outcome, value in client.tokens.stats().items()]))
+        log_queue = app.extensions.get('log_queue')
+        if log_queue is not None:
+            families.append(('log_records_dropped_total', 'counter',
+                             'Log records dropped because the log queue was full.', [({}, log_queue.dropped)]))
+        return families
+    return collect
+
+
+def init_metrics(app):
+    """Install the request hooks and GET /metrics (app.extensions['metrics'])."""
+    metrics = app.extensions['metrics'] = Metrics(app.config.get('SLOW_QUERY_SECONDS', DEFAULT_SLOW_QUERY_SECONDS))
+    metrics.registry.collector(_component_counters(app))
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_end_request)
+    if app.config.get('METRICS_ENABLED', True):
+        app.add_url_rule('/metrics', 'metrics', lambda: (metrics.registry.render(), 200,
+                                                          {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}))
+    return metrics
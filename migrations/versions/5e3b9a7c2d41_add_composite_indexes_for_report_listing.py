@@ -0,0 +1,41 @@
+"""Add composite indexes for report listing filters
+
+Revision ID: 5e3b9a7c2d41
+Revises: 37da5a236528
+Create Date: 2026-10-18 10:12:04.381520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e3b9a7c2d41'
+down_revision = '37da5a236528'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Each index matches one (equality filters, ORDER BY created_at DESC, id DESC) shape built in listing.py
+    with op.batch_alter_table('pet_lost_reports', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_lost_reports_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_lost_reports_is_found_created_at', ['is_found', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_lost_reports_is_found_pet_type_created_at', ['is_found', 'pet_type', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_lost_reports_pet_type_created_at', ['pet_type', 'created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('pet_found_reports', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_found_reports_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_found_reports_pet_type_created_at', ['pet_type', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pet_found_reports', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_found_reports_pet_type_created_at')
+        batch_op.drop_index('ix_pet_found_reports_created_at_id')
+
+    with op.batch_alter_table('pet_lost_reports', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_lost_reports_pet_type_created_at')
+        batch_op.drop_index('ix_pet_lost_reports_is_found_pet_type_created_at')
+        batch_op.drop_index('ix_pet_lost_reports_is_found_created_at')
+        batch_op.drop_index('ix_pet_lost_reports_created_at_id')
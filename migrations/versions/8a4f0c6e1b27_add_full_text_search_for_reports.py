@@ -0,0 +1,105 @@
+"""Add full-text search columns and indexes for reports
+
+Revision ID: 8a4f0c6e1b27
+Revises: 5e3b9a7c2d41
+Create Date: 2026-10-18 11:03:47.902114
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4f0c6e1b27'
+down_revision = '5e3b9a7c2d41'
+branch_labels = None
+depends_on = None
+
+# Snapshot of segmenter.segment() at the time of this migration, used to backfill existing rows
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[0-9A-Za-zÀ-ɏ]+')
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+
+def _segment(*texts):
+    tokens = []
+    for text in texts:
+        for run in _TOKEN_RE.findall(text or ''):
+            if _CJK_RE.match(run):
+                tokens.extend([run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]])
+            else:
+                tokens.append(run.lower())
+    return ' '.join(tokens)
+
+
+# table -> (location fields, text fields)
+SEARCH_SOURCES = {
+    'pet_lost_reports': (['lost_location_text'], ['breed', 'color', 'pet_name', 'features', 'additional_info']),
+    'pet_found_reports': (['found_location_text'], ['breed', 'color', 'features']),
+}
+
+
+def _fts_ddl(table_name):
+    fts = f'{table_name}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"search_location, search_text, content='{table_name}', content_rowid='id', "
+        f"tokenize='unicode61', prefix='1')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {fts}(rowid, search_location, search_text) "
+        f"VALUES (new.id, new.search_location, new.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_location, search_text) "
+        f"VALUES ('delete', old.id, old.search_location, old.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_location, search_text ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_location, search_text) "
+        f"VALUES ('delete', old.id, old.search_location, old.search_text); "
+        f"INSERT INTO {fts}(rowid, search_location, search_text) "
+        f"VALUES (new.id, new.search_location, new.search_text); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    bind = op.get_bind()
+    for table_name, (location_fields, text_fields) in SEARCH_SOURCES.items():
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('search_location', sa.Text(), nullable=True))
+            batch_op.add_column(sa.Column('search_text', sa.Text(), nullable=True))
+
+        # Backfill the segmented columns for existing reports
+        rows = bind.execute(sa.text(
+            f"SELECT id, {', '.join(location_fields + text_fields)} FROM {table_name}")).mappings().all()
+        for row in rows:
+            bind.execute(
+                sa.text(f"UPDATE {table_name} SET search_location = :loc, search_text = :txt WHERE id = :id"),
+                {'id': row['id'],
+                 'loc': _segment(*(row[name] for name in location_fields)),
+                 'txt': _segment(*(row[name] for name in text_fields))})
+
+        if bind.dialect.name == 'sqlite':
+            for statement in _fts_ddl(table_name):
+                op.execute(statement)
+        elif bind.dialect.name == 'postgresql':
+            for column in ('search_location', 'search_text'):
+                op.create_index(f'ix_{table_name}_{column}_tsv', table_name,
+                                [sa.text(f"to_tsvector('simple', coalesce({column}, ''))")],
+                                postgresql_using='gin')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table_name in SEARCH_SOURCES:
+        if bind.dialect.name == 'sqlite':
+            fts = f'{table_name}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
+        elif bind.dialect.name == 'postgresql':
+            for column in ('search_location', 'search_text'):
+                op.drop_index(f'ix_{table_name}_{column}_tsv', table_name=table_name)
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('search_text')
+            batch_op.drop_column('search_location')
@@ -0,0 +1,54 @@
+"""Add photo_hashes table and stored_files.signature
+
+Revision ID: a7d3e51c9b24
+Revises: f2c6a8e0b913
+Create Date: 2026-10-18 19:41:05.318266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e51c9b24'
+down_revision = 'f2c6a8e0b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # create_app() runs db.create_all() before migrations, which may already have built the new table
+    if 'photo_hashes' not in sa.inspect(bind).get_table_names():
+        op.create_table('photo_hashes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('report_type', sa.String(length=10), nullable=False),
+        sa.Column('report_id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('phash', sa.String(length=16), nullable=False),
+        sa.Column('dhash', sa.String(length=16), nullable=False),
+        sa.Column('colors', sa.String(length=32), nullable=False),
+        sa.Column('phash_band0', sa.Integer(), nullable=False),
+        sa.Column('phash_band1', sa.Integer(), nullable=False),
+        sa.Column('phash_band2', sa.Integer(), nullable=False),
+        sa.Column('phash_band3', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('report_type', 'report_id', 'filename', name='uq_photo_hashes_photo')
+        )
+        with op.batch_alter_table('photo_hashes', schema=None) as batch_op:
+            for band in range(4):
+                batch_op.create_index(f'ix_photo_hashes_band{band}', ['report_type', f'phash_band{band}'], unique=False)
+
+    if 'signature' not in {column['name'] for column in sa.inspect(bind).get_columns('stored_files')}:
+        with op.batch_alter_table('stored_files', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('signature', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_table('photo_hashes')
+
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('ALTER TABLE stored_files DROP COLUMN signature')
+    else:
+        op.drop_column('stored_files', 'signature')
@@ -0,0 +1,42 @@
+"""Store report photos as upload filenames instead of URLs
+
+Revision ID: b5e82f4d1c36
+Revises: a7d3e51c9b24
+Create Date: 2026-10-18 20:26:47.904512
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e82f4d1c36'
+down_revision = 'a7d3e51c9b24'
+branch_labels = None
+depends_on = None
+
+report_tables = [sa.table(name, sa.column('id', sa.Integer), sa.column('_photo_urls', sa.Text))
+                 for name in ('pet_lost_reports', 'pet_found_reports')]
+
+
+def upgrade():
+    # 寻宠启事原先保存 '/static/uploads/<文件名>'，招领启事保存 url_for(..., _external=True) 的完整地址:
+    # 统一为相对 UPLOAD_FOLDER 的文件名
+    bind = op.get_bind()
+    for table in report_tables:
+        rows = bind.execute(sa.select(table.c.id, table.c._photo_urls)
+                            .where(table.c._photo_urls.like('%/uploads/%'))).all()
+        for report_id, photo_urls in rows:
+            try:
+                urls = json.loads(photo_urls)
+            except ValueError:
+                continue
+            filenames = [url.split('/uploads/', 1)[1] if '/uploads/' in url else url for url in urls]
+            bind.execute(table.update().where(table.c.id == report_id).values(_photo_urls=json.dumps(filenames)))
+
+
+def downgrade():
+    # Filenames are valid photo entries for the previous code as well (images.photo_filename)
+    pass
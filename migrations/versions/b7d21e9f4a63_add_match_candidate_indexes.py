@@ -0,0 +1,32 @@
+"""Add indexes for lost/found match candidate retrieval
+
+Revision ID: b7d21e9f4a63
+Revises: 8a4f0c6e1b27
+Create Date: 2026-10-18 13:26:10.514862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d21e9f4a63'
+down_revision = '8a4f0c6e1b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pet_lost_reports', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_lost_reports_match', ['pet_type', 'is_found', 'lost_time'], unique=False)
+
+    with op.batch_alter_table('pet_found_reports', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_found_reports_match', ['pet_type', 'found_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pet_found_reports', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_found_reports_match')
+
+    with op.batch_alter_table('pet_lost_reports', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_lost_reports_match')
@@ -0,0 +1,63 @@
+"""Add geohash to PetLostReport and PetFoundReport
+
+Revision ID: c3e85a1d7f90
+Revises: b7d21e9f4a63
+Create Date: 2026-10-18 14:40:22.067315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e85a1d7f90'
+down_revision = 'b7d21e9f4a63'
+branch_labels = None
+depends_on = None
+
+_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def _geohash(lat, lon, precision=9):
+    # Snapshot of geo.geohash_encode() at the time of this migration, used for the backfill
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value = (value << 1) | (1 if coord >= mid else 0)
+        rng[0 if coord >= mid else 1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def upgrade():
+    bind = op.get_bind()
+    for table_name in ('pet_lost_reports', 'pet_found_reports'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table_name}_geohash'), ['geohash'], unique=False)
+
+        rows = bind.execute(sa.text(
+            f"SELECT id, latitude, longitude FROM {table_name} "
+            f"WHERE latitude IS NOT NULL AND longitude IS NOT NULL")).all()
+        for report_id, lat, lon in rows:
+            bind.execute(sa.text(f"UPDATE {table_name} SET geohash = :geohash WHERE id = :id"),
+                         {'id': report_id, 'geohash': _geohash(lat, lon)})
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table_name in ('pet_found_reports', 'pet_lost_reports'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table_name}_geohash'))
+        if bind.dialect.name == 'sqlite':
+            # Native DROP COLUMN (SQLite >= 3.35): batch mode would rebuild the table and
+            # silently drop the FTS sync triggers attached to it
+            op.execute(f'ALTER TABLE {table_name} DROP COLUMN geohash')
+        else:
+            op.drop_column(table_name, 'geohash')
@@ -0,0 +1,46 @@
+"""Add notifications queue for WeChat match notifications
+
+Revision ID: c3f7a9d24e61
+Revises: b5e82f4d1c36
+Create Date: 2026-10-18 21:12:38.540173
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f7a9d24e61'
+down_revision = 'b5e82f4d1c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_app() runs db.create_all() before migrations, which may already have built the new table
+    if 'notifications' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('notifications',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('openid', sa.String(length=128), nullable=False),
+        sa.Column('template_id', sa.String(length=64), nullable=False),
+        sa.Column('report_type', sa.String(length=10), nullable=False),
+        sa.Column('report_id', sa.Integer(), nullable=False),
+        sa.Column('match_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('msgid', sa.String(length=32), nullable=True),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('openid', 'report_type', 'report_id', 'match_id', name='uq_notifications_match')
+        )
+        with op.batch_alter_table('notifications', schema=None) as batch_op:
+            batch_op.create_index('ix_notifications_status_available_at', ['status', 'available_at'], unique=False)
+
+
+def downgrade():
+    op.drop_table('notifications')
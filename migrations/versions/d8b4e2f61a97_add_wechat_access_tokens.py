@@ -0,0 +1,34 @@
+"""Add wechat_access_tokens table shared by all workers
+
+Revision ID: d8b4e2f61a97
+Revises: c3f7a9d24e61
+Create Date: 2026-10-18 22:03:51.276094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b4e2f61a97'
+down_revision = 'c3f7a9d24e61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_app() runs db.create_all() before migrations, which may already have built the new table
+    if 'wechat_access_tokens' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('wechat_access_tokens',
+        sa.Column('appid', sa.String(length=64), nullable=False),
+        sa.Column('access_token', sa.String(length=512), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('lock_owner', sa.String(length=32), nullable=True),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('appid')
+        )
+
+
+def downgrade():
+    op.drop_table('wechat_access_tokens')
@@ -0,0 +1,58 @@
+"""Add image_jobs queue and photos_processing flag to reports
+
+Revision ID: d9a6f3b2c815
+Revises: c3e85a1d7f90
+Create Date: 2026-10-18 16:05:31.228904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a6f3b2c815'
+down_revision = 'c3e85a1d7f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_app() runs db.create_all() before migrations, which may already have built the new table
+    if 'image_jobs' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('image_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('report_type', sa.String(length=10), nullable=False),
+        sa.Column('report_id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('image_jobs', schema=None) as batch_op:
+            batch_op.create_index('ix_image_jobs_status_available_at', ['status', 'available_at'], unique=False)
+            batch_op.create_index('ix_image_jobs_report', ['report_type', 'report_id'], unique=False)
+
+    for table_name in ('pet_lost_reports', 'pet_found_reports'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            # Adjust for SQLite: Add server_default for NOT NULL column
+            batch_op.add_column(sa.Column('photos_processing', sa.Boolean(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table_name in ('pet_found_reports', 'pet_lost_reports'):
+        if bind.dialect.name == 'sqlite':
+            # Native DROP COLUMN keeps the FTS triggers that a batch table rebuild would drop
+            op.execute(f'ALTER TABLE {table_name} DROP COLUMN photos_processing')
+        else:
+            op.drop_column(table_name, 'photos_processing')
+
+    with op.batch_alter_table('image_jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_image_jobs_report')
+        batch_op.drop_index('ix_image_jobs_status_available_at')
+
+    op.drop_table('image_jobs')
@@ -0,0 +1,43 @@
+"""Add photo thumbnail variants to reports and image_jobs
+
+Revision ID: e4b19c7d2a58
+Revises: d9a6f3b2c815
+Create Date: 2026-10-18 17:20:46.513207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b19c7d2a58'
+down_revision = 'd9a6f3b2c815'
+branch_labels = None
+depends_on = None
+
+
+def _columns(bind, table_name):
+    return {column['name'] for column in sa.inspect(bind).get_columns(table_name)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    # image_jobs may have just been built with the new column by create_all()
+    if 'variants' not in _columns(bind, 'image_jobs'):
+        with op.batch_alter_table('image_jobs', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('variants', sa.Text(), nullable=True))
+
+    for table_name in ('pet_lost_reports', 'pet_found_reports'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('_photo_variants', sa.Text(), nullable=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table_name in ('pet_found_reports', 'pet_lost_reports', 'image_jobs'):
+        column_name = 'variants' if table_name == 'image_jobs' else '_photo_variants'
+        if bind.dialect.name == 'sqlite':
+            # Native DROP COLUMN keeps the FTS triggers that a batch table rebuild would drop
+            op.execute(f'ALTER TABLE {table_name} DROP COLUMN {column_name}')
+        else:
+            op.drop_column(table_name, column_name)
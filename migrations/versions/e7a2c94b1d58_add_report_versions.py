@@ -0,0 +1,35 @@
+"""Add report_versions: per-table write counters for the list ETags
+
+Revision ID: e7a2c94b1d58
+Revises: d8b4e2f61a97
+Create Date: 2026-10-19 10:12:37.508214
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c94b1d58'
+down_revision = 'd8b4e2f61a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_app() runs db.create_all() before migrations, which may already have built (and filled) the new table
+    if 'report_versions' not in sa.inspect(op.get_bind()).get_table_names():
+        report_versions = op.create_table('report_versions',
+        sa.Column('report_type', sa.String(length=10), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('report_type')
+        )
+        op.bulk_insert(report_versions, [{'report_type': report_type, 'version': 0, 'updated_at': datetime.utcnow()}
+                                         for report_type in ('lost', 'found')])
+
+
+def downgrade():
+    op.drop_table('report_versions')
@@ -0,0 +1,45 @@
+"""Add content-addressed stored_files table
+
+Revision ID: f2c6a8e0b913
+Revises: e4b19c7d2a58
+Create Date: 2026-10-18 18:02:13.774120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a8e0b913'
+down_revision = 'e4b19c7d2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # create_app() runs db.create_all() before migrations, which may already have built the new table
+    if 'stored_files' not in sa.inspect(bind).get_table_names():
+        op.create_table('stored_files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.Column('variants', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('filename'),
+        sa.UniqueConstraint('sha256')
+        )
+
+    if 'ix_image_jobs_filename_status' not in {index['name'] for index in sa.inspect(bind).get_indexes('image_jobs')}:
+        with op.batch_alter_table('image_jobs', schema=None) as batch_op:
+            batch_op.create_index('ix_image_jobs_filename_status', ['filename', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image_jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_image_jobs_filename_status')
+
+    op.drop_table('stored_files')
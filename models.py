@@ -1,13 +1,72 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect, text
+from sqlalchemy.orm import Session
 from datetime import datetime
-import json # To handle photo_urls
+import json # To handle photo_urls / photo_variants
+from segmenter import segment
+from geo import geohash_encode
+from db_engines import ReadWriteSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ReadWriteSession}) # SELECTs use the read pool, if any (db_engines.py)
+
+
+class DecodedJSON:
+    """
+    Property exposing a JSON text column as the decoded value, parsed once per loaded value.
+
+    The decoded value is cached on the instance next to the raw string it came from and reused
+    while the column still holds that same string (a new assignment, refresh or reload replaces
+    the string), so templates reading report.photo_urls several times per row parse it once.
+    The returned value is shared: assign a new one instead of mutating it in place.
+    """
+
+    def __init__(self, column_attr, empty):
+        self.column_attr = column_attr
+        self.empty = empty # Factory for the value of a NULL / invalid column, e.g. list
+
+    def __set_name__(self, owner, name):
+        self.cache_attr = f'_{name}_decoded'
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        raw = getattr(instance, self.column_attr)
+        cached = instance.__dict__.get(self.cache_attr)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+        try:
+            value = json.loads(raw) if raw else self.empty()
+        except json.JSONDecodeError:
+            value = self.empty()
+        instance.__dict__[self.cache_attr] = (raw, value)
+        return value
+
+    def __set__(self, instance, value):
+        setattr(instance, self.column_attr, json.dumps(value) if value else None)
 
 # --- Define your database models here --- 
 
 class PetLostReport(db.Model):
     __tablename__ = 'pet_lost_reports'
+    # 组合索引与列表查询的 (过滤条件, 排序) 组合一一对应，见 listing.py 与 scripts/check_query_plans.py
+    __table_args__ = (
+        db.Index('ix_pet_lost_reports_created_at_id', 'created_at', 'id'),
+        db.Index('ix_pet_lost_reports_is_found_created_at', 'is_found', 'created_at', 'id'),
+        db.Index('ix_pet_lost_reports_is_found_pet_type_created_at', 'is_found', 'pet_type', 'created_at', 'id'),
+        db.Index('ix_pet_lost_reports_pet_type_created_at', 'pet_type', 'created_at', 'id'),
+        # 自动匹配的候选检索: 同类型 + 时间窗口 (见 matching.py)
+        db.Index('ix_pet_lost_reports_match', 'pet_type', 'is_found', 'lost_time'),
+        # PostgreSQL 全文检索 (SQLite 使用下方的 FTS5 虚拟表)
+        db.Index('ix_pet_lost_reports_search_location_tsv',
+                 text("to_tsvector('simple', coalesce(search_location, ''))"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        db.Index('ix_pet_lost_reports_search_text_tsv',
+                 text("to_tsvector('simple', coalesce(search_text, ''))"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+    # 全文检索字段 -> (search_location, search_text) 的来源列，见 segmenter.py
+    SEARCH_LOCATION_FIELDS = ('lost_location_text',)
+    SEARCH_TEXT_FIELDS = ('breed', 'color', 'pet_name', 'features', 'additional_info')
 
     id = db.Column(db.Integer, primary_key=True)
     user_openid = db.Column(db.String(128), index=True, nullable=True) # Optional user link
@@ -27,37 +86,70 @@ class PetLostReport(db.Model):
     lost_location_text = db.Column(db.Text, nullable=False) # 丢失地点文字描述
     latitude = db.Column(db.Float, nullable=True)  # 新增：纬度
     longitude = db.Column(db.Float, nullable=True) # 新增：经度
+    geohash = db.Column(db.String(12), index=True, nullable=True) # 由经纬度自动计算，用于附近查询 (geo.nearby)
 
     contact_info = db.Column(db.String(200), nullable=False) # 联系方式
     _photo_urls = db.Column(db.Text, nullable=True) # Store as JSON string
+    photos_processing = db.Column(db.Boolean, default=False, nullable=False) # 照片仍在后台压缩中 (见 image_jobs.py)
+    _photo_variants = db.Column(db.Text, nullable=True) # JSON: 照片文件名 -> 各尺寸缩略图 (见 images.process_upload)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_found = db.Column(db.Boolean, default=False, nullable=False) # 是否已找到
     found_time = db.Column(db.DateTime, nullable=True) # 找到时间
 
-    @property
-    def photo_urls(self):
-        """Return photo URLs as a list."""
-        if self._photo_urls:
-            try:
-                return json.loads(self._photo_urls)
-            except json.JSONDecodeError:
-                return [] # Or handle error appropriately
-        return []
-
-    @photo_urls.setter
-    def photo_urls(self, urls):
-        """Store photo URLs as a JSON string."""
-        if urls and isinstance(urls, list):
-            self._photo_urls = json.dumps(urls)
-        else:
-            self._photo_urls = None
+    # --- 全文检索 (分词后的文本，由 before_insert/before_update 自动维护) ---
+    search_location = db.Column(db.Text, nullable=True)
+    search_text = db.Column(db.Text, nullable=True)
+
+    # 照片文件名列表 (相对 UPLOAD_FOLDER) 与 {照片文件名: {宽度: {'fallback'|'webp'|...: 缩略图文件名}}}
+    photo_urls = DecodedJSON('_photo_urls', list)
+    photo_variants = DecodedJSON('_photo_variants', dict)
+
+    def to_dict(self):
+        """Serialize the report for the JSON API."""
+        return {
+            'id': self.id,
+            'report_type': 'lost',
+            'pet_type': self.pet_type,
+            'breed': self.breed,
+            'color': self.color,
+            'gender': self.gender,
+            'age': self.age,
+            'features': self.features,
+            'pet_name': self.pet_name,
+            'additional_info': self.additional_info,
+            'lost_time': self.lost_time.isoformat() if self.lost_time else None,
+            'lost_location_text': self.lost_location_text,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'geohash': self.geohash,
+            'contact_info': self.contact_info,
+            'photo_urls': self.photo_urls,
+            'photo_variants': self.photo_variants,
+            'photos_processing': self.photos_processing,
+            'is_found': self.is_found,
+            'found_time': self.found_time.isoformat() if self.found_time else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
 
     def __repr__(self):
         return f'<PetLostReport {self.id}: {self.pet_type} lost at {self.lost_location_text}>'
 
 class PetFoundReport(db.Model):
     __tablename__ = 'pet_found_reports'
+    __table_args__ = (
+        db.Index('ix_pet_found_reports_created_at_id', 'created_at', 'id'),
+        db.Index('ix_pet_found_reports_pet_type_created_at', 'pet_type', 'created_at', 'id'),
+        db.Index('ix_pet_found_reports_match', 'pet_type', 'found_time'),
+        db.Index('ix_pet_found_reports_search_location_tsv',
+                 text("to_tsvector('simple', coalesce(search_location, ''))"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        db.Index('ix_pet_found_reports_search_text_tsv',
+                 text("to_tsvector('simple', coalesce(search_text, ''))"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+    SEARCH_LOCATION_FIELDS = ('found_location_text',)
+    SEARCH_TEXT_FIELDS = ('breed', 'color', 'features')
 
     id = db.Column(db.Integer, primary_key=True)
     user_openid = db.Column(db.String(128), index=True, nullable=True) # Optional user link
@@ -70,32 +162,279 @@ class PetFoundReport(db.Model):
     found_location_text = db.Column(db.Text, nullable=False)
     latitude = db.Column(db.Float, nullable=True)  # 新增：纬度
     longitude = db.Column(db.Float, nullable=True) # 新增：经度
+    geohash = db.Column(db.String(12), index=True, nullable=True) # 由经纬度自动计算，用于附近查询 (geo.nearby)
     contact_info = db.Column(db.String(255), nullable=False)
     _photo_urls = db.Column(db.Text, nullable=True) # Store as JSON string
+    photos_processing = db.Column(db.Boolean, default=False, nullable=False) # 照片仍在后台压缩中 (见 image_jobs.py)
+    _photo_variants = db.Column(db.Text, nullable=True) # JSON: 照片文件名 -> 各尺寸缩略图 (见 images.process_upload)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    @property
-    def photo_urls(self):
-        """Return photo URLs as a list."""
-        if self._photo_urls:
-            try:
-                return json.loads(self._photo_urls)
-            except json.JSONDecodeError:
-                return [] # Or handle error appropriately
-        return []
-
-    @photo_urls.setter
-    def photo_urls(self, urls):
-        """Store photo URLs as a JSON string."""
-        if urls and isinstance(urls, list):
-            self._photo_urls = json.dumps(urls)
-        else:
-            self._photo_urls = None
+    # --- 全文检索 (分词后的文本，由 before_insert/before_update 自动维护) ---
+    search_location = db.Column(db.Text, nullable=True)
+    search_text = db.Column(db.Text, nullable=True)
+
+    # 照片文件名列表 (相对 UPLOAD_FOLDER) 与 {照片文件名: {宽度: {'fallback'|'webp'|...: 缩略图文件名}}}
+    photo_urls = DecodedJSON('_photo_urls', list)
+    photo_variants = DecodedJSON('_photo_variants', dict)
+
+    def to_dict(self):
+        """Serialize the report for the JSON API."""
+        return {
+            'id': self.id,
+            'report_type': 'found',
+            'pet_type': self.pet_type,
+            'breed': self.breed,
+            'color': self.color,
+            'gender': self.gender,
+            'features': self.features,
+            'found_time': self.found_time.isoformat() if self.found_time else None,
+            'found_location_text': self.found_location_text,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'geohash': self.geohash,
+            'contact_info': self.contact_info,
+            'photo_urls': self.photo_urls,
+            'photo_variants': self.photo_variants,
+            'photos_processing': self.photos_processing,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
 
     def __repr__(self):
         return f'<PetFoundReport {self.id}: {self.pet_type} found at {self.found_location_text}>'
 
+class ImageJob(db.Model):
+    """Durable queue entry for compressing one uploaded photo and generating its thumbnails in the background."""
+    __tablename__ = 'image_jobs'
+    __table_args__ = (
+        db.Index('ix_image_jobs_status_available_at', 'status', 'available_at'),
+        db.Index('ix_image_jobs_report', 'report_type', 'report_id'),
+        db.Index('ix_image_jobs_filename_status', 'filename', 'status'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    report_type = db.Column(db.String(10), nullable=False) # 'lost' or 'found'
+    report_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False) # Relative to UPLOAD_FOLDER
+    status = db.Column(db.String(10), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    variants = db.Column(db.Text, nullable=True) # JSON of the derivatives written for this photo (set when done)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Not picked up before this (retry backoff / lease expiry)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ImageJob {self.id}: {self.report_type}/{self.report_id} {self.filename} {self.status}>'
+
+class StoredFile(db.Model):
+    """One content-addressed upload (see uploads.py), shared by every report photo with the same bytes."""
+    __tablename__ = 'stored_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False) # Hash of the bytes as uploaded
+    filename = db.Column(db.String(255), unique=True, nullable=False) # Relative to UPLOAD_FOLDER: 'ab/cd/<sha256>.jpg'
+    size = db.Column(db.Integer, nullable=False) # Upload size in bytes
+    refcount = db.Column(db.Integer, nullable=False, default=0) # Report photos referencing this file
+    variants = db.Column(db.Text, nullable=True) # JSON of images.process_upload() once processed
+    signature = db.Column(db.Text, nullable=True) # JSON perceptual signature, set together with variants
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredFile {self.id}: {self.filename} x{self.refcount}>'
+
+class PhotoHash(db.Model):
+    """Perceptual hashes of one report photo (see perceptual_hash.py), for finding visually similar photos."""
+    __tablename__ = 'photo_hashes'
+    # 多索引哈希: pHash 的每个 16 位分段单独建索引 (见 matching.find_similar_photos)
+    __table_args__ = (
+        db.UniqueConstraint('report_type', 'report_id', 'filename', name='uq_photo_hashes_photo'),
+        db.Index('ix_photo_hashes_band0', 'report_type', 'phash_band0'),
+        db.Index('ix_photo_hashes_band1', 'report_type', 'phash_band1'),
+        db.Index('ix_photo_hashes_band2', 'report_type', 'phash_band2'),
+        db.Index('ix_photo_hashes_band3', 'report_type', 'phash_band3'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    report_type = db.Column(db.String(10), nullable=False) # 'lost' or 'found'
+    report_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False) # Relative to UPLOAD_FOLDER
+    phash = db.Column(db.String(16), nullable=False) # 64-bit hex
+    dhash = db.Column(db.String(16), nullable=False) # 64-bit hex
+    colors = db.Column(db.String(32), nullable=False) # Color histogram, one hex digit per bin
+    phash_band0 = db.Column(db.Integer, nullable=False)
+    phash_band1 = db.Column(db.Integer, nullable=False)
+    phash_band2 = db.Column(db.Integer, nullable=False)
+    phash_band3 = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PhotoHash {self.id}: {self.report_type}/{self.report_id} {self.filename} {self.phash}>'
+
+class Notification(db.Model):
+    """Durable queue entry for one WeChat template message telling a reporter about a match (see notifications.py)."""
+    __tablename__ = 'notifications'
+    __table_args__ = (
+        # 同一启事的同一匹配只通知一次 (重新匹配 / 重复提交不会重复推送)
+        db.UniqueConstraint('openid', 'report_type', 'report_id', 'match_id', name='uq_notifications_match'),
+        db.Index('ix_notifications_status_available_at', 'status', 'available_at'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    openid = db.Column(db.String(128), nullable=False) # Recipient: user_openid of the notified report
+    template_id = db.Column(db.String(64), nullable=False)
+    report_type = db.Column(db.String(10), nullable=False) # 'lost' or 'found': the recipient's report
+    report_id = db.Column(db.Integer, nullable=False)
+    match_id = db.Column(db.Integer, nullable=False) # The matching report, of the other type
+    payload = db.Column(db.Text, nullable=False) # JSON {"data": {field: value}, "url": ...} rendered at enqueue time
+    status = db.Column(db.String(10), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    msgid = db.Column(db.String(32), nullable=True) # Returned by WeChat once sent
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Not picked up before this (retry backoff / lease expiry)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Notification {self.id}: {self.report_type}/{self.report_id} <- {self.match_id} {self.status}>'
+
+class WeChatAccessToken(db.Model):
+    """The access_token of one official account, shared by all workers, plus its refresh lock (see wechat_token.py)."""
+    __tablename__ = 'wechat_access_tokens'
+
+    appid = db.Column(db.String(64), primary_key=True)
+    access_token = db.Column(db.String(512), nullable=True) # NULL until the first refresh completes
+    expires_at = db.Column(db.DateTime, nullable=True) # UTC
+    lock_owner = db.Column(db.String(32), nullable=True) # Worker currently refreshing
+    locked_until = db.Column(db.DateTime, nullable=True) # Lock lease: taken over after this if the worker died
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<WeChatAccessToken {self.appid} expires {self.expires_at}>'
+
+class ReportVersion(db.Model):
+    """
+    Write counter of one report table, bumped in the same transaction as every change to it
+    (bump_report_versions); the list responses' ETag / Last-Modified come from it (listing.report_version).
+    """
+    __tablename__ = 'report_versions'
+
+    report_type = db.Column(db.String(10), primary_key=True) # 'lost' or 'found'
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow) # Time of the last change, UTC
+
+    def __repr__(self):
+        return f'<ReportVersion {self.report_type} {self.version}>'
+
+# --- 自动维护的派生字段: 全文检索分词 / geohash ---
+
+def _refresh_search_columns(target, only_if_changed):
+    """Recompute search_location / search_text from the report's source fields."""
+    if only_if_changed:
+        state = inspect(target)
+        sources = target.SEARCH_LOCATION_FIELDS + target.SEARCH_TEXT_FIELDS
+        if not any(state.attrs[name].history.has_changes() for name in sources):
+            return
+    target.search_location = segment(*(getattr(target, name) for name in target.SEARCH_LOCATION_FIELDS))
+    target.search_text = segment(*(getattr(target, name) for name in target.SEARCH_TEXT_FIELDS))
+
+
+def _refresh_geohash(target, only_if_changed):
+    """Recompute the geohash cell from latitude/longitude (None if either is missing)."""
+    if only_if_changed:
+        state = inspect(target)
+        if not (state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes()):
+            return
+    if target.latitude is None or target.longitude is None:
+        target.geohash = None
+    else:
+        target.geohash = geohash_encode(target.latitude, target.longitude)
+
+
+for _model in (PetLostReport, PetFoundReport):
+    for _refresh in (_refresh_search_columns, _refresh_geohash):
+        event.listen(_model, 'before_insert', lambda mapper, connection, target, _refresh=_refresh: _refresh(target, False))
+        event.listen(_model, 'before_update', lambda mapper, connection, target, _refresh=_refresh: _refresh(target, True))
+
+
+def derived_columns(model, values):
+    """
+    search_location / search_text / geohash of a report given as {column: value}, for bulk
+    inserts (report_transfer.py), which bypass the ORM events above.
+    """
+    latitude, longitude = values.get('latitude'), values.get('longitude')
+    return {
+        'search_location': segment(*(values.get(name) for name in model.SEARCH_LOCATION_FIELDS)),
+        'search_text': segment(*(values.get(name) for name in model.SEARCH_TEXT_FIELDS)),
+        'geohash': None if latitude is None or longitude is None else geohash_encode(latitude, longitude),
+    }
+
+
+def fts_table_ddl(table_name):
+    """
+    SQLite FTS5 external-content table over (search_location, search_text) plus the triggers
+    that keep it in sync with `table_name`. prefix='1' indexes one-character prefixes so
+    single-character CJK queries ("猫"*) are index lookups too.
+    """
+    fts = f'{table_name}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"search_location, search_text, content='{table_name}', content_rowid='id', "
+        f"tokenize='unicode61', prefix='1')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {fts}(rowid, search_location, search_text) "
+        f"VALUES (new.id, new.search_location, new.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_location, search_text) "
+        f"VALUES ('delete', old.id, old.search_location, old.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_location, search_text ON {table_name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_location, search_text) "
+        f"VALUES ('delete', old.id, old.search_location, old.search_text); "
+        f"INSERT INTO {fts}(rowid, search_location, search_text) "
+        f"VALUES (new.id, new.search_location, new.search_text); END",
+    ]
+
+
+for _model in (PetLostReport, PetFoundReport):
+    for _statement in fts_table_ddl(_model.__tablename__):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+# --- 启事表版本号: 每次提交改动启事时递增 (列表 ETag 用) ---
+REPORT_VERSION_TYPES = {PetLostReport: 'lost', PetFoundReport: 'found'}
+
+
+def bump_report_versions(connection, report_types):
+    """Increment the ReportVersion rows of report_types on connection (inside the writing transaction)."""
+    table = ReportVersion.__table__
+    connection.execute(db.update(table).where(table.c.report_type.in_(sorted(report_types)))
+                       .values(version=table.c.version + 1, updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_report_versions(session, flush_context):
+    changed = {REPORT_VERSION_TYPES[type(obj)] for obj in (*session.new, *session.dirty, *session.deleted)
+               if type(obj) in REPORT_VERSION_TYPES}
+    if changed:
+        bump_report_versions(session.connection(), changed)
+
+
+@event.listens_for(ReportVersion.__table__, 'after_create')
+def _insert_report_versions(table, connection, **kw):
+    connection.execute(table.insert(), [{'report_type': report_type, 'version': 0, 'updated_at': datetime.utcnow()}
+                                        for report_type in REPORT_VERSION_TYPES.values()])
+
 # Example (We will define actual models later):
 # class User(db.Model):
 #     id = db.Column(db.Integer, primary_key=True)
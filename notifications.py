@@ -0,0 +1,339 @@
+"""
+微信模板消息通知 (WeChat template-message notifications for new matches).
+
+When a new report has likely matches (announce_matches in app.py), the owners of the reports
+on both sides who came through the official account (user_openid set) get a template message
+(WECHAT_MATCH_TEMPLATE_ID). The request only adds Notification rows in its own transaction;
+sending happens in the background, like the image jobs:
+
+* WECHAT_NOTIFY_MODE = 'thread'   - a sender thread is started lazily inside each web worker
+* WECHAT_NOTIFY_MODE = 'external' - notifications are only sent by `flask notifications worker`
+* WECHAT_NOTIFY_MODE = 'inline'   - sent synchronously right after the commit (tests/dev)
+
+The sender runs an asyncio loop: it claims up to WECHAT_SEND_BATCH_SIZE due notifications with
+one commit, sends them concurrently (at most WECHAT_SEND_CONCURRENCY requests in flight, over the
+connection pool of the app's WeChatClient), paced by a token bucket at WECHAT_SEND_RATE
+messages/sec, then records all outcomes with one commit.
+WeChat has no batch endpoint for template messages, so a batch is one request per message.
+
+Claims are conditional UPDATEs with a lease, so several senders can poll the same table;
+transient failures (network errors, WeChat busy / rate limited) are retried with exponential
+backoff up to MAX_ATTEMPTS, permanent ones (user unsubscribed, invalid openid) fail at once.
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import AppGroup
+
+from models import db, Notification, PetLostReport
+from wechat_api import WeChatAPIError, get_wechat_client
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+LEASE_SECONDS = 120
+POLL_SECONDS = 5
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 20 # Messages per second
+
+KIND_NAMES = {'lost': '寻宠启事', 'found': '招领信息'}
+
+
+def match_message(report_type, match_report, score, base_url):
+    """Template payload telling the owner of a report_type report about match_report (the other type)."""
+    match_type = 'found' if report_type == 'lost' else 'lost'
+    if match_type == 'found':
+        location, when = match_report.found_location_text, match_report.found_time
+    else:
+        location, when = match_report.lost_location_text, match_report.lost_time
+    return {
+        'data': {
+            'first': f'有一条新的{KIND_NAMES[match_type]}可能与您发布的{KIND_NAMES[report_type]}匹配',
+            'keyword1': ' '.join(filter(None, [match_report.pet_type, match_report.breed, match_report.color])),
+            'keyword2': location or '',
+            'keyword3': when.strftime('%Y-%m-%d %H:%M') if when else '',
+            'remark': f'匹配度 {score:.0%}，点击查看详情并联系对方。',
+        },
+        'url': f'{base_url}/reports?report_type={match_type}',
+    }
+
+
+def enqueue_match_notifications(report, matches):
+    """
+    Queue notifications about `matches` (matching.Match) of the committed `report` in the current
+    session: to the report's owner about each match, and to each matched report's owner about
+    `report`. Pairs notified before are skipped. The caller commits.
+
+    :return: Number of notifications queued (0 when WECHAT_MATCH_TEMPLATE_ID is not configured).
+    """
+    template_id = current_app.config.get('WECHAT_MATCH_TEMPLATE_ID')
+    if not template_id or not matches:
+        return 0
+    base_url = current_app.config.get('APP_BASE_URL') or (f'http://{request.host}' if has_request_context() else '')
+    report_type = 'lost' if isinstance(report, PetLostReport) else 'found'
+    match_type = 'found' if report_type == 'lost' else 'lost'
+    wanted = {} # (openid, report_type, report_id, match_id) -> payload
+    for match in matches:
+        if report.user_openid:
+            wanted[(report.user_openid, report_type, report.id, match.report.id)] = match_message(
+                report_type, match.report, match.score, base_url)
+        if match.report.user_openid:
+            wanted[(match.report.user_openid, match_type, match.report.id, report.id)] = match_message(
+                match_type, report, match.score, base_url)
+    if not wanted:
+        return 0
+    existing = set(db.session.execute(
+        db.select(Notification.openid, Notification.report_type, Notification.report_id, Notification.match_id)
+        .where(Notification.openid.in_({key[0] for key in wanted}))).all())
+    queued = 0
+    for key, payload in wanted.items():
+        if key in existing:
+            continue
+        openid, notified_type, report_id, match_id = key
+        db.session.add(Notification(openid=openid, template_id=template_id, report_type=notified_type,
+                                    report_id=report_id, match_id=match_id,
+                                    payload=json.dumps(payload, ensure_ascii=False)))
+        queued += 1
+    return queued
+
+
+def claim_notifications(limit):
+    """Atomically claim up to `limit` due notifications for this sender and return them."""
+    now = datetime.utcnow()
+    due = db.session.execute(
+        db.select(Notification.id)
+        .where(Notification.status.in_([Notification.STATUS_PENDING, Notification.STATUS_RUNNING]),
+               Notification.available_at <= now)
+        .order_by(Notification.id).limit(limit)).scalars().all()
+    claimed = []
+    for notification_id in due:
+        # Only one sender can win: the first UPDATE pushes available_at out to the lease expiry
+        result = db.session.execute(
+            db.update(Notification)
+            .where(Notification.id == notification_id,
+                   Notification.status.in_([Notification.STATUS_PENDING, Notification.STATUS_RUNNING]),
+                   Notification.available_at <= now)
+            .values(status=Notification.STATUS_RUNNING, attempts=Notification.attempts + 1,
+                    available_at=now + timedelta(seconds=LEASE_SECONDS), updated_at=now))
+        if result.rowcount == 1:
+            claimed.append(notification_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.execute(db.select(Notification).where(Notification.id.in_(claimed))
+                              .order_by(Notification.id)).scalars().all()
+
+
+def finish_notifications(results):
+    """
+    Record the outcomes of claimed notifications in one commit, scheduling retries for transient errors.
+
+    :param results: (notification_id, error, msgid) per notification; error is None when sent.
+    """
+    now = datetime.utcnow()
+    notifications = {notification.id: notification for notification in db.session.execute(
+        db.select(Notification).where(Notification.id.in_([result[0] for result in results]))).scalars()}
+    for notification_id, error, msgid in results:
+        notification = notifications.get(notification_id)
+        if notification is None:
+            continue
+        if error is None:
+            notification.status = Notification.STATUS_SENT
+            notification.msgid = str(msgid) if msgid is not None else None
+            notification.last_error = None
+            notification.sent_at = now
+        elif (isinstance(error, WeChatAPIError) and error.permanent) or notification.attempts >= MAX_ATTEMPTS:
+            notification.status = Notification.STATUS_FAILED
+            notification.last_error = f'{type(error).__name__}: {error}'
+            current_app.logger.error('Notification %s to %s failed after %d attempt(s): %s',
+                                     notification.id, notification.openid, notification.attempts, error)
+        else:
+            notification.status = Notification.STATUS_PENDING
+            notification.last_error = f'{type(error).__name__}: {error}'
+            notification.available_at = now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (notification.attempts - 1))
+            current_app.logger.warning('Notification %s failed (attempt %d), will retry: %s',
+                                       notification.id, notification.attempts, error)
+    db.session.commit()
+
+
+class RateLimiter:
+    """Token bucket for coroutines of one event loop: `rate` acquisitions per second, bursts up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock: # Waiters are served in order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotificationSender:
+    """Claims due notifications in batches and sends them concurrently from an asyncio loop."""
+
+    def __init__(self, app, client=None):
+        self.app = app
+        self.client = client
+        self.batch_size = app.config.get('WECHAT_SEND_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.concurrency = app.config.get('WECHAT_SEND_CONCURRENCY', DEFAULT_CONCURRENCY)
+        self.rate = app.config.get('WECHAT_SEND_RATE', DEFAULT_RATE)
+        self._stop = threading.Event()
+        self._loop = None
+        self._wake = None # asyncio.Event of the running loop
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='notification-sender', daemon=True)
+        self._thread.start()
+        return self
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wake(self):
+        """Thread-safe: make the loop poll for new notifications now."""
+        loop, wake = self._loop, self._wake
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass # The loop has just finished
+
+    def stop(self):
+        self._stop.set()
+        self.wake()
+
+    def run(self):
+        """Main loop; returns after stop() is called."""
+        asyncio.run(self._serve(forever=True))
+
+    def drain(self):
+        """Send every currently due notification, then return how many were processed."""
+        return asyncio.run(self._serve(forever=False))
+
+    async def _serve(self, forever):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        limiter = RateLimiter(self.rate)
+        # requests is blocking: each send runs on one of these threads, sharing the client's pool
+        executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='wechat-send')
+        processed = 0
+        with self.app.app_context():
+            try:
+                client = self.client or get_wechat_client()
+                while not self._stop.is_set():
+                    batch = claim_notifications(self.batch_size)
+                    if batch:
+                        results = await asyncio.gather(*(self._send(client, notification, limiter, executor)
+                                                         for notification in batch))
+                        finish_notifications(results)
+                        processed += len(batch)
+                    elif not forever:
+                        break
+                    else:
+                        try:
+                            await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+                        except asyncio.TimeoutError:
+                            pass
+                        self._wake.clear()
+                    db.session.remove()
+            except Exception as e:
+                current_app.logger.error(f"Notification sender stopped unexpectedly: {e}", exc_info=True)
+            finally:
+                self._loop = None
+                executor.shutdown(wait=True)
+        return processed
+
+    async def _send(self, client, notification, limiter, executor):
+        payload = json.loads(notification.payload)
+        send = functools.partial(client.send_template_message, notification.openid, notification.template_id,
+                                 payload['data'], payload.get('url'))
+        await limiter.acquire()
+        try:
+            msgid = await asyncio.get_running_loop().run_in_executor(executor, send)
+        except Exception as e:
+            return notification.id, e, None
+        return notification.id, None, msgid
+
+
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+
+def _get_sender(app):
+    """The sender thread of this process, started on first use (and again after a fork)."""
+    global _sender, _sender_pid
+    with _sender_lock:
+        if _sender is None or _sender_pid != os.getpid() or not _sender.is_alive():
+            _sender = NotificationSender(app).start()
+            _sender_pid = os.getpid()
+        return _sender
+
+
+def dispatch_notifications():
+    """Hand newly committed notifications to whatever sends them under WECHAT_NOTIFY_MODE."""
+    mode = current_app.config.get('WECHAT_NOTIFY_MODE', 'thread')
+    if mode == 'inline':
+        NotificationSender(current_app._get_current_object()).drain()
+    elif mode == 'thread':
+        _get_sender(current_app._get_current_object()).wake()
+    # 'external': a `flask notifications worker` process polls the table
+
+
+# --- flask notifications ... ---
+notifications_cli = AppGroup('notifications', help='微信模板消息通知 (WeChat match notifications).')
+
+
+@notifications_cli.command('worker')
+def worker():
+    """Run a notification sender in the foreground until interrupted."""
+    sender = NotificationSender(current_app._get_current_object())
+    click.echo(f'Sending notifications: {sender.concurrency} concurrent, {sender.rate}/s (Ctrl+C to stop)', err=True)
+    try:
+        sender.run()
+    except KeyboardInterrupt:
+        sender.stop()
+
+
+@notifications_cli.command('send')
+def send():
+    """Send all currently due notifications in this process, then exit."""
+    click.echo(f'{NotificationSender(current_app._get_current_object()).drain()} notifications processed', err=True)
+
+
+@notifications_cli.command('status')
+def status():
+    """Show notification counts by status."""
+    rows = db.session.execute(db.select(Notification.status, db.func.count(Notification.id))
+                              .group_by(Notification.status)).all()
+    for notification_status, count in sorted(rows):
+        click.echo(f'{notification_status:8} {count}')
+
+
+@notifications_cli.command('retry-failed')
+def retry_failed():
+    """Put failed notifications back in the queue with a fresh attempt budget."""
+    result = db.session.execute(
+        db.update(Notification).where(Notification.status == Notification.STATUS_FAILED)
+        .values(status=Notification.STATUS_PENDING, attempts=0, available_at=datetime.utcnow()))
+    db.session.commit()
+    click.echo(f'{result.rowcount} failed notifications requeued', err=True)
@@ -0,0 +1,115 @@
+"""
+感知哈希 (Perceptual image hashes for photo-based matching).
+
+Each processed photo gets a signature of three parts (images.process_upload):
+
+* pHash - 64 bits from the signs of the low-frequency DCT coefficients of a 32x32 grayscale
+  thumbnail; robust to rescaling, recompression and small crops (reposts of the same photo);
+* dHash - 64 bits of horizontal brightness gradients on a 9x8 thumbnail, a cheap second opinion;
+* color signature - hue histogram of the saturated pixels plus dark/grey/light bins, one hex
+  digit per bin, which ranks candidates by coat color.
+
+Near-duplicate lookup uses multi-index hashing: the 64-bit pHash is split into PHASH_BANDS
+16-bit bands stored in indexed columns. Two hashes within Hamming distance d agree to within
+d // PHASH_BANDS bits on at least one band (pigeonhole), so probing every band with its
+neighbours in that radius finds all of them through the indexes (matching.find_similar_photos).
+
+Pure Pillow/NumPy, no app or model imports: runs in the image job process pool.
+"""
+import itertools
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+PHASH_BANDS = 4
+BAND_BITS = HASH_BITS // PHASH_BANDS
+HUE_BINS = 12
+COLOR_BINS = HUE_BINS + 3 # + dark, grey, light
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so that dct(x) = M @ x."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def _bits_to_hex(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f'{value:0{HASH_BITS // 4}x}'
+
+
+def phash(img):
+    """64-bit DCT perceptual hash as 16 hex digits."""
+    pixels = np.asarray(img.convert('L').resize((_PHASH_SIZE, _PHASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:_PHASH_LOW, :_PHASH_LOW].flatten()
+    return _bits_to_hex(low > np.median(low[1:])) # The DC term only carries the mean brightness
+
+
+def dhash(img):
+    """64-bit difference hash as 16 hex digits."""
+    pixels = np.asarray(img.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _bits_to_hex((pixels[:, 1:] > pixels[:, :-1]).flatten())
+
+
+def color_signature(img):
+    """
+    Color histogram as COLOR_BINS hex digits (each bin's share of the pixels, 0-15).
+
+    Saturated pixels are binned by hue; the rest by brightness into dark / grey / light, which
+    is what black, tabby-grey and white coats come out as.
+    """
+    hsv = np.asarray(img.convert('RGB').resize((64, 64), Image.Resampling.BILINEAR).convert('HSV'), dtype=np.int32)
+    hue, saturation, value = hsv[..., 0].ravel(), hsv[..., 1].ravel(), hsv[..., 2].ravel()
+    chromatic = (saturation >= 64) & (value >= 48)
+    bins = np.where(chromatic, hue * HUE_BINS // 256,
+                    np.where(value < 64, HUE_BINS, np.where(value < 176, HUE_BINS + 1, HUE_BINS + 2)))
+    histogram = np.bincount(bins, minlength=COLOR_BINS) / bins.size
+    return ''.join(f'{min(15, round(share * 15)):x}' for share in histogram)
+
+
+def image_signature(img):
+    """All three parts for one photo, JSON-ready: {'phash', 'dhash', 'colors'}."""
+    return {'phash': phash(img), 'dhash': dhash(img), 'colors': color_signature(img)}
+
+
+def hamming(hash_a, hash_b):
+    """Number of differing bits between two hex hashes."""
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def color_similarity(colors_a, colors_b):
+    """Histogram intersection of two color signatures, in [0, 1]."""
+    a = [int(digit, 16) for digit in colors_a]
+    b = [int(digit, 16) for digit in colors_b]
+    total = max(sum(a), sum(b))
+    return sum(map(min, a, b)) / total if total else 0.0
+
+
+def hash_bands(hash_hex):
+    """The PHASH_BANDS integer bands of a hex hash, most significant first."""
+    value = int(hash_hex, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (PHASH_BANDS - 1 - band))) & mask for band in range(PHASH_BANDS)]
+
+
+def band_neighbours(band_value, radius):
+    """Every BAND_BITS-bit value within `radius` bit flips of band_value (including itself)."""
+    values = []
+    for flips in range(radius + 1):
+        for positions in itertools.combinations(range(BAND_BITS), flips):
+            flipped = band_value
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
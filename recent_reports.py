@@ -0,0 +1,131 @@
+"""
+表单页侧栏的最新启事 (Recent reports shown next to the report forms).
+
+Every GET and every re-rendered POST of /report/lost (/report/found) shows the newest found
+(lost) reports. Instead of querying them each time, recent_reports() keeps the newest
+RECENT_REPORTS_SIZE reports per type as a small list of ReportSnapshot objects in the response
+cache backend (response_cache.py), newest first:
+
+* the list is loaded with one query when missing (first request, TTL expiry, LRU eviction);
+* committed inserts, updates and deletes of reports patch it in place (session hooks below):
+  a new report is pushed to the front and the oldest falls off, and an updated one (mark as
+  found, finished thumbnails) is replaced - so in the common case the form renders with no
+  query at all.
+
+With the 'redis' backend all workers share one list per type; with 'memory' each worker keeps
+its own and sees other workers' writes after RECENT_REPORTS_TTL. Two workers committing at the
+same moment may each write back their own version; the TTL bounds that too.
+"""
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, DecodedJSON, PetLostReport, PetFoundReport
+from response_cache import get_response_cache
+
+DEFAULT_SIZE = 5
+DEFAULT_TTL = 300
+REPORT_MODELS = {'lost': PetLostReport, 'found': PetFoundReport}
+REPORT_TYPES = {model: report_type for report_type, model in REPORT_MODELS.items()}
+SKIPPED_COLUMNS = {'search_location', 'search_text'} # Only used in queries
+
+
+class ReportSnapshot:
+    """Detached, picklable copy of a report's column values, usable in the templates in its place."""
+
+    photo_urls = DecodedJSON('_photo_urls', list)
+    photo_variants = DecodedJSON('_photo_variants', dict)
+
+    def __init__(self, report):
+        # Read the instance state, not getattr(): expired attributes would be SELECTed from a session hook
+        state = db.inspect(report)
+        self.complete = True # False when a column is expired (e.g. set on a report loaded before a commit)
+        for attr in db.inspect(type(report)).column_attrs:
+            if attr.key in SKIPPED_COLUMNS:
+                continue
+            if attr.key in state.dict:
+                setattr(self, attr.key, state.dict[attr.key])
+            elif attr.key in state.expired_attributes:
+                self.complete = False
+            else:
+                setattr(self, attr.key, None) # Never set since the INSERT: NULL
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if not key.endswith('_decoded')}
+
+    @property
+    def sort_key(self):
+        return self.created_at, self.id
+
+    def __repr__(self):
+        return f'<ReportSnapshot {self.id}>'
+
+
+def _key(report_type):
+    return f'recent:{report_type}'
+
+
+def recent_reports(report_type):
+    """The newest RECENT_REPORTS_SIZE reports of report_type ('lost' or 'found') as ReportSnapshots."""
+    cache = get_response_cache()
+    if cache is not None:
+        snapshots = cache.backend.get(_key(report_type))
+        if snapshots is not None:
+            return snapshots
+    model = REPORT_MODELS[report_type]
+    size = current_app.config.get('RECENT_REPORTS_SIZE', DEFAULT_SIZE)
+    reports = model.query.order_by(model.created_at.desc(), model.id.desc()).limit(size).all()
+    snapshots = [ReportSnapshot(report) for report in reports]
+    if cache is not None:
+        cache.backend.set(_key(report_type), snapshots, current_app.config.get('RECENT_REPORTS_TTL', DEFAULT_TTL))
+    return snapshots
+
+
+def reset_recent_reports(report_type):
+    """Drop the cached list of report_type, after writes that bypass the session hooks (bulk imports)."""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.backend.delete(_key(report_type))
+
+
+def _apply_changes(cache, report_type, changes):
+    """Patch the cached list of report_type with {id: ReportSnapshot, or None if deleted}."""
+    snapshots = cache.backend.get(_key(report_type))
+    if snapshots is None:
+        return # Not loaded: the next recent_reports() call queries the current rows
+    if (any(changes.get(snapshot.id, snapshot) is None for snapshot in snapshots) # A listed report was deleted
+            or any(snapshot is not None and not snapshot.complete for snapshot in changes.values())):
+        cache.backend.delete(_key(report_type)) # Reload instead
+        return
+    changed = {report_id: snapshot for report_id, snapshot in changes.items() if snapshot is not None}
+    size = current_app.config.get('RECENT_REPORTS_SIZE', DEFAULT_SIZE)
+    updated = sorted([snapshot for snapshot in snapshots if snapshot.id not in changed] + list(changed.values()),
+                     key=lambda snapshot: snapshot.sort_key, reverse=True)[:size]
+    cache.backend.set(_key(report_type), updated, current_app.config.get('RECENT_REPORTS_TTL', DEFAULT_TTL))
+
+
+# --- 提交后更新: 在 flush 时记下启事的新值，提交成功后再写入缓存 ---
+
+@event.listens_for(Session, 'after_flush')
+def _snapshot_changed_reports(session, flush_context):
+    pending = session.info.setdefault('recent_report_changes', {})
+    for obj in (*session.new, *session.dirty):
+        if type(obj) in REPORT_TYPES:
+            pending.setdefault(REPORT_TYPES[type(obj)], {})[obj.id] = ReportSnapshot(obj)
+    for obj in session.deleted:
+        if type(obj) in REPORT_TYPES:
+            pending.setdefault(REPORT_TYPES[type(obj)], {})[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _update_recent_reports(session):
+    pending = session.info.pop('recent_report_changes', None)
+    cache = get_response_cache()
+    if pending and cache is not None:
+        for report_type, changes in pending.items():
+            _apply_changes(cache, report_type, changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_recent_report_changes(session):
+    session.info.pop('recent_report_changes', None)
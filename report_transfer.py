@@ -0,0 +1,277 @@
+"""
+启事批量导入/导出 (Bulk import and export of reports as CSV / JSONL).
+
+Reports from partner shelters and Weibo groups arrive in batches of tens of thousands. `flask
+reports import` streams the file through a generator pipeline instead of creating one ORM object
+and one commit per report:
+
+    read_rows() -> prepare_rows() -> batched() -> executemany INSERT, COMMIT every --commit-size rows
+
+* each row is validated by report_upload.report_columns(), the same rules as the H5 forms
+  (required fields, '其他品种', time formats, coordinates), plus the column lengths; invalid rows
+  are reported by line number (--rejects) and skipped;
+* search_location / search_text / geohash are computed in Python (models.derived_columns), as
+  bulk INSERTs bypass the ORM events; the SQLite FTS triggers still fire;
+* besides the form fields a row may carry user_openid, created_at (ISO 8601, keeps the original
+  posting time) and, for lost reports, is_found / found_time. Photos are not imported.
+
+`flask reports export` reads with yield_per (a server-side cursor on PostgreSQL), so memory stays
+constant whatever the table size. Exported files import again.
+
+Imported reports are not run through matching or notifications. Each commit bumps the report
+version (so cached list responses are rebuilt), and the recent-reports list is reset when the
+import finishes.
+
+    flask reports import lost shelter.csv --rejects rejected.csv
+    flask reports import found weibo.jsonl --batch-size 1000 --commit-size 20000
+    flask reports export lost --output lost.jsonl --since 2025-01-01
+"""
+import csv
+import itertools
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from models import db, PetLostReport, PetFoundReport, bump_report_versions, derived_columns
+from recent_reports import reset_recent_reports
+from report_upload import LOST_TIME_FORMAT, report_columns
+
+REPORT_MODELS = {'lost': PetLostReport, 'found': PetFoundReport}
+DEFAULT_BATCH_SIZE = 500 # Rows per executemany INSERT / per fetch when exporting
+DEFAULT_COMMIT_SIZE = 10000 # Rows per transaction
+TRUE_VALUES = {'1', 'true', 'yes', 'y', '是'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', '否'}
+# Exported columns, in file order; photo_urls holds the stored filenames (relative to UPLOAD_FOLDER)
+EXPORT_COLUMNS = {
+    'lost': ('id', 'pet_type', 'breed', 'color', 'gender', 'age', 'features', 'pet_name', 'additional_info',
+             'lost_time', 'lost_location_text', 'latitude', 'longitude', 'contact_info', 'user_openid',
+             'is_found', 'found_time', 'photo_urls', 'created_at', 'updated_at'),
+    'found': ('id', 'pet_type', 'breed', 'color', 'gender', 'features', 'found_time', 'found_location_text',
+              'latitude', 'longitude', 'contact_info', 'user_openid', 'photo_urls', 'created_at', 'updated_at'),
+}
+
+Row = namedtuple('Row', ['line', 'fields', 'error']) # fields: {name: str}; error: why the line could not be read
+
+
+def file_format(filename, fmt):
+    """--format, or the one implied by the file extension ('csv' for stdin/stdout)."""
+    if fmt:
+        return fmt
+    return 'jsonl' if os.path.splitext(filename or '')[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+# --- 导入 ---
+
+def read_rows(stream, fmt):
+    """Yield a Row per record of a CSV (with a header row) or JSONL stream, values as stripped strings."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield Row(reader.line_num, {name: (value or '').strip() for name, value in record.items() if name}, None)
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as e:
+            yield Row(line, None, f'invalid JSON: {e.msg}')
+            continue
+        if not isinstance(record, dict):
+            yield Row(line, None, 'expected a JSON object')
+            continue
+        yield Row(line, {name: _text(value) for name, value in record.items()}, None)
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+def _flag(value, name):
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f'{name}: expected 1/0 or true/false, got {value!r}')
+
+
+def _timestamp(value, name, default=None):
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name}: expected an ISO 8601 time, got {value!r}')
+
+
+def _check_lengths(table, values):
+    for name, value in values.items():
+        length = getattr(table.c[name].type, 'length', None)
+        if length and isinstance(value, str) and len(value) > length:
+            raise ValueError(f'{name}: longer than {length} characters')
+
+
+def prepare_rows(report_type, rows, reject, now=None):
+    """
+    Yield the column values of each valid row, ready for an INSERT of report_type's table;
+    reject(line, message) is called for the others.
+    """
+    model = REPORT_MODELS[report_type]
+    now = now or datetime.utcnow()
+    for row in rows:
+        if row.error:
+            reject(row.line, row.error)
+            continue
+        fields = row.fields
+        try:
+            values = report_columns(report_type, fields) # UploadRejected is a ValueError
+            values['user_openid'] = fields.get('user_openid') or None
+            values['created_at'] = values['updated_at'] = _timestamp(fields.get('created_at'), 'created_at', now)
+            if report_type == 'lost':
+                values['is_found'] = _flag(fields.get('is_found', ''), 'is_found')
+                values['found_time'] = _timestamp(fields.get('found_time'), 'found_time')
+            _check_lengths(model.__table__, values)
+        except ValueError as e:
+            reject(row.line, str(e))
+            continue
+        values.update(derived_columns(model, values), _photo_urls=None, _photo_variants=None, photos_processing=False)
+        yield values
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def import_reports(report_type, rows, batch_size=DEFAULT_BATCH_SIZE, commit_size=DEFAULT_COMMIT_SIZE,
+                   dry_run=False, progress=None):
+    """
+    Insert the prepared rows (prepare_rows()) with one executemany INSERT per batch, committing
+    every commit_size rows. Returns the number of rows inserted (validated, with dry_run).
+    """
+    table = REPORT_MODELS[report_type].__table__
+    inserted = uncommitted = 0
+    for batch in batched(rows, batch_size):
+        if dry_run:
+            inserted += len(batch)
+            continue
+        db.session.execute(table.insert(), batch)
+        inserted += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= commit_size:
+            bump_report_versions(db.session.connection(), [report_type]) # Bulk INSERTs bypass the flush hook
+            db.session.commit()
+            uncommitted = 0
+            if progress:
+                progress(inserted)
+    if not dry_run:
+        if uncommitted:
+            bump_report_versions(db.session.connection(), [report_type])
+        db.session.commit()
+        reset_recent_reports(report_type) # The bulk INSERTs bypassed the session hooks that keep it current
+    return inserted
+
+
+# --- 导出 ---
+
+def export_rows(report_type, since=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield {column: value} for each report of report_type in id order, fetched batch_size rows at a time."""
+    model = REPORT_MODELS[report_type]
+    names = EXPORT_COLUMNS[report_type]
+    columns = [model.__table__.c['_photo_urls' if name == 'photo_urls' else name] for name in names]
+    query = db.select(*columns).order_by(model.id)
+    if since:
+        query = query.where(model.created_at >= since)
+    # yield_per streams the result (stream_results: a server-side cursor on PostgreSQL) in batch_size chunks
+    for row in db.session.execute(query.execution_options(yield_per=batch_size)):
+        yield dict(zip(names, row))
+
+
+def _export_value(name, value, fmt):
+    if name == 'photo_urls':
+        photos = json.loads(value) if value else []
+        return photos if fmt == 'jsonl' else json.dumps(photos, ensure_ascii=False)
+    if isinstance(value, datetime):
+        # lost_time in the format report_columns() parses back; the others as ISO 8601
+        return value.strftime(LOST_TIME_FORMAT) if name == 'lost_time' else value.isoformat()
+    if isinstance(value, bool) and fmt == 'csv':
+        return int(value)
+    return value
+
+
+def write_rows(rows, output, fmt, names):
+    """Write the exported rows to output; returns how many were written."""
+    written = 0
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(output, fieldnames=names)
+        writer.writeheader()
+    for row in rows:
+        row = {name: _export_value(name, value, fmt) for name, value in row.items()}
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            output.write(json.dumps(row, ensure_ascii=False) + '\n')
+        written += 1
+    return written
+
+
+# --- flask reports ... ---
+reports_cli = AppGroup('reports', help='启事批量导入/导出 (Bulk report import/export).')
+
+
+@reports_cli.command('import')
+@click.argument('report_type', type=click.Choice(['lost', 'found']))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension, else csv.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per INSERT.')
+@click.option('--commit-size', default=DEFAULT_COMMIT_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--rejects', type=click.File('w', encoding='utf-8'), help='Write the rejected lines (line, error) as CSV.')
+@click.option('--dry-run', is_flag=True, help='Validate only, write nothing.')
+def import_command(report_type, source, fmt, batch_size, commit_size, rejects, dry_run):
+    """Import lost/found reports from a CSV or JSONL file (columns named like the form fields)."""
+    rejected = []
+    reject_writer = csv.writer(rejects) if rejects else None
+    if reject_writer:
+        reject_writer.writerow(['line', 'error'])
+
+    def reject(line, message):
+        rejected.append(line)
+        if reject_writer:
+            reject_writer.writerow([line, message])
+        elif len(rejected) <= 20:
+            click.echo(f'line {line}: {message}', err=True)
+
+    started = time.perf_counter()
+    rows = prepare_rows(report_type, read_rows(source, file_format(source.name, fmt)), reject)
+    imported = import_reports(report_type, rows, batch_size, commit_size, dry_run,
+                              progress=lambda count: click.echo(f'{count} rows committed', err=True))
+    elapsed = time.perf_counter() - started
+    if len(rejected) > 20 and not reject_writer:
+        click.echo(f'... {len(rejected) - 20} more rejected lines (use --rejects FILE to list them all)', err=True)
+    click.echo(f"{imported} {report_type} reports {'validated' if dry_run else 'imported'}, {len(rejected)} rejected "
+               f"in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s)", err=True)
+
+
+@reports_cli.command('export')
+@click.argument('report_type', type=click.Choice(['lost', 'found']))
+@click.option('--output', type=click.File('w', encoding='utf-8', lazy=False), default='-',
+              help='File (default: stdout); created even when no report is exported.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension, else csv.')
+@click.option('--since', type=click.DateTime(), help='Only reports created at or after this time.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows fetched at a time.')
+def export_command(report_type, output, fmt, since, batch_size):
+    """Export lost/found reports as CSV or JSONL, streaming from the database."""
+    fmt = file_format(output.name, fmt)
+    written = write_rows(export_rows(report_type, since, batch_size), output, fmt, EXPORT_COLUMNS[report_type])
+    click.echo(f'{written} {report_type} reports exported', err=True)
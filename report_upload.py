@@ -0,0 +1,211 @@
+"""
+流式解析启事表单 (Streaming parser for report submissions with photos).
+
+request.form / request.files make werkzeug read and spool the whole multipart body (up to
+MAX_CONTENT_LENGTH) before the route can look at a single field. parse_report_submission()
+instead feeds request.stream through werkzeug's sans-IO MultipartDecoder:
+
+* text fields are collected first (the forms put the photo input last), and the required
+  fields are checked as soon as the first photo part starts;
+* each photo is type-checked from its first bytes (magic numbers, not the client's filename)
+  and then streamed straight into the upload store (uploads.UploadWriter), hashing on the way;
+* a missing field, a non-image or one photo too many aborts immediately, without reading or
+  writing the rest of the upload.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app, request
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from models import db
+from uploads import UploadWriter, CHUNK_SIZE
+
+MAX_PHOTOS = 3
+PHOTO_FIELD = 'photos'
+OTHER_BREED = '其他品种'
+REQUIRED_FIELDS = {
+    'lost': ('pet_type', 'breed', 'color', 'gender', 'features', 'lost_time', 'lost_location_text', 'contact_info'),
+    'found': ('pet_type', 'color', 'gender', 'features', 'found_time', 'found_location_text', 'contact_info'),
+}
+SNIFF_BYTES = 12 # Enough for every signature below
+LOST_TIME_FORMAT = '%Y-%m-%dT%H:%M' # <input type="datetime-local">; found_time also accepts any ISO 8601 time
+
+ReportSubmission = namedtuple('ReportSubmission', ['form', 'photos'])
+
+
+class UploadRejected(ValueError):
+    """A submission refused before it was fully read; message is shown to the user."""
+
+    def __init__(self, message, form):
+        super().__init__(message)
+        self.message = message
+        self.form = form # The fields received so far, for re-rendering the form
+
+
+def sniff_image_type(head):
+    """File extension for the image format of these leading bytes, or None if not a known image."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def check_required_fields(report_type, form):
+    """Raise UploadRejected if a required field of report_type is missing."""
+    if form.get('breed') == OTHER_BREED and not form.get('other_breed', '').strip():
+        raise UploadRejected('选择了“其他品种”时，请填写具体品种。', form)
+    missing = [field for field in REQUIRED_FIELDS[report_type] if not form.get(field)]
+    if missing:
+        raise UploadRejected(f'请填写所有必填项: {", ".join(missing)}', form)
+
+
+def report_columns(report_type, form):
+    """
+    Column values of a report_type report from its form fields, validated as the H5 forms do:
+    required fields, the '其他品种' breed and the time format. Coordinates that are not numbers
+    are dropped - the report is accepted without a map position.
+    Shared by report_lost()/report_found() and `flask reports import` (report_transfer.py).
+    :raises UploadRejected: with the message the form shows.
+    """
+    check_required_fields(report_type, form)
+    columns = {
+        'pet_type': form['pet_type'], 'color': form['color'], 'gender': form['gender'], 'features': form['features'],
+        'contact_info': form['contact_info'],
+        'latitude': _coordinate(form.get('latitude')), 'longitude': _coordinate(form.get('longitude')),
+    }
+    if report_type == 'lost':
+        try:
+            lost_time = datetime.strptime(form['lost_time'], LOST_TIME_FORMAT)
+        except ValueError:
+            raise UploadRejected('丢失时间格式无效，请使用日期时间选择器。', form)
+        columns.update(breed=form['breed'], age=form.get('age'), pet_name=form.get('pet_name'),
+                       additional_info=form.get('additional_info'), lost_time=lost_time,
+                       lost_location_text=form['lost_location_text'])
+    else:
+        breed = form.get('breed')
+        if breed == OTHER_BREED:
+            breed = form['other_breed'].strip()
+        try:
+            found_time = datetime.fromisoformat(form['found_time'])
+        except ValueError:
+            raise UploadRejected('拾获时间格式无效，请使用日期时间选择器。', form)
+        columns.update(breed=breed or None, found_time=found_time, found_location_text=form['found_location_text'])
+    return columns
+
+
+def invalid_coordinates(form, columns):
+    """True if the form sent a latitude/longitude that report_columns() had to drop."""
+    return any(form.get(name) and columns[name] is None for name in ('latitude', 'longitude'))
+
+
+def _coordinate(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_report_submission(report_type):
+    """
+    Parse the POSTed report form of report_type ('lost' or 'found'), storing its photos.
+
+    The stored photos are added to the current session (see UploadWriter.commit) for the caller
+    to commit with the report. On UploadRejected the session is rolled back and the rest of the
+    request body is left unread.
+    :return: ReportSubmission(form=MultiDict of text fields, photos=[StoredFile, ...])
+    """
+    content_type, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if content_type != 'multipart/form-data' or 'boundary' not in options:
+        form = MultiDict(request.form) # No photos possible; werkzeug parses the small body as usual
+        check_required_fields(report_type, form)
+        return ReportSubmission(form, [])
+
+    parser = _SubmissionParser(report_type)
+    try:
+        return parser.parse(request.stream, options['boundary'].encode())
+    except UploadRejected:
+        parser.discard()
+        db.session.rollback()
+        raise
+
+
+class _SubmissionParser:
+    def __init__(self, report_type):
+        self.report_type = report_type
+        self.allowed = current_app.config.get('ALLOWED_EXTENSIONS', {'jpg', 'png', 'gif'})
+        self.form = MultiDict()
+        self.photos = []
+        self.fields_checked = False
+        self.part = None # Current Field/File event
+        self.chunks = [] # Field value, or photo bytes before the type is known
+        self.writer = None
+        self.extension = None
+
+    def parse(self, stream, boundary):
+        decoder = MultipartDecoder(boundary, max_form_memory_size=request.max_form_memory_size,
+                                   max_parts=request.max_form_parts)
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            decoder.receive_data(data or None) # None marks the end of the body
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                self._handle(event)
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not data:
+                break
+        if not self.fields_checked:
+            check_required_fields(self.report_type, self.form)
+        return ReportSubmission(self.form, self.photos)
+
+    def _handle(self, event):
+        if isinstance(event, (Field, File)):
+            self.part, self.chunks, self.writer, self.extension = event, [], None, None
+            if self._is_photo(event):
+                if not self.fields_checked:
+                    check_required_fields(self.report_type, self.form)
+                    self.fields_checked = True
+                if len(self.photos) >= MAX_PHOTOS:
+                    raise UploadRejected(f'最多只能上传{MAX_PHOTOS}张照片。请选择不超过{MAX_PHOTOS}张照片后重新提交。', self.form)
+        elif isinstance(event, Data):
+            if isinstance(self.part, Field):
+                self.chunks.append(event.data)
+                if not event.more_data:
+                    self.form.add(self.part.name, b''.join(self.chunks).decode('utf-8', 'replace'))
+            elif self._is_photo(self.part):
+                self._photo_data(event.data)
+                if not event.more_data:
+                    self._photo_data(b'', end=True)
+            # Data of other file inputs is dropped
+
+    def _is_photo(self, part):
+        # Browsers send an empty part with filename="" when no file was chosen
+        return isinstance(part, File) and part.name == PHOTO_FIELD and part.filename
+
+    def _photo_data(self, data, end=False):
+        if self.writer is None:
+            self.chunks.append(data)
+            head = b''.join(self.chunks)
+            if len(head) < SNIFF_BYTES and not end:
+                return
+            self.extension = sniff_image_type(head)
+            if self.extension not in self.allowed:
+                allowed = ', '.join(sorted(self.allowed))
+                raise UploadRejected(f'文件 "{self.part.filename}" 不是支持的图片格式。请上传以下类型的文件: {allowed}。', self.form)
+            self.writer = UploadWriter()
+            data = head
+        self.writer.write(data)
+        if end:
+            self.photos.append(self.writer.commit('.' + self.extension))
+            self.writer = None
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.discard()
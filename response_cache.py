@@ -0,0 +1,267 @@
+"""
+列表/搜索响应缓存 (Response cache for the report list and search endpoints).
+
+Reports change a few times a minute while the list pages are requested on every WeChat menu
+click, so cached_view() keeps the rendered responses of /reports, /api/reports and /api/search:
+
+* keys are the endpoint plus the normalized query parameters it reads (empty values dropped,
+  sorted), so '?pet_type=猫&color=' and '?color=&pet_type=猫' share an entry;
+* entries expire after RESPONSE_CACHE_TTL seconds and the in-process backend evicts the least
+  recently used beyond RESPONSE_CACHE_MAX_ENTRIES;
+* every key also carries listing.report_version() of the report types it depends on (the
+  report_versions counters, bumped in every transaction that changes a report table). A change
+  committed by any worker or process orphans exactly the entries built from that table -
+  submitting a found report keeps the cached lost-only pages. Old entries simply age out.
+
+RESPONSE_CACHE_BACKEND selects the store:
+
+* 'memory' (default) - per process;
+* 'redis'  - shared by all workers (and the `flask images worker` process) at RESPONSE_CACHE_URL;
+  any client with redis-py's get/set(ex=, nx=)/delete works, e.g. a local stand-in in tests;
+* 'none'   - caching disabled.
+
+conditional_view() adds HTTP revalidation on top: list responses carry a weak ETag derived
+from listing.report_version() (the report_versions counters, bumped in every transaction that
+changes a report table) plus Last-Modified and Cache-Control: no-cache, so the WeChat browser's
+constant reloads are answered with 304 after a primary-key read, without rendering or sending
+the page. Both read the version once per request, so a cached body is never sent with the ETag
+of newer data. Uploads never change under their (content-hash) names and are served with a long-lived
+immutable Cache-Control (upload_cache_headers).
+"""
+import functools
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import timezone
+
+from flask import current_app, g, has_app_context, make_response, request, session
+
+from listing import report_version
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_UPLOAD_MAX_AGE = 365 * 24 * 3600
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'status', 'mimetype'])
+
+
+class MemoryCacheBackend:
+    """Thread-safe in-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        """set() only if key holds no live entry; True if this call stored value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCacheBackend:
+    """
+    Shared backend on a Redis-compatible client (get, set with ex=/nx=, delete, scan_iter).
+
+    Expiry and eviction are left to the server (TTL per key; configure maxmemory-policy
+    allkeys-lru there).
+    """
+
+    def __init__(self, client, prefix='petfinder:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND='redis' requires the redis package (pip install redis)") from e
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def add(self, key, value, ttl):
+        """set() only if key is absent (SET NX EX); True if this call stored value."""
+        return bool(self.client.set(self.prefix + key, pickle.dumps(value), nx=True, ex=max(1, int(ttl))))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + 'view:*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, endpoint, params, version):
+        query = '&'.join(f'{name}={value}' for name, value in params)
+        return f'view:{endpoint}:{version}:{query}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+
+def init_response_cache(app):
+    """Create the cache configured by RESPONSE_CACHE_* (app.extensions['response_cache'], None if disabled)."""
+    kind = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    if kind == 'memory':
+        backend = MemoryCacheBackend(app.config.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    elif kind == 'redis':
+        backend = RedisCacheBackend.from_url(app.config['RESPONSE_CACHE_URL'])
+    elif kind == 'none':
+        backend = None
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {kind!r} (memory, redis or none)')
+    cache = ResponseCache(backend, app.config.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)) if backend else None
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def get_response_cache():
+    return current_app.extensions.get('response_cache') if has_app_context() else None
+
+
+def normalized_params(args, names):
+    """Sorted (name, value) pairs of the non-empty query parameters in names."""
+    return tuple(sorted((name, args[name].strip()) for name in names if args.get(name, '').strip()))
+
+
+def request_report_version():
+    """listing.report_version() for this request's report_type, read once per request."""
+    if 'report_version' not in g:
+        g.report_version = report_version(request.args.get('report_type', 'all'))
+    return g.report_version
+
+
+def cached_view(params):
+    """
+    Cache successful GET responses of a view, keyed on the query parameters named in params.
+
+    Requests with pending flash messages bypass the cache: their page shows the messages,
+    and a cached page would neither show nor consume them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_response_cache()
+            if cache is None or request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            token, _ = request_report_version()
+            key = cache.key(request.endpoint, normalized_params(request.args, params), token)
+            cached = cache.get(key)
+            if cached is not None:
+                response = current_app.response_class(cached.body, status=cached.status, mimetype=cached.mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                cache.set(key, CachedResponse(response.get_data(), response.status_code, response.mimetype))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_view(params):
+    """
+    Answer GETs whose If-None-Match / If-Modified-Since still match the data with 304, unrendered.
+
+    :param params: Query parameters the response depends on, as for cached_view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs) # A page showing flash messages must not be revalidated later
+            token, last_modified = request_report_version()
+            etag = hashlib.sha1(f'{request.endpoint}|{normalized_params(request.args, params)}|{token}'.encode()).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True # Cache, but revalidate every time
+            return response
+        return wrapper
+    return decorator
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag) # If-Modified-Since is ignored when both are sent
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def upload_cache_headers(response):
+    """after_request hook: cache photos under static/uploads for UPLOAD_CACHE_MAX_AGE, immutable."""
+    if (request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('uploads/')
+            and response.status_code in (200, 206, 304)):
+        response.cache_control.no_cache = None # Set by send_file when no max_age is configured
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('UPLOAD_CACHE_MAX_AGE', DEFAULT_UPLOAD_MAX_AGE)
+        response.cache_control.immutable = True
+    return response
+
@@ -0,0 +1,456 @@
+"""
+Load-test the H5 and WeChat endpoints: throughput and p50/p95/p99 latency per endpoint.
+
+Seeds a database (SQLite file by default, or --database-url, e.g. PostgreSQL) with synthetic
+lost/found reports sharing a pool of processed photos, then sends each scenario's requests from
+--concurrency threads:
+
+* home          GET  /
+* reports       GET  /reports, cycling through pet_type/color filters
+* lost_form     GET  /report/lost
+* lost_submit   POST /report/lost, multipart with one distinct JPEG per request
+* found_form    GET  /report/found
+* found_submit  POST /report/found, multipart with one distinct JPEG per request
+* mark_found    POST /report/<id>/found on a different unfound report each time
+* wechat        POST /wechat, distinct menu CLICK events
+
+Drivers:
+
+* wsgi     - in-process through the Flask test client (one client per thread): the app's own
+             cost, without a server or sockets;
+* gunicorn - `gunicorn -w N app:create_app()` on a local port, driven over HTTP with a
+             keep-alive requests.Session per thread.
+
+Results are written as JSON (--output); --compare BASELINE.json prints the change against an
+earlier run and exits non-zero when a scenario's p95 regressed by more than --max-regression.
+The same --seed and --reports give the same data, so runs on one machine are comparable.
+
+Usage:
+    python scripts/bench_http.py --output bench.json
+    python scripts/bench_http.py --driver gunicorn --workers 4 --concurrency 16 --compare bench.json
+    python scripts/bench_http.py --database-url postgresql://localhost/petfinder_bench --reports 50000
+"""
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PET_TYPES = ('猫', '狗', '其他')
+BREEDS = {'猫': ('橘猫', '狸花猫', '英短', '布偶', '暹罗'), '狗': ('柯基', '金毛', '泰迪', '柴犬', '中华田园犬'),
+          '其他': ('兔子', '仓鼠', '鹦鹉')}
+COLORS = ('橘色', '黑色', '白色', '灰色', '黄白', '三花')
+GENDERS = ('公', '母', '未知')
+DISTRICTS = ('南岗区', '道里区', '道外区', '香坊区', '松北区', '平房区')
+PLACES = ('中央大街', '哈工大', '会展中心', '哈西万达', '太阳岛', '医大二院', '红博广场')
+FEATURES = ('左耳有缺口', '戴红色项圈', '尾巴很短', '右前腿有白斑', '怕生，叫名字会回应', '刚做过绝育')
+HARBIN = (45.75, 126.63)
+SCENARIOS = ('home', 'reports', 'lost_form', 'lost_submit', 'found_form', 'found_submit', 'mark_found', 'wechat')
+# Results are only comparable when these match
+COMPARABLE_SETTINGS = ('driver', 'workers', 'concurrency', 'reports', 'photos', 'database', 'image_mode', 'cpus')
+EXPECTED_STATUS = {'lost_submit': 302, 'found_submit': 302, 'mark_found': 302} # Others answer 200
+
+
+# --- 测试数据 ---
+
+def synthetic_jpeg(rng, width=640, height=480):
+    """A distinct JPEG: a random two-colour gradient with a few blocks."""
+    from PIL import Image, ImageDraw
+    start, end = [rng.randrange(256) for _ in range(3)], [rng.randrange(256) for _ in range(3)]
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    img = Image.merge('RGB', [band.point(lambda v, a=a, b=b: a + (b - a) * v // 255)
+                              for band, a, b in zip(img.split(), start, end)])
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def report_fields(rng, report_type):
+    pet_type = rng.choice(PET_TYPES)
+    when = datetime(2025, 6, 1) - timedelta(minutes=rng.randrange(90 * 24 * 60))
+    fields = {
+        'pet_type': pet_type, 'breed': rng.choice(BREEDS[pet_type]), 'color': rng.choice(COLORS),
+        'gender': rng.choice(GENDERS), 'features': '，'.join(rng.sample(FEATURES, 2)),
+        'contact_info': f'138{rng.randrange(10 ** 8):08d}',
+        'latitude': round(HARBIN[0] + rng.uniform(-0.15, 0.15), 6),
+        'longitude': round(HARBIN[1] + rng.uniform(-0.2, 0.2), 6),
+    }
+    location = f'{rng.choice(DISTRICTS)}{rng.choice(PLACES)}附近'
+    if report_type == 'lost':
+        fields.update(lost_time=when, lost_location_text=location, pet_name=rng.choice(('咪咪', '旺财', '豆豆', None)))
+    else:
+        fields.update(found_time=when, found_location_text=location)
+    return fields, when
+
+
+def seed_database(app, reports, photos, seed):
+    """Insert `reports` lost and `reports` found reports into an empty database; returns False if it had data."""
+    from image_jobs import record_photo_hash
+    from images import process_upload
+    from models import db, PetLostReport, PetFoundReport, StoredFile
+    from uploads import UploadWriter
+
+    rng = random.Random(seed)
+    with app.app_context():
+        if db.session.query(PetLostReport.id).first() is not None:
+            return False
+        pool = [] # (filename, variants, signature) of processed photos shared by the reports
+        for _ in range(photos):
+            writer = UploadWriter()
+            writer.write(synthetic_jpeg(rng))
+            stored = writer.commit('.jpg')
+            variants, signature = process_upload(os.path.join(app.config['UPLOAD_FOLDER'], stored.filename))
+            stored.variants, stored.signature = json.dumps(variants), json.dumps(signature)
+            pool.append((stored.filename, variants, signature))
+        db.session.commit()
+
+        for report_type, model in (('lost', PetLostReport), ('found', PetFoundReport)):
+            for batch_start in range(0, reports, 500):
+                batch = []
+                for _ in range(min(500, reports - batch_start)):
+                    fields, when = report_fields(rng, report_type)
+                    chosen = rng.sample(pool, min(len(pool), rng.choice((0, 1, 1, 2))))
+                    report = model(**fields, photo_urls=[name for name, _, _ in chosen],
+                                   created_at=when + timedelta(hours=1), updated_at=when + timedelta(hours=1))
+                    report.photo_variants = {name: variants for name, variants, _ in chosen}
+                    if report_type == 'lost' and rng.random() < 0.3:
+                        report.is_found, report.found_time = True, when + timedelta(days=2)
+                    batch.append((report, chosen))
+                db.session.add_all(report for report, _ in batch)
+                db.session.flush()
+                for report, chosen in batch:
+                    for name, _, signature in chosen:
+                        record_photo_hash(report_type, report.id, name, signature)
+                        db.session.execute(db.update(StoredFile).where(StoredFile.filename == name)
+                                           .values(refcount=StoredFile.refcount + 1))
+                db.session.commit()
+    return True
+
+
+def unfound_lost_ids(app):
+    from models import db, PetLostReport
+    with app.app_context():
+        return db.session.scalars(db.select(PetLostReport.id).where(PetLostReport.is_found.is_(False))
+                                  .order_by(PetLostReport.id)).all()
+
+
+# --- 请求 ---
+
+def multipart(fields, photo):
+    from werkzeug.datastructures import FileStorage
+    from werkzeug.test import encode_multipart
+    values = {name: value for name, value in fields.items() if value is not None}
+    values['photos'] = FileStorage(io.BytesIO(photo), filename='photo.jpg', content_type='image/jpeg')
+    boundary, body = encode_multipart(values)
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def form_fields(rng, report_type):
+    fields, when = report_fields(rng, report_type)
+    time_field = f'{report_type}_time'
+    fields[time_field] = when.strftime('%Y-%m-%dT%H:%M')
+    return {name: str(value) if value is not None else None for name, value in fields.items()}
+
+
+def wechat_click(index):
+    return (f'<xml><ToUserName><![CDATA[gh_bench]]></ToUserName><FromUserName><![CDATA[oBench{index % 5000:04d}]]>'
+            f'</FromUserName><CreateTime>{1700000000 + index}</CreateTime><MsgType><![CDATA[event]]></MsgType>'
+            f'<Event><![CDATA[CLICK]]></Event><EventKey><![CDATA[{("LOST", "FOUND", "SEARCH")[index % 3]}]]>'
+            f'</EventKey></xml>').encode()
+
+
+def build_requests(name, count, rng, lost_ids):
+    """The scenario's (method, path, body, content type) requests, built before timing starts."""
+    if name == 'home':
+        return [('GET', '/', None, None)] * count
+    if name == 'reports':
+        filters = [''] + [f'?pet_type={pet_type}' for pet_type in PET_TYPES] + [f'?color={color}' for color in COLORS]
+        return [('GET', '/reports' + filters[index % len(filters)], None, None) for index in range(count)]
+    if name in ('lost_form', 'found_form'):
+        return [('GET', f'/report/{name[:-5]}', None, None)] * count
+    if name in ('lost_submit', 'found_submit'):
+        report_type = name[:-7]
+        return [('POST', f'/report/{report_type}',
+                 *multipart(form_fields(rng, report_type), synthetic_jpeg(rng, 1280, 960))) for _ in range(count)]
+    if name == 'mark_found':
+        if not lost_ids:
+            return []
+        ids = lost_ids[-count:] # Reports marked by earlier runs on a --workdir database are excluded already
+        return [('POST', f'/report/{ids[index % len(ids)]}/found', None, None) for index in range(count)]
+    if name == 'wechat':
+        return [('POST', '/wechat', wechat_click(index), 'text/xml') for index in range(count)]
+    raise ValueError(name)
+
+
+class WSGIDriver:
+    """Requests through the Flask test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, body, content_type):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, content_type=content_type)
+        response.close()
+        return response.status_code
+
+
+class HTTPDriver:
+    """Requests over HTTP, one keep-alive session per thread."""
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url
+        self._local = threading.local()
+
+    def send(self, method, path, body, content_type):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.requests.Session()
+        headers = {'Content-Type': content_type} if content_type else {}
+        response = session.request(method, self.base_url + path, data=body, headers=headers, allow_redirects=False)
+        response.content # Read the whole body, as a browser would
+        return response.status_code
+
+
+def run_scenario(driver, requests_, concurrency):
+    """Send the requests from `concurrency` threads; returns (latencies in seconds, statuses, wall seconds)."""
+    latencies, statuses = [], []
+    next_index = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            index = next(next_index)
+            if index >= len(requests_):
+                return
+            started = time.perf_counter()
+            try:
+                status = driver.send(*requests_[index])
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def summarize(name, latencies, statuses, seconds):
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    expected = str(EXPECTED_STATUS.get(name, 200))
+    milliseconds = sorted(latency * 1000 for latency in latencies)
+    cuts = statistics.quantiles(milliseconds, n=100, method='inclusive') if len(milliseconds) > 1 else milliseconds * 99
+    return {
+        'requests': len(latencies),
+        'errors': len(latencies) - counts.get(expected, 0),
+        'statuses': counts,
+        'seconds': round(seconds, 3),
+        'rps': round(len(latencies) / seconds, 1) if seconds else None,
+        'latency_ms': {'mean': round(statistics.fmean(milliseconds), 2), 'p50': round(cuts[49], 2),
+                       'p95': round(cuts[94], 2), 'p99': round(cuts[98], 2), 'max': round(milliseconds[-1], 2)},
+    }
+
+
+# --- gunicorn ---
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port, log_path):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '1', '--bind', f'127.0.0.1:{port}',
+         '--error-logfile', log_path, '--log-level', 'info', '--chdir', ROOT, 'app:create_app()'],
+        env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    import requests
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'gunicorn exited with {server.returncode}, see {log_path}')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/ping', timeout=1).ok:
+                return server
+        except requests.RequestException: # Not listening yet, or no worker booted yet
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f'gunicorn did not answer within 60s, see {log_path}')
+
+
+# --- 结果 ---
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    if baseline:
+        differences = [f"{key}={baseline['meta'].get(key)}" for key in COMPARABLE_SETTINGS
+                       if baseline['meta'].get(key) != results['meta'][key]]
+        if differences:
+            print(f"Note: the baseline ran with different settings ({', '.join(differences)})")
+    print(f"{'scenario':14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+          + ('   p95 vs baseline' if baseline else ''))
+    for name, result in results['scenarios'].items():
+        latency = result['latency_ms']
+        line = (f"{name:14} {result['rps']:8.1f} {latency['p50']:8.2f} {latency['p95']:8.2f} {latency['p99']:8.2f} "
+                f"{result['errors']:7d}")
+        before = (baseline or {}).get('scenarios', {}).get(name)
+        if before:
+            line += f"   {(latency['p95'] / before['latency_ms']['p95'] - 1) * 100:+6.1f}%"
+        print(line)
+
+
+def regressions(results, baseline, max_regression):
+    """Scenarios whose p95 grew by more than max_regression (a fraction) against the baseline."""
+    slower = []
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before and result['latency_ms']['p95'] > before['latency_ms']['p95'] * (1 + max_regression):
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--driver', choices=('wsgi', 'gunicorn'), default='wsgi')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--reports', type=int, default=2000, help='Seeded reports of each type')
+    parser.add_argument('--photos', type=int, default=50, help='Distinct photos shared by the seeded reports')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help='Database to seed and use (default: SQLite file in --workdir)')
+    parser.add_argument('--workdir', help='Keep the database and uploads here and reuse them (default: temporary)')
+    parser.add_argument('--image-mode', default='external',
+                        help="IMAGE_PROCESSING_MODE during the run; 'external' leaves photo compression out of the numbers")
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95 growth against --compare (0.2 = 20%%)')
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='petfinder-bench-')
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+    # Read by config.py at import time, and inherited by the gunicorn workers
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['IMAGE_PROCESSING_MODE'] = args.image_mode
+    os.environ.pop('WECHAT_MATCH_TEMPLATE_ID', None) # No template messages to the real WeChat API
+    log_path = os.path.join(workdir, 'app.log')
+    # Like under gunicorn, app logs go through the queue to a file handler (structured_logging.py)
+    gunicorn_error_logger = logging.getLogger('gunicorn.error')
+    gunicorn_error_logger.addHandler(logging.FileHandler(log_path))
+    gunicorn_error_logger.setLevel(logging.INFO)
+
+    from app import create_app
+    from models import db
+    app = create_app()
+    started = time.perf_counter()
+    if seed_database(app, args.reports, args.photos, args.seed):
+        print(f'Seeded {args.reports} lost + {args.reports} found reports, {args.photos} photos '
+              f'in {time.perf_counter() - started:.1f}s')
+    lost_ids = unfound_lost_ids(app)
+    with app.app_context():
+        dialect = db.engine.dialect.name
+
+    server = None
+    if args.driver == 'gunicorn':
+        port = free_port()
+        server = start_gunicorn(args.workers, port, log_path)
+        driver = HTTPDriver(f'http://127.0.0.1:{port}')
+    else:
+        driver = WSGIDriver(app)
+
+    rng = random.Random(args.seed)
+    results = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z', 'revision': git_revision(),
+            'driver': args.driver, 'workers': args.workers if server else 1, 'concurrency': args.concurrency,
+            'requests': args.requests, 'reports': args.reports, 'photos': args.photos, 'seed': args.seed,
+            'database': dialect,
+            'image_mode': args.image_mode, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in scenarios:
+            requests_ = build_requests(name, args.warmup + args.requests, rng, lost_ids)
+            if not requests_:
+                print(f'{name}: skipped (no unfound lost reports left)')
+                continue
+            run_scenario(driver, requests_[:args.warmup], args.concurrency)
+            latencies, statuses, seconds = run_scenario(driver, requests_[args.warmup:], args.concurrency)
+            results['scenarios'][name] = summarize(name, latencies, statuses, seconds)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        log_queue = app.extensions.get('log_queue')
+        if log_queue is not None:
+            log_queue.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if baseline:
+        slower = regressions(results, baseline, args.max_regression)
+        if slower:
+            print(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark per-image CPU time of upload compression with and without reduced-size JPEG decoding.
+
+Compresses copies of each sample with images.compress_image_file(fast_decode=False) (full
+decode + LANCZOS, the previous behaviour) and fast_decode=True (Image.draft DCT scaling), and
+prints the median process CPU time plus the PSNR between the two outputs.
+
+Usage:
+    python scripts/bench_image_decode.py                    # synthetic 12MP phone-style photos
+    python scripts/bench_image_decode.py photo1.jpg a.png   # your own samples
+    python scripts/bench_image_decode.py --repeat 9 --max-width 1024
+"""
+import argparse
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops, ImageStat  # noqa: E402
+
+from images import compress_image_file, EXIF_ORIENTATION  # noqa: E402
+
+
+def make_samples(folder):
+    """Synthetic stand-ins for phone uploads: 4032x3024 JPEGs (one rotated via EXIF) and a PNG."""
+    size = (4032, 3024)
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 24)
+    photo = Image.merge('RGB', (gradient, ImageChops.add(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise, 2),
+                                noise))
+    samples = []
+    for name, orientation in (('landscape.jpg', 1), ('portrait_exif6.jpg', 6)):
+        path = os.path.join(folder, name)
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        photo.save(path, 'JPEG', quality=92, exif=exif)
+        samples.append(path)
+    path = os.path.join(folder, 'screenshot.png')
+    photo.resize((2048, 1536)).save(path, 'PNG')
+    samples.append(path)
+    return samples
+
+
+def time_compress(source, workdir, fast_decode, max_width, repeat):
+    """Median CPU seconds of compress_image_file on a fresh copy of source, and the last output path."""
+    timings = []
+    target = os.path.join(workdir, f"{'fast' if fast_decode else 'full'}_{os.path.basename(source)}")
+    for _ in range(repeat):
+        shutil.copyfile(source, target)
+        start = time.process_time()
+        compress_image_file(target, max_width=max_width, fast_decode=fast_decode)
+        timings.append(time.process_time() - start)
+    return statistics.median(timings), target
+
+
+def psnr(path_a, path_b):
+    a, b = Image.open(path_a).convert('RGB'), Image.open(path_b).convert('RGB')
+    if a.size != b.size:
+        return float('nan')
+    mse = statistics.mean(value ** 2 for value in ImageStat.Stat(ImageChops.difference(a, b)).rms)
+    return float('inf') if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('samples', nargs='*', help='Image files (default: generated samples)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-width', type=int, default=1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_image_decode_')
+    try:
+        samples = args.samples or make_samples(workdir)
+        print(f"{'sample':28} {'size':>11} {'full ms':>8} {'fast ms':>8} {'speedup':>8} {'out':>10} {'PSNR dB':>8}")
+        for source in samples:
+            with Image.open(source) as img:
+                size = f'{img.width}x{img.height}'
+            full, full_out = time_compress(source, workdir, False, args.max_width, args.repeat)
+            fast, fast_out = time_compress(source, workdir, True, args.max_width, args.repeat)
+            with Image.open(fast_out) as img:
+                out = f'{img.width}x{img.height}'
+            print(f'{os.path.basename(source)[:28]:28} {size:>11} {full * 1000:8.1f} {fast * 1000:8.1f} '
+                  f'{full / fast:7.1f}x {out:>10} {psnr(full_out, fast_out):8.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
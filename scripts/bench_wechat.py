@@ -0,0 +1,138 @@
+"""
+Benchmark WeChat message handling throughput (messages/sec).
+
+Measures a mix of menu CLICK events and text messages through:
+
+* dispatcher - wechat.parse_message() + WeChatDispatcher.dispatch(), the per-message work;
+* previous   - the former inline handling (ElementTree find() per field, menu dict rebuilt and
+               reply concatenated per message), kept here for comparison;
+* route      - full POST /wechat requests through the Flask test client (in-memory SQLite), each
+               message distinct (new CreateTime / MsgId);
+* retries    - the same, every message sent again as WeChat retries it: answered from the
+               deduplication cache (wechat.MessageDeduplicator).
+
+Usage:
+    python scripts/bench_wechat.py
+    python scripts/bench_wechat.py --messages 50000 --repeat 5
+"""
+import argparse
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wechat import WeChatDispatcher, MENU_ARTICLES, parse_message  # noqa: E402
+
+BASE_URL = 'http://bench.local'
+
+
+def sample_messages():
+    """Menu clicks on every key (the bulk of the traffic) plus a text message."""
+    messages = [
+        f'<xml><ToUserName><![CDATA[gh_bench]]></ToUserName><FromUserName><![CDATA[oBench{index:04d}]]></FromUserName>'
+        f'<CreateTime>1700000000</CreateTime><MsgType><![CDATA[event]]></MsgType><Event><![CDATA[CLICK]]></Event>'
+        f'<EventKey><![CDATA[{key}]]></EventKey></xml>'.encode()
+        for index, key in enumerate(MENU_ARTICLES)]
+    messages.append(b'<xml><ToUserName><![CDATA[gh_bench]]></ToUserName><FromUserName><![CDATA[oBenchText]]></FromUserName>'
+                    b'<CreateTime>1700000000</CreateTime><MsgType><![CDATA[text]]></MsgType>'
+                    b'<Content><![CDATA[\xe7\x8c\xab]]></Content><MsgId>1234567890123456</MsgId></xml>')
+    return messages
+
+
+def previous_handle(xml_data):
+    """The handling /wechat did before wechat.py (minus logging), for comparison."""
+    root = ET.fromstring(xml_data)
+    msg_type = root.find('MsgType').text if root.find('MsgType') is not None else 'UnknownMsgType'
+    to_user_name = root.find('ToUserName').text if root.find('ToUserName') is not None else 'N/A'
+    from_user_name = root.find('FromUserName').text if root.find('FromUserName') is not None else 'N/A'
+    event = event_key = None
+    if msg_type == 'event':
+        event = root.find('Event').text if root.find('Event') is not None else 'UnknownEvent'
+        if event == 'CLICK':
+            event_key = root.find('EventKey').text if root.find('EventKey') is not None else 'NoKey'
+    elif msg_type == 'text':
+        root.find('Content').text if root.find('Content') is not None else 'NoContent'
+    if not (msg_type == 'event' and event == 'CLICK'):
+        return ''
+    menu_actions = {key: {'title': article.title, 'description': article.description, 'pic_url': article.pic_url,
+                          'url': f'{BASE_URL}{article.path}'} for key, article in MENU_ARTICLES.items()}
+    action = menu_actions.get(event_key)
+    if not action:
+        return ''
+    xml_response = "<xml>"
+    xml_response += f"<ToUserName><![CDATA[{from_user_name}]]></ToUserName>"
+    xml_response += f"<FromUserName><![CDATA[{to_user_name}]]></FromUserName>"
+    xml_response += f"<CreateTime>{int(time.time())}</CreateTime>"
+    xml_response += "<MsgType><![CDATA[news]]></MsgType>"
+    xml_response += "<ArticleCount>1</ArticleCount>"
+    xml_response += "<Articles><item>"
+    xml_response += f"<Title><![CDATA[{action['title']}]]></Title>"
+    xml_response += f"<Description><![CDATA[{action['description']}]]></Description>"
+    xml_response += f"<PicUrl><![CDATA[{action['pic_url']}]]></PicUrl>"
+    xml_response += f"<Url><![CDATA[{action['url']}]]></Url>"
+    xml_response += "</item></Articles></xml>"
+    return xml_response
+
+
+def unique(xml_data, index):
+    """A distinct message: WeChat identifies messages by MsgId, or FromUserName + CreateTime."""
+    xml_data = xml_data.replace(b'<CreateTime>1700000000</CreateTime>', f'<CreateTime>{1700000000 + index}</CreateTime>'.encode())
+    return xml_data.replace(b'<MsgId>1234567890123456</MsgId>', f'<MsgId>{1234567890123456 + index}</MsgId>'.encode())
+
+
+def rate(handle, messages, count, repeat, distinct=False):
+    """Median messages/sec of handle() over count messages cycling through the samples."""
+    batch = [messages[index % len(messages)] for index in range(count)]
+    if distinct:
+        batch = [unique(xml_data, index) for index, xml_data in enumerate(batch)]
+    rates = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for xml_data in batch:
+            handle(xml_data)
+        rates.append(count / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+def route_handler():
+    from config import Config
+    from app import create_app
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        IMAGE_PROCESSING_MODE = 'inline'
+        APP_BASE_URL = BASE_URL
+
+    app = create_app(BenchConfig)
+    app.logger.setLevel(logging.WARNING) # Measure the handling, not the log handler
+    client = app.test_client()
+    return lambda xml_data: client.post('/wechat', data=xml_data, content_type='text/xml')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000, help='Messages per run (route: a tenth of it)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    messages = sample_messages()
+    dispatcher = WeChatDispatcher()
+    without_time = lambda reply: re.sub(r'<CreateTime>\d+</CreateTime>', '', reply)  # noqa: E731
+    assert all(without_time(dispatcher.dispatch(parse_message(xml_data), BASE_URL)) == without_time(previous_handle(xml_data))
+               for xml_data in messages), 'replies differ from the previous implementation'
+
+    print(f"{'path':12} {'msgs/sec':>10}")
+    print(f"{'previous':12} {rate(previous_handle, messages, args.messages, args.repeat):10.0f}")
+    print(f"{'dispatcher':12} {rate(lambda xml_data: dispatcher.dispatch(parse_message(xml_data), BASE_URL), messages, args.messages, args.repeat):10.0f}")
+    handle = route_handler()
+    print(f"{'route':12} {rate(handle, messages, max(1, args.messages // 10), 1, distinct=True):10.0f}")
+    print(f"{'retries':12} {rate(handle, messages, max(1, args.messages // 10), args.repeat, distinct=True):10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Check that every list query shape built by listing.py is served by an index.
+
+Runs EXPLAIN QUERY PLAN (SQLite) / EXPLAIN (PostgreSQL) for each combination of
+report_type / status / pet_type / location / color / cursor and exits non-zero if
+any plan falls back to a full table scan or sorts in a temp B-tree (other than
+sorting the rows matched by a full-text index), so CI can catch a filter that
+outgrew the composite indexes in models.py.
+
+Usage:
+    python scripts/check_query_plans.py                       # in-memory SQLite built from models
+    python scripts/check_query_plans.py --database-url URL    # an existing (migrated) database
+"""
+import argparse
+import itertools
+import os
+import re
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from models import db, PetLostReport, PetFoundReport  # noqa: E402
+from listing import build_lost_query, build_found_query, keyset_query, encode_cursor  # noqa: E402
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN \w+$')  # "SCAN t USING INDEX ..." is fine, bare "SCAN t" is not
+
+
+def iter_query_shapes():
+    """Yield (label, query, model) for every distinct filter combination the list page can build."""
+    class _Cursor:
+        created_at = datetime(2025, 1, 1)
+        id = 1
+    cursor = encode_cursor(_Cursor)
+
+    for report_type, status, pet_type, location, color, with_cursor in itertools.product(
+            ('lost', 'found', 'all'), ('', 'lost', 'found'), ('', '猫'), ('', '南岗'), ('', '橘'), (False, True)):
+        params = {'status': status, 'pet_type': pet_type, 'location': location, 'color': color}
+        label = f"report_type={report_type} " + ' '.join(f'{k}={v!r}' for k, v in params.items() if v)
+        if with_cursor:
+            label += ' +cursor'
+        if report_type in ('lost', 'all'):
+            yield ('lost ' + label, keyset_query(build_lost_query(params, report_type), PetLostReport,
+                                                 cursor=cursor if with_cursor else None), PetLostReport)
+        if report_type in ('found', 'all') and not status:  # status does not apply to found reports
+            yield ('found ' + label, keyset_query(build_found_query(params), PetFoundReport,
+                                                  cursor=cursor if with_cursor else None), PetFoundReport)
+
+
+def explain(connection, query):
+    """Return the plan lines for `query` on this connection's dialect."""
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    params = compiled.params
+    if compiled.positiontup:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + str(compiled), params).fetchall()
+    return [row[0] for row in rows]
+
+
+def plan_problems(dialect_name, plan_lines):
+    """Return human-readable problems found in a plan (empty list if the plan is index-driven)."""
+    # Full-text filters (search.py) drive the query from the FTS / GIN index; sorting the
+    # matched rows is expected there, only a table scan is a problem
+    fulltext_driven = any('VIRTUAL TABLE INDEX' in line or ('Bitmap Index Scan' in line and '_tsv' in line)
+                          for line in plan_lines)
+    problems = []
+    for line in plan_lines:
+        detail = line.strip()
+        if dialect_name == 'sqlite':
+            if SQLITE_FULL_SCAN.match(detail):
+                problems.append(f'full table scan: {detail}')
+            elif 'USE TEMP B-TREE FOR ORDER BY' in detail and not fulltext_driven:
+                problems.append(f'sort without index: {detail}')
+        else:
+            if 'Seq Scan' in detail:
+                problems.append(f'full table scan: {detail}')
+            elif (detail.startswith('Sort') or '->  Sort' in detail) and not fulltext_driven:
+                problems.append(f'sort without index: {detail}')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite://',
+                        help='Database to explain against (default: in-memory SQLite created from the models)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every plan, not only failures')
+    args = parser.parse_args(argv)
+
+    class ExplainConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app
+    app = create_app(ExplainConfig)
+
+    failures = 0
+    with app.app_context():
+        with db.engine.connect() as connection:
+            dialect_name = connection.dialect.name
+            if dialect_name == 'postgresql':
+                # Tiny CI tables make a seq scan look cheapest; forbid it so we see whether an index *can* be used
+                connection.exec_driver_sql('SET enable_seqscan = off')
+            seen = set()
+            for label, query, _model in iter_query_shapes():
+                sql = str(query.statement.compile(dialect=connection.dialect))
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                plan = explain(connection, query)
+                problems = plan_problems(dialect_name, plan)
+                if problems:
+                    failures += 1
+                if problems or args.verbose:
+                    print(f"{'FAIL' if problems else 'ok  '} {label}")
+                    for line in plan:
+                        print(f'        {line}')
+            print(f'{len(seen)} distinct query shapes checked on {dialect_name}, {failures} without index support')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Local stand-in for the WeChat API endpoints used by wechat_api.py, for development and tests.
+
+Serves GET /cgi-bin/token and POST /cgi-bin/message/template/send like api.weixin.qq.com:
+
+* tokens expire after --token-ttl seconds and are then refused with errcode 42001;
+* template messages to an openid starting with 'blocked' fail with 43004 (user unsubscribed);
+* a --fail-rate fraction of sends answer errcode -1 (system busy), retryable;
+* --latency adds a delay per request, to see the sender's concurrency at work.
+
+Accepted messages are printed (and kept in StubWeChatServer.messages when used in-process).
+
+Usage:
+    python scripts/wechat_stub_server.py --port 8765
+    WECHAT_API_BASE=http://127.0.0.1:8765 WECHAT_APPID=stub WECHAT_APPSECRET=stub flask notifications send
+
+In-process:
+    server = StubWeChatServer().start()   # picks a free port
+    app.config['WECHAT_API_BASE'] = server.base_url
+"""
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/cgi-bin/token':
+            return self.send_error(404)
+        time.sleep(self.server.latency)
+        self._reply(self.server.issue_token(parse_qs(url.query)))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/cgi-bin/message/template/send':
+            return self.send_error(404)
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.server.latency)
+        self._reply(self.server.send_template(parse_qs(url.query).get('access_token', [''])[0], payload))
+
+
+class StubWeChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), token_ttl=7200, fail_rate=0.0, latency=0.0, verbose=False):
+        super().__init__(address, StubHandler)
+        self.token_ttl = token_ttl
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.verbose = verbose
+        self.messages = [] # Accepted template message payloads
+        self.token_requests = 0
+        self._tokens = {} # token -> expiry (time.monotonic())
+        self._next_msgid = 1000
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='wechat-stub', daemon=True).start()
+        return self
+
+    def revoke_tokens(self):
+        """Make every issued token invalid, as when another server fetched a new one."""
+        with self._lock:
+            self._tokens.clear()
+
+    def issue_token(self, query):
+        if not query.get('appid') or not query.get('secret'):
+            return {'errcode': 41002, 'errmsg': 'appid missing'}
+        with self._lock:
+            self.token_requests += 1
+            token = secrets.token_hex(16)
+            self._tokens[token] = time.monotonic() + self.token_ttl
+        return {'access_token': token, 'expires_in': self.token_ttl}
+
+    def send_template(self, token, payload):
+        with self._lock:
+            expires_at = self._tokens.get(token)
+            if expires_at is None:
+                return {'errcode': 40001, 'errmsg': 'invalid credential, access_token is invalid or not latest'}
+            if expires_at <= time.monotonic():
+                return {'errcode': 42001, 'errmsg': 'access_token expired'}
+            if str(payload.get('touser', '')).startswith('blocked'):
+                return {'errcode': 43004, 'errmsg': 'require subscribe'}
+            if random.random() < self.fail_rate:
+                return {'errcode': -1, 'errmsg': 'system error'}
+            self._next_msgid += 1
+            self.messages.append(payload)
+            msgid = self._next_msgid
+        if self.verbose:
+            print(json.dumps(payload, ensure_ascii=False), flush=True)
+        return {'errcode': 0, 'errmsg': 'ok', 'msgid': msgid}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--token-ttl', type=int, default=7200, help='Seconds a token stays valid')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of sends answering errcode -1')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay per request')
+    args = parser.parse_args()
+
+    server = StubWeChatServer((args.host, args.port), args.token_ttl, args.fail_rate, args.latency, verbose=True)
+    print(f'WeChat API stub on {server.base_url} (Ctrl+C to stop)', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+全文检索 (Full-text search over report location and description text).
+
+SQLite uses the FTS5 tables created in models.fts_table_ddl(); PostgreSQL uses the GIN
+indexes on to_tsvector('simple', ...) declared on the models. Both index the bigram-segmented
+search_location / search_text columns (see segmenter.py), so Chinese substrings are matched
+through the index instead of an ILIKE '%...%' scan.
+"""
+from sqlalchemy import column, func, literal_column, table, text
+
+from models import db
+from segmenter import fts5_match_expression, tsquery_expression
+
+MAX_SEARCH_RESULTS = 100
+
+# Location matches rank above description matches
+LOCATION_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def _fts_table(model):
+    return table(f'{model.__tablename__}_fts', column('rowid'))
+
+
+def _tsvector(model_column):
+    # Must match the index expression in models.py exactly for PostgreSQL to use the GIN index
+    return func.to_tsvector(literal_column("'simple'"), func.coalesce(model_column, literal_column("''")))
+
+
+def fulltext_clause(model, search, field=None):
+    """
+    WHERE clause matching reports whose text contains every term of `search`.
+
+    :param field: 'search_location' or 'search_text' to restrict the match, or None for either.
+    :return: SQLAlchemy clause, or None if `search` contains nothing searchable.
+    """
+    if _dialect_name() == 'postgresql':
+        expression = tsquery_expression(search)
+        if expression is None:
+            return None
+        tsquery = func.to_tsquery(literal_column("'simple'"), expression)
+        fields = [field] if field else ['search_location', 'search_text']
+        return db.or_(*(_tsvector(getattr(model, name)).op('@@')(tsquery) for name in fields))
+
+    expression = fts5_match_expression(search, column=field)
+    if expression is None:
+        return None
+    fts = _fts_table(model)
+    matching_ids = db.select(fts.c.rowid).where(
+        text(f'{fts.name} MATCH :fts_query').bindparams(fts_query=expression))
+    return model.id.in_(matching_ids)
+
+
+def ranked_search(query, model, search, limit=MAX_SEARCH_RESULTS):
+    """
+    Run `query` (already filtered, unordered) restricted to full-text matches of `search`,
+    best matches first.
+
+    :return: list of (report, score) tuples; higher score is a better match.
+    """
+    if _dialect_name() == 'postgresql':
+        expression = tsquery_expression(search)
+        if expression is None:
+            return []
+        tsquery = func.to_tsquery(literal_column("'simple'"), expression)
+        location_vector = _tsvector(model.search_location)
+        text_vector = _tsvector(model.search_text)
+        score = (func.ts_rank(location_vector, tsquery) * LOCATION_WEIGHT
+                 + func.ts_rank(text_vector, tsquery) * TEXT_WEIGHT)
+        rows = (query.filter(db.or_(location_vector.op('@@')(tsquery), text_vector.op('@@')(tsquery)))
+                .add_columns(score.label('score'))
+                .order_by(score.desc(), model.id.desc())
+                .limit(limit).all())
+        return [(report, float(value)) for report, value in rows]
+
+    expression = fts5_match_expression(search)
+    if expression is None:
+        return []
+    fts = _fts_table(model)
+    # bm25() is lower-is-better; negate it so callers always see higher-is-better
+    bm25 = literal_column(f'bm25({fts.name}, {LOCATION_WEIGHT}, {TEXT_WEIGHT})')
+    rows = (query.join(fts, fts.c.rowid == model.id)
+            .filter(text(f'{fts.name} MATCH :fts_query').bindparams(fts_query=expression))
+            .add_columns(bm25.label('score'))
+            .order_by(bm25, model.id.desc())
+            .limit(limit).all())
+    return [(report, -float(value)) for report, value in rows]
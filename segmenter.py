@@ -0,0 +1,74 @@
+"""
+中文分词 (Chinese-aware segmentation for full-text search).
+
+Neither SQLite FTS5's unicode61 tokenizer nor PostgreSQL's 'simple' config can split
+Chinese text, which has no spaces between words. We segment in Python instead and store
+the result in plain text columns that the FTS index tokenizes on whitespace:
+
+* each run of CJK characters becomes its overlapping bigrams plus a unigram of its last
+  character ("南岗区" -> "南岗 岗区 区"), so any substring of length >= 2 is a phrase of
+  consecutive bigrams and any single character is a prefix of some token;
+* runs of letters/digits become one lower-cased token.
+"""
+import re
+
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[0-9A-Za-zÀ-ɏ]+')
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+
+def _is_cjk(run):
+    return bool(_CJK_RE.match(run))
+
+
+def _cjk_tokens(run):
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def segment(*texts):
+    """Segment one or more text fields into a single whitespace-separated token string."""
+    tokens = []
+    for text in texts:
+        if not text:
+            continue
+        for run in _TOKEN_RE.findall(text):
+            tokens.extend(_cjk_tokens(run) if _is_cjk(run) else [run.lower()])
+    return ' '.join(tokens)
+
+
+def query_terms(text):
+    """
+    Split a search string into terms for the FTS query builders.
+
+    :return: list of (tokens, is_prefix) tuples. A term matches when its tokens appear as a
+             consecutive phrase; is_prefix terms (a single CJK character) match as a token prefix.
+    """
+    terms = []
+    for run in _TOKEN_RE.findall(text or ''):
+        if not _is_cjk(run):
+            terms.append(([run.lower()], False))
+        elif len(run) == 1:
+            terms.append(([run], True))
+        else:
+            terms.append(([run[i:i + 2] for i in range(len(run) - 1)], False))
+    return terms
+
+
+def fts5_match_expression(text, column=None):
+    """Build an SQLite FTS5 MATCH expression (all terms required), or None if nothing to search."""
+    parts = []
+    for tokens, is_prefix in query_terms(text):
+        phrase = '"' + ' '.join(tokens) + '"'
+        parts.append(phrase + '*' if is_prefix else phrase)
+    if not parts:
+        return None
+    expression = ' AND '.join(parts)
+    return f'{column} : ({expression})' if column else expression
+
+
+def tsquery_expression(text):
+    """Build a PostgreSQL to_tsquery('simple', ...) string (all terms required), or None."""
+    parts = []
+    for tokens, is_prefix in query_terms(text):
+        quoted = [f"'{token}'" for token in tokens]
+        parts.append(quoted[0] + ':*' if is_prefix else '(' + ' <-> '.join(quoted) + ')')
+    return ' & '.join(parts) if parts else None
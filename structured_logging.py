@@ -0,0 +1,173 @@
+"""
+结构化日志 (Non-blocking, structured logging).
+
+init_logging(app) puts a QueueHandler in front of app.logger's handlers (gunicorn's error log
+under gunicorn, Flask's stderr handler otherwise). A request thread only appends the LogRecord
+to an in-memory queue; a QueueListener thread formats it (text or JSON) and writes it out, so
+neither the formatter nor a slow log file or pipe is on the request's critical path. msg % args
+and the traceback are rendered before the record is queued: the arguments (e.g. ORM objects,
+whose repr may need the request's session) are not safe to use later or from another thread.
+
+Log lazily - pass arguments instead of formatting the message yourself, so records below the
+logger's level cost one isEnabledFor() check:
+
+    current_app.logger.debug('Resized image %s to %dx%d', path, width, height)
+
+Settings (config.py):
+
+* LOG_ASYNC - False writes records synchronously from the logging thread (tests, debugging);
+* LOG_FORMAT - 'text' keeps the handlers' format, 'json' writes one JSON object per line
+  (ts, level, logger, message, pid, thread, request path, exc_info and any `extra` fields);
+* LOG_SAMPLE_RATES - {event: n}: of the records logged with extra={'sample': event} only one in n
+  is kept (per process); kept records carry sampled=n;
+* LOG_QUEUE_SIZE - records waiting for the listener; when it is full records are dropped and
+  counted (log_records_dropped_total in /metrics) rather than blocking the request.
+"""
+import atexit
+import copy
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+DEFAULT_QUEUE_SIZE = 10000
+_EXCEPTION_FORMATTER = logging.Formatter()
+# Attributes every LogRecord has; the others were passed through `extra` and go into the JSON object
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one in n records of each sampled event (records logged with extra={'sample': event})."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {event: int(n) for event, n in rates.items() if int(n) > 1}
+        self._counters = {event: itertools.count() for event in self.rates}
+
+    def filter(self, record):
+        event = getattr(record, 'sample', None)
+        if event not in self.rates:
+            return True
+        if next(self._counters[event]) % self.rates[event]: # itertools.count is atomic under the GIL
+            return False
+        record.sampled = self.rates[event]
+        return True
+
+
+def _add_request_path(record):
+    # The listener thread has no request context: take the path before the record is queued
+    if has_request_context() and not hasattr(record, 'path'):
+        record.path = request.path
+    return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler feeding a QueueListener that it starts itself, also again in a forked child
+    (gunicorn --preload, multiprocessing): the parent's listener thread does not survive a fork.
+    """
+
+    def __init__(self, handlers, maxsize=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._start()
+        atexit.register(self.stop)
+
+    def _start(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        """Write out the queued records and stop the listener thread."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but leaves the layout to the listener's handlers
+        record = copy.copy(record) # Other handlers (propagation) get the original
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None # Tracebacks hold the request's frames
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def init_logging(app):
+    """Route app.logger through the queue (app.extensions['log_queue']); call once the config is loaded."""
+    logger = app.logger
+    if not app.debug:
+        # 生产环境 (gunicorn): 写入 gunicorn 的 error log; 级别未设置或高于 INFO 时使用 INFO
+        gunicorn_error_logger = logging.getLogger('gunicorn.error')
+        logger.handlers = list(gunicorn_error_logger.handlers)
+        logger.setLevel(min(gunicorn_error_logger.level or logging.INFO, logging.INFO))
+    handlers = []
+    for handler in logger.handlers: # Another app of this process (same logger name) installed a queue already
+        if isinstance(handler, AsyncQueueHandler):
+            handler.stop()
+            handlers.extend(handler.handlers)
+        else:
+            handlers.append(handler)
+    for old_filter in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+        logger.removeFilter(old_filter)
+
+    if app.config.get('LOG_FORMAT', 'text') == 'json':
+        formatter = JSONFormatter()
+        for handler in handlers: # gunicorn's own error log lines share the handlers and become JSON too
+            handler.setFormatter(formatter)
+
+    # Logger filters run on the logging thread, before the record is queued
+    logger.addFilter(SamplingFilter(app.config.get('LOG_SAMPLE_RATES') or {}))
+    logger.addFilter(_add_request_path)
+    if app.config.get('LOG_ASYNC', True) and handlers: # Without handlers records go to logging.lastResort
+        front = app.extensions['log_queue'] = AsyncQueueHandler(handlers, app.config.get('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        logger.handlers = [front]
+    else:
+        logger.handlers = handlers
+    return logger
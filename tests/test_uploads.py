@@ -0,0 +1,67 @@
+"""
+上传文件存储 (uploads.py): a rejected submission leaves no stored file behind.
+
+Run with `python -m pytest tests`.
+"""
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from models import db, StoredFile
+
+LOST_FORM = {'pet_type': '猫', 'breed': '橘猫', 'color': '橘色', 'gender': '公', 'features': '左耳有缺口',
+             'lost_time': '2025-05-01T10:00', 'lost_location_text': '南岗区', 'contact_info': '13800000000'}
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        IMAGE_PROCESSING_MODE = 'external' # No compression: only the stored originals
+    os.makedirs(TestConfig.UPLOAD_FOLDER)
+    return create_app(TestConfig)
+
+
+def jpeg(red):
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), (red, 80, 40)).save(data, 'JPEG')
+    return data.getvalue()
+
+
+def stored_files(folder):
+    return [os.path.join(root, name) for root, _, names in os.walk(folder) for name in names]
+
+
+@pytest.mark.parametrize('rejected', ['photo', 'field'])
+def test_rejected_submission_leaves_no_files(app, rejected):
+    photos = [(io.BytesIO(jpeg(red)), f'{red}.jpg') for red in (0, 100, 200)]
+    form = dict(LOST_FORM)
+    if rejected == 'photo': # The fourth photo fails the type check after three were stored
+        photos.append((io.BytesIO(b'not an image'), 'notes.jpg'))
+    else: # All photos stored, then the form fails validation
+        form['lost_time'] = 'yesterday'
+    response = app.test_client().post('/report/lost', data={**form, 'photos': photos},
+                                      content_type='multipart/form-data')
+
+    assert response.status_code == 200 # The form again, with the error
+    assert stored_files(app.config['UPLOAD_FOLDER']) == []
+    with app.app_context():
+        assert StoredFile.query.count() == 0
+
+
+def test_accepted_submission_keeps_files(app):
+    photos = [(io.BytesIO(jpeg(red)), f'{red}.jpg') for red in (0, 100, 200)]
+    app.test_client().post('/report/lost', data={**LOST_FORM, 'photos': photos}, content_type='multipart/form-data')
+
+    with app.app_context():
+        assert StoredFile.query.count() == 3
+    assert len(stored_files(app.config['UPLOAD_FOLDER'])) == 3
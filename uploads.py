@@ -0,0 +1,183 @@
+"""
+内容寻址的上传存储 (Content-addressed upload store).
+
+Each distinct upload is stored once as UPLOAD_FOLDER/ab/cd/<sha256><ext>, keyed by the SHA-256
+of its bytes. A StoredFile row per file counts the report photos referencing it, so the same
+photo reposted in a lost report, a found report or a resubmission after a validation error is
+written and compressed only once (image_jobs.py reuses the file's derivatives), and the upload
+directory fans out over 65536 shards instead of growing as one flat folder.
+
+Once processed, the stored file is replaced by its compressed rendition: the key is the hash of
+the bytes as uploaded, not of what is on disk.
+
+Reference counts follow the reports: UploadWriter.commit() counts the new photo, and deleting a
+report or replacing its photo list releases the files it no longer references, in the same
+flush (_release_dropped_photos). A file moved into the store by a transaction that is rolled back
+is removed again, unless another upload of the same bytes has replaced it in the meantime.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import uuid
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, PetLostReport, PetFoundReport, StoredFile
+
+CHUNK_SIZE = 64 * 1024
+SHARD_LEVELS = 2 # Directory levels of two hex characters each
+
+
+def shard_path(digest, extension):
+    """'3fa2...', '.jpg' -> '3f/a2/3fa2....jpg' (relative to UPLOAD_FOLDER, always with '/')."""
+    shards = [digest[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)]
+    return posixpath.join(*shards, digest + extension)
+
+
+def _absolute_path(filename):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *filename.split('/'))
+
+
+class UploadWriter:
+    """
+    Writes one upload into the store incrementally, hashing it on the way.
+
+    The data goes to a temporary file, which commit() turns into the stored file only if that
+    content is not stored yet; discard() drops it (e.g. when a submission is rejected midway).
+    """
+
+    def __init__(self):
+        self.tmp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'.incoming-{uuid.uuid4().hex}')
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        self._digest.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self, extension):
+        """
+        Store the written content and count one more reference to it.
+
+        The StoredFile is added to the current session; the caller commits it together with the
+        report that references it.
+        :param extension: File extension for a newly stored file, e.g. '.jpg'.
+        :return: the StoredFile; its .filename goes into the report's photo list.
+        """
+        self._file.close()
+        digest = self._digest.hexdigest()
+        try:
+            stored = StoredFile.query.filter_by(sha256=digest).first()
+            created = False
+            if stored is None:
+                stored = StoredFile(sha256=digest, filename=shard_path(digest, extension.lower()), size=self.size,
+                                    refcount=1)
+                created = _insert_stored_file(stored)
+                if not created: # A concurrent upload of the same bytes inserted it first
+                    stored = StoredFile.query.filter_by(sha256=digest).one()
+            path = _absolute_path(stored.filename)
+            if created or not os.path.exists(path):
+                # New content, or the stored copy went missing: (re)write it and process it again
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(self.tmp_path, path)
+                db.session.info.setdefault('new_upload_files', []).append((path, os.stat(path).st_ino))
+                stored.variants = None
+        finally:
+            self.discard()
+
+        if not created:
+            stored.refcount = StoredFile.refcount + 1 # Incremented in SQL: concurrent uploads of the same photo
+        current_app.logger.info('Stored upload %s (%d bytes)', stored.filename, self.size)
+        return stored
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _insert_stored_file(stored):
+    """
+    INSERT a new StoredFile in a SAVEPOINT. False if a concurrent upload of the same bytes
+    committed its row first (unique sha256): the caller then counts a reference to that row.
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.add(stored)
+    except IntegrityError:
+        return False
+    return True
+
+
+def release_uploads(session, filenames):
+    """Drop one reference per occurrence in filenames; unreferenced files are deleted by `flask images gc`."""
+    for filename, count in Counter(filenames).items():
+        session.execute(db.update(StoredFile).where(StoredFile.filename == filename, StoredFile.refcount > 0)
+                        .values(refcount=db.case((StoredFile.refcount > count, StoredFile.refcount - count), else_=0)))
+
+
+def delete_stored_file(stored):
+    """Remove a stored file, its derivatives and its row (in the current session)."""
+    folder = posixpath.dirname(stored.filename)
+    names = {stored.filename}
+    for entry in json.loads(stored.variants or '{}').values():
+        names.update(posixpath.join(folder, name) for name in entry.values())
+    for name in names:
+        try:
+            os.remove(_absolute_path(name))
+        except FileNotFoundError:
+            pass
+    db.session.delete(stored)
+
+
+# --- 引用计数随启事删除/更换照片递减; 回滚时删除本事务新存入的文件 ---
+
+def _photo_list(value):
+    return json.loads(value) if value else []
+
+
+@event.listens_for(Session, 'before_flush')
+def _release_dropped_photos(session, flush_context, instances):
+    dropped = []
+    for report in session.deleted:
+        if isinstance(report, (PetLostReport, PetFoundReport)):
+            dropped.extend(report.photo_urls or [])
+    for report in session.dirty:
+        if isinstance(report, (PetLostReport, PetFoundReport)):
+            history = inspect(report).attrs._photo_urls.history
+            if history.deleted:
+                remaining = Counter(_photo_list(history.added[0] if history.added else None))
+                dropped.extend((Counter(_photo_list(history.deleted[0])) - remaining).elements())
+    if dropped:
+        release_uploads(session, dropped)
+
+
+for _model in (PetLostReport, PetFoundReport):
+    # active_history: load the previous photo list when a new one is assigned, for the flush above
+    event.listen(_model._photo_urls, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _keep_new_upload_files(session):
+    if session.in_nested_transaction(): # A released SAVEPOINT (_insert_stored_file) commits nothing yet
+        return
+    session.info.pop('new_upload_files', None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _remove_new_upload_files(session, transaction):
+    if transaction.parent is not None: # Savepoints: the files belong to the enclosing transaction
+        return
+    for path, inode in session.info.pop('new_upload_files', ()): # Left by after_commit: rolled back or closed
+        try:
+            if os.stat(path).st_ino == inode: # Not replaced by another upload of the same bytes since
+                os.remove(path)
+        except FileNotFoundError:
+            pass
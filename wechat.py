@@ -0,0 +1,246 @@
+"""
+微信公众号消息处理 (WeChat official account message handling).
+
+POST /wechat is hit by WeChat's servers for every menu click and message, in bursts when a menu
+is pushed to all followers. The per-message work is kept to the minimum:
+
+* parse_message() extracts all fields in one regex pass over the flat <xml><Tag><![CDATA[..]]>..
+  layout WeChat sends, falling back to ElementTree for anything else;
+* handlers are registered once, per (MsgType, Event), on a WeChatDispatcher built by create_app;
+* menu replies are news messages whose XML (everything but ToUserName, FromUserName and
+  CreateTime) is rendered once per menu key and base URL, then reused.
+
+WeChat resends a message up to three times when it gets no reply within 5 seconds.
+MessageDeduplicator recognizes those retries (by MsgId, or FromUserName + CreateTime for
+events) and answers them with the reply of the first attempt instead of handling the message
+again; a retry arriving while the first attempt is still running waits for it. Handlers run
+on a small thread pool so the route can give up after a latency budget and answer 'success'
+(no reply, no more retries) while the handler finishes in the background.
+
+`python scripts/bench_wechat.py` measures messages/sec through the dispatcher and the route.
+"""
+import hashlib
+import hmac
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+MAX_FAST_PARSE_BYTES = 8192 # WeChat messages are well below this; larger bodies go to ElementTree
+MAX_CACHED_BODIES = 64 # Without APP_BASE_URL the base URL comes from the Host header: bound what it can add
+DEDUP_TTL = 60 # Seconds a reply is remembered; WeChat's three retries come within ~15s
+REPLY_BUDGET = 4.5 # Seconds before answering 'success' without a reply; WeChat gives up after 5
+SHARED_POLL_INTERVAL = 0.05
+
+Article = namedtuple('Article', ['title', 'description', 'pic_url', 'path'])
+
+# 菜单 CLICK 事件的 EventKey -> 回复的图文消息 (path 相对于站点根地址)
+MENU_ARTICLES = {
+    'USER_REPORT_LOST': Article('发布寻宠启事', '您的爱宠不慎走失？点击这里填写信息，让更多人帮您寻找。', '', '/report/lost'),
+    'USER_REPORT_FOUND': Article('发布招领信息', '您捡到了需要帮助的小可爱？点击这里为它寻找主人。', '', '/report/found'),
+    'VIEW_LOST_REPORTS': Article('查看寻宠启事', '看看最近有哪些正在寻找的宠物，也许您能提供线索。', '', '/reports?report_type=lost'),
+    'VIEW_FOUND_REPORTS': Article('查看招领信息', '这些小可爱正在等待主人，快来看看有没有您认识的。', '', '/reports?report_type=found'),
+}
+
+
+def check_signature(token, signature, timestamp, nonce):
+    """Verify WeChat's signature: sha1 of the sorted token, timestamp and nonce."""
+    expected = hashlib.sha1(''.join(sorted([token, timestamp, nonce])).encode('utf-8')).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def parse_message(xml_data):
+    """
+    {tag: text} of the top-level fields of a WeChat message (ToUserName, MsgType, Event, ...).
+
+    The fast path only accepts input it reads exactly as ElementTree would: <xml> holding
+    attribute-less fields whose text is one CDATA section or plain characters without entities.
+    Nested fields (e.g. ScanCodeInfo), entities, CR characters or an XML declaration fall back
+    to ET.fromstring().
+    :raises ET.ParseError: if xml_data is not well-formed XML.
+    """
+    data = xml_data.strip()
+    if (len(data) <= MAX_FAST_PARSE_BYTES and data.startswith(b'<xml>') and data.endswith(b'</xml>')
+            and b'\r' not in data):
+        fields, position, end = {}, len(b'<xml>'), len(data) - len(b'</xml>')
+        try:
+            while match := _FIELD.match(data, position, end):
+                tag, cdata, text = match.groups()
+                value = cdata if cdata is not None else text
+                fields[tag.decode('ascii')] = value.decode('utf-8') if value else None # ET gives None for empty text
+                position = match.end()
+        except UnicodeDecodeError:
+            pass # ET raises ParseError for it below
+        else:
+            if not data[position:end].strip():
+                return fields
+    return {field.tag: field.text for field in ET.fromstring(xml_data)}
+
+
+_FIELD = re.compile(rb'\s*<(\w+)>(?:<!\[CDATA\[(.*?)\]\]>|([^<&]*))</\1>', re.S)
+
+
+def render_news_body(articles, base_url):
+    """The constant part of a news reply: everything after CreateTime, up to </xml>."""
+    items = ''.join(
+        f'<item><Title><![CDATA[{article.title}]]></Title>'
+        f'<Description><![CDATA[{article.description}]]></Description>'
+        f'<PicUrl><![CDATA[{article.pic_url}]]></PicUrl>'
+        f'<Url><![CDATA[{base_url}{article.path}]]></Url></item>'
+        for article in articles)
+    return (f'<MsgType><![CDATA[news]]></MsgType><ArticleCount>{len(articles)}</ArticleCount>'
+            f'<Articles>{items}</Articles></xml>')
+
+
+def news_reply(to_user, from_user, body):
+    """A complete reply from a body rendered by render_news_body()."""
+    return (f'<xml><ToUserName><![CDATA[{to_user}]]></ToUserName>'
+            f'<FromUserName><![CDATA[{from_user}]]></FromUserName>'
+            f'<CreateTime>{int(time.time())}</CreateTime>{body}')
+
+
+class WeChatDispatcher:
+    """
+    Routes parsed messages to the handler registered for their (MsgType, Event).
+
+    A handler is called as handler(message, base_url) and returns the reply XML, or '' to just
+    acknowledge the message.
+    """
+
+    def __init__(self, menu_articles=MENU_ARTICLES):
+        self.menu_articles = menu_articles
+        self._handlers = {}
+        self._bodies = {} # (EventKey, base_url) -> pre-rendered news body
+        self.register('event', 'CLICK')(self.menu_click)
+
+    def register(self, msg_type, event=None):
+        """Decorator registering a handler for messages of msg_type (and Event, for 'event' messages)."""
+        def decorator(handler):
+            self._handlers[(msg_type, event)] = handler
+            return handler
+        return decorator
+
+    def dispatch(self, message, base_url):
+        handler = self._handlers.get((message.get('MsgType'), message.get('Event')))
+        return handler(message, base_url) if handler else ''
+
+    def menu_click(self, message, base_url):
+        key = (message.get('EventKey'), base_url)
+        body = self._bodies.get(key)
+        if body is None:
+            article = self.menu_articles.get(message.get('EventKey'))
+            if article is None:
+                return '' # Unknown menu key: acknowledge only
+            body = render_news_body([article], base_url)
+            if len(self._bodies) >= MAX_CACHED_BODIES:
+                self._bodies.clear()
+            self._bodies[key] = body
+        # Reply from the official account (ToUserName) to the user (FromUserName)
+        return news_reply(message.get('FromUserName'), message.get('ToUserName'), body)
+
+
+def message_key(message):
+    """Identity of a message across WeChat's retries: MsgId, or FromUserName + CreateTime (events have no MsgId)."""
+    if message.get('MsgId'):
+        return f"msg:{message['MsgId']}"
+    if message.get('FromUserName') and message.get('CreateTime'):
+        return f"event:{message['FromUserName']}:{message['CreateTime']}"
+    return None
+
+
+class MessageDeduplicator:
+    """
+    Handles each message once and answers its retries with the remembered reply.
+
+    Replies are kept for `ttl` seconds in `local` (a bounded LRU with per-entry TTL, e.g.
+    response_cache.MemoryCacheBackend) and, when given, in `shared` (same interface, reachable
+    by all workers - a retry may reach another gunicorn worker). While a message is being
+    handled, `shared` holds a PENDING marker, written with add() (set-if-absent): only the
+    worker that writes it runs the handler, the others wait for the reply.
+    """
+
+    PENDING = '\0pending'
+
+    def __init__(self, local, shared=None, ttl=DEDUP_TTL, threads=8):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self._inflight = {} # key -> Future of the attempt being handled in this process
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='wechat-handler')
+        self.duplicates = 0 # Retries answered without handling the message again
+        self.late = 0 # Messages not handled within the budget
+
+    def _remembered(self, key):
+        reply = self.local.get(key)
+        if reply is None and self.shared is not None:
+            reply = self.shared.get(key)
+        return reply
+
+    def handle(self, message, handler, budget=REPLY_BUDGET):
+        """
+        The reply of handler() for message (a str, '' to acknowledge), or the remembered reply
+        of an earlier attempt. None if no reply is ready within `budget` seconds; the handler
+        keeps running and its reply is remembered.
+        Exceptions from handler() are raised to every attempt waiting for it.
+        """
+        key = message_key(message)
+        if key is None:
+            return handler()
+        deadline = time.monotonic() + budget
+        reply = self._remembered(key)
+        while True:
+            if reply == self.PENDING: # Being handled by another worker
+                reply = self._wait_shared(key, deadline)
+            if reply is not None:
+                self.duplicates += 1
+                if reply == self.PENDING:
+                    self.late += 1
+                    return None
+                return reply
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is not None:
+                    self.duplicates += 1
+                    break
+                # Only the worker whose PENDING marker gets written (set-if-absent) handles the message
+                if self.shared is None or self.shared.add(key, self.PENDING, self.ttl):
+                    future = self._inflight[key] = self._executor.submit(self._run, key, handler)
+                    break
+            reply = self.shared.get(key) # Another worker claimed it first: its marker or its reply
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            self.late += 1
+            return None
+
+    def _run(self, key, handler):
+        try:
+            reply = handler()
+        except Exception:
+            if self.shared is not None:
+                self.shared.delete(key) # Let a retry try again
+            with self._lock:
+                self._inflight.pop(key, None)
+            raise
+        self.local.set(key, reply, self.ttl)
+        if self.shared is not None:
+            self.shared.set(key, reply, self.ttl)
+        with self._lock:
+            self._inflight.pop(key, None)
+        return reply
+
+    def _wait_shared(self, key, deadline):
+        """The reply another worker stores for key; PENDING if not ready by deadline, None if it gave up."""
+        reply = self.PENDING
+        while reply == self.PENDING and time.monotonic() < deadline:
+            time.sleep(SHARED_POLL_INTERVAL)
+            reply = self.shared.get(key)
+        if reply is not None and reply != self.PENDING:
+            self.local.set(key, reply, self.ttl)
+        return reply
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,132 @@
+"""
+微信公众号接口客户端 (WeChat official account API client).
+
+WeChatClient calls the server-side API (access_token, template messages) over one
+requests.Session, whose connection pool is shared by every thread using the client. The
+access_token comes from an AccessTokenManager (wechat_token.py): shared by all workers through
+WECHAT_TOKEN_STORE, refreshed before it expires by a single worker, and refreshed once more
+when WeChat reports it invalid.
+
+get_wechat_client() returns the app's client; WECHAT_API_BASE points it at a local stub
+instead of api.weixin.qq.com (see scripts/wechat_stub_server.py).
+"""
+import json
+from datetime import datetime
+
+import click
+import requests
+from flask import current_app
+from flask.cli import AppGroup
+from requests.adapters import HTTPAdapter
+
+from wechat_token import AccessTokenManager, MemoryTokenStore, create_token_store
+
+API_BASE = 'https://api.weixin.qq.com'
+REQUEST_TIMEOUT = (3.05, 10) # (connect, read) seconds
+TOKEN_ERRORS = {40001, 40014, 42001} # access_token invalid / malformed / expired: refresh and retry once
+# Retrying cannot help: invalid openid, user unsubscribed or blocked messages, bad template id or data
+PERMANENT_ERRORS = {40003, 40037, 43004, 43101, 47003}
+
+
+class WeChatAPIError(Exception):
+    """WeChat answered with a non-zero errcode."""
+
+    def __init__(self, errcode, errmsg):
+        super().__init__(f'{errcode}: {errmsg}')
+        self.errcode = errcode
+        self.errmsg = errmsg
+
+    @property
+    def permanent(self):
+        return self.errcode in PERMANENT_ERRORS
+
+
+class WeChatClient:
+    def __init__(self, appid, secret, api_base=API_BASE, pool_size=10, token_store=None):
+        self.appid = appid
+        self.secret = secret
+        self.api_base = api_base.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.tokens = AccessTokenManager(token_store or MemoryTokenStore(), self._fetch_token)
+
+    @classmethod
+    def from_config(cls, config, pool_size=10, token_store=None):
+        if not config.get('WECHAT_APPID') or not config.get('WECHAT_APPSECRET'):
+            raise RuntimeError('WECHAT_APPID and WECHAT_APPSECRET must be configured to call the WeChat API')
+        return cls(config['WECHAT_APPID'], config['WECHAT_APPSECRET'], config.get('WECHAT_API_BASE') or API_BASE,
+                   pool_size=pool_size, token_store=token_store)
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, self.api_base + path, timeout=REQUEST_TIMEOUT, **kwargs)
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errcode'):
+            raise WeChatAPIError(result['errcode'], result.get('errmsg', ''))
+        return result
+
+    def _fetch_token(self):
+        result = self._request('GET', '/cgi-bin/token', params={
+            'grant_type': 'client_credential', 'appid': self.appid, 'secret': self.secret})
+        return result['access_token'], int(result.get('expires_in', 7200))
+
+    def access_token(self, rejected=None):
+        return self.tokens.token(rejected)
+
+    def call(self, path, payload):
+        """POST a JSON payload to an access_token API, refreshing a rejected token once."""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        token = self.access_token()
+        try:
+            return self._request('POST', path, params={'access_token': token}, data=body,
+                                 headers={'Content-Type': 'application/json; charset=utf-8'})
+        except WeChatAPIError as e:
+            if e.errcode not in TOKEN_ERRORS:
+                raise
+        token = self.access_token(rejected=token)
+        return self._request('POST', path, params={'access_token': token}, data=body,
+                             headers={'Content-Type': 'application/json; charset=utf-8'})
+
+    def send_template_message(self, openid, template_id, data, url=None):
+        """Send a template message; data is {field: value} for the template's fields. Returns the msgid."""
+        payload = {'touser': openid, 'template_id': template_id,
+                   'data': {field: {'value': value} for field, value in data.items()}}
+        if url:
+            payload['url'] = url
+        return self.call('/cgi-bin/message/template/send', payload).get('msgid')
+
+
+def get_wechat_client():
+    """The WeChatClient of this app, shared by all senders of the process (one pool, one token manager)."""
+    client = current_app.extensions.get('wechat_client')
+    if client is None:
+        client = current_app.extensions['wechat_client'] = WeChatClient.from_config(
+            current_app.config, pool_size=current_app.config.get('WECHAT_SEND_CONCURRENCY', 10),
+            token_store=create_token_store(current_app))
+    return client
+
+
+# --- flask wechat ... ---
+wechat_cli = AppGroup('wechat', help='微信公众号接口 (WeChat API).')
+
+
+@wechat_cli.command('token')
+@click.option('--refresh', is_flag=True, help='Fetch a new token now (invalidates the current one for all workers).')
+def token(refresh):
+    """Show the shared access_token's expiry; the hit/refresh counters are per worker (see /metrics)."""
+    try:
+        manager = get_wechat_client().tokens
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if refresh:
+        entry = manager.store.get()
+        manager.token(rejected=entry.token if entry else None)
+    entry = manager.store.get()
+    if entry is None:
+        click.echo('No access_token stored yet')
+    else:
+        remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+        click.echo(f'access_token {entry.token[:6]}... expires {entry.expires_at:%Y-%m-%d %H:%M:%S} UTC '
+                   f'(in {remaining:.0f}s, refreshed {manager.refresh_margin.total_seconds():.0f}s before it expires)')
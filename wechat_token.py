@@ -0,0 +1,253 @@
+"""
+微信 access_token 共享缓存 (WeChat access_token shared by all workers).
+
+WeChat allows a limited number of access_token requests per day, and fetching a new token
+invalidates the previous one a few minutes later. Every process (gunicorn workers, the
+`flask notifications worker`) therefore shares one token through a store:
+
+* each process keeps a local copy and only reads the store once that copy is due for refresh;
+* the token is refreshed TOKEN_REFRESH_MARGIN seconds before it expires, by exactly one worker:
+  refreshing takes a lock in the store (single flight). Meanwhile the others keep using the
+  old token, which is still valid, and only wait for the new one when theirs has expired or
+  was rejected;
+* a lock whose holder died expires after LOCK_SECONDS and is taken over.
+
+WECHAT_TOKEN_STORE selects the store:
+
+* 'database' (default) - a row per appid in the wechat_access_tokens table; the lock is a
+  conditional UPDATE, so it works across processes on SQLite and PostgreSQL alike;
+* 'redis'  - keys at WECHAT_TOKEN_STORE_URL; the lock is SET NX with an expiry;
+* 'memory' - per process only (tests/dev).
+
+AccessTokenManager.stats() counts local hits, store hits, refreshes, waits and stale tokens
+served in this process; each worker exports them on /metrics (metrics.py). `flask wechat token`
+shows the shared token's expiry (wechat_api.py).
+"""
+import json
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, WeChatAccessToken
+
+TOKEN_REFRESH_MARGIN = 300 # Refresh this many seconds before the token expires
+LOCK_SECONDS = 15 # Longer than a token request can take (wechat_api.REQUEST_TIMEOUT)
+WAIT_SECONDS = 20 # Give up waiting for another worker's refresh after this; > LOCK_SECONDS to take over a dead one
+WAIT_INTERVAL = 0.05
+
+TokenEntry = namedtuple('TokenEntry', ['token', 'expires_at']) # expires_at: naive UTC datetime
+
+
+class MemoryTokenStore:
+    """Process-local store; only shares the token between the threads of one process."""
+
+    def __init__(self):
+        self._entry = None
+        self._owner = None
+        self._locked_until = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._entry
+
+    def set(self, entry):
+        self._entry = entry
+
+    def acquire(self, owner, seconds):
+        with self._lock:
+            if self._owner is not None and time.monotonic() < self._locked_until:
+                return False
+            self._owner, self._locked_until = owner, time.monotonic() + seconds
+            return True
+
+    def release(self, owner):
+        with self._lock:
+            if self._owner == owner:
+                self._owner = None
+
+
+class DatabaseTokenStore:
+    """
+    One wechat_access_tokens row per appid, accessed through the engine rather than the session:
+    tokens are requested from sender threads without an app context.
+    """
+
+    def __init__(self, engine, appid):
+        self.engine = engine
+        self.appid = appid
+        self.table = WeChatAccessToken.__table__
+
+    def get(self):
+        with self.engine.connect() as conn:
+            row = conn.execute(db.select(self.table.c.access_token, self.table.c.expires_at)
+                               .where(self.table.c.appid == self.appid)).first()
+        return TokenEntry(row.access_token, row.expires_at) if row and row.access_token else None
+
+    def set(self, entry):
+        with self.engine.begin() as conn:
+            conn.execute(db.update(self.table).where(self.table.c.appid == self.appid)
+                         .values(access_token=entry.token, expires_at=entry.expires_at, updated_at=datetime.utcnow()))
+
+    def acquire(self, owner, seconds):
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            # Only one worker can win: the UPDATE only matches while the lock is free or expired
+            result = conn.execute(
+                db.update(self.table)
+                .where(self.table.c.appid == self.appid,
+                       db.or_(self.table.c.locked_until.is_(None), self.table.c.locked_until <= now))
+                .values(lock_owner=owner, locked_until=now + timedelta(seconds=seconds)))
+            if result.rowcount == 1:
+                return True
+        try:
+            with self.engine.begin() as conn: # First token for this appid: create the row, locked
+                conn.execute(db.insert(self.table).values(appid=self.appid, lock_owner=owner,
+                                                          locked_until=now + timedelta(seconds=seconds)))
+        except IntegrityError:
+            return False # The row exists and is locked, or another worker just created it
+        return True
+
+    def release(self, owner):
+        with self.engine.begin() as conn:
+            conn.execute(db.update(self.table)
+                         .where(self.table.c.appid == self.appid, self.table.c.lock_owner == owner)
+                         .values(lock_owner=None, locked_until=None))
+
+
+class RedisTokenStore:
+    """Store on a Redis-compatible client (get, set with nx=/ex=, delete)."""
+
+    def __init__(self, client, appid, prefix='petfinder:wechat:'):
+        self.client = client
+        self.key = f'{prefix}token:{appid}'
+        self.lock_key = f'{prefix}token-lock:{appid}'
+
+    @classmethod
+    def from_url(cls, url, appid):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("WECHAT_TOKEN_STORE='redis' requires the redis package (pip install redis)") from e
+        return cls(redis.Redis.from_url(url), appid)
+
+    def get(self):
+        data = self.client.get(self.key)
+        if data is None:
+            return None
+        value = json.loads(data)
+        return TokenEntry(value['token'], datetime.fromisoformat(value['expires_at']))
+
+    def set(self, entry):
+        ttl = int((entry.expires_at - datetime.utcnow()).total_seconds())
+        self.client.set(self.key, json.dumps({'token': entry.token, 'expires_at': entry.expires_at.isoformat()}),
+                        ex=max(1, ttl))
+
+    def acquire(self, owner, seconds):
+        return bool(self.client.set(self.lock_key, owner, nx=True, ex=seconds))
+
+    def release(self, owner):
+        value = self.client.get(self.lock_key)
+        if value is not None and (value.decode() if isinstance(value, bytes) else value) == owner:
+            self.client.delete(self.lock_key)
+
+
+class AccessTokenManager:
+    """
+    Hands out the shared access_token, refreshing it through `fetch` (-> (token, expires_in))
+    in at most one worker at a time.
+    """
+
+    def __init__(self, store, fetch, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.store = store
+        self.fetch = fetch
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.owner = uuid.uuid4().hex # Lock owner id of this manager
+        self._entry = None # Local copy of the shared token
+        self._lock = threading.Lock() # Single flight within the process
+        self.local_hits = 0
+        self.store_hits = 0
+        self.refreshes = 0
+        self.waits = 0
+        self.stale_served = 0
+
+    def stats(self):
+        return {'local_hits': self.local_hits, 'store_hits': self.store_hits, 'refreshes': self.refreshes,
+                'waits': self.waits, 'stale_served': self.stale_served}
+
+    def _fresh(self, entry, rejected, now):
+        return entry is not None and entry.token != rejected and now < entry.expires_at - self.refresh_margin
+
+    def _usable(self, entry, rejected, now):
+        return entry is not None and entry.token != rejected and now < entry.expires_at
+
+    def token(self, rejected=None):
+        """
+        The current access_token.
+
+        :param rejected: A token WeChat just refused; a different one is returned, refreshing
+                         it unless another thread or worker already has.
+        """
+        entry = self._entry
+        now = datetime.utcnow()
+        if self._fresh(entry, rejected, now):
+            self.local_hits += 1
+            return entry.token
+        usable = self._usable(entry, rejected, now)
+        # While another thread refreshes, keep using a token that has not expired yet
+        if not self._lock.acquire(blocking=not usable):
+            self.stale_served += 1
+            return entry.token
+        try:
+            return self._shared_token(rejected)
+        finally:
+            self._lock.release()
+
+    def _shared_token(self, rejected):
+        deadline = time.monotonic() + WAIT_SECONDS
+        while True:
+            entry = self.store.get()
+            now = datetime.utcnow()
+            if self._fresh(entry, rejected, now):
+                self._entry = entry
+                self.store_hits += 1
+                return entry.token
+            if self.store.acquire(self.owner, LOCK_SECONDS):
+                try:
+                    entry = self.store.get() # Another worker may have refreshed between get() and acquire()
+                    if self._fresh(entry, rejected, datetime.utcnow()):
+                        self.store_hits += 1
+                    else:
+                        token, expires_in = self.fetch()
+                        entry = TokenEntry(token, datetime.utcnow() + timedelta(seconds=expires_in))
+                        self.store.set(entry)
+                        self.refreshes += 1
+                    self._entry = entry
+                    return entry.token
+                finally:
+                    self.store.release(self.owner)
+            # Another worker is refreshing
+            if self._usable(entry, rejected, now):
+                self.stale_served += 1
+                return entry.token
+            if time.monotonic() >= deadline:
+                raise TimeoutError('Timed out waiting for another worker to refresh the WeChat access_token')
+            self.waits += 1
+            time.sleep(WAIT_INTERVAL)
+
+
+def create_token_store(app):
+    """The token store configured by WECHAT_TOKEN_STORE (call inside an app context)."""
+    kind = app.config.get('WECHAT_TOKEN_STORE', 'database')
+    appid = app.config['WECHAT_APPID']
+    if kind == 'database':
+        return DatabaseTokenStore(db.engine, appid)
+    if kind == 'redis':
+        return RedisTokenStore.from_url(app.config['WECHAT_TOKEN_STORE_URL'], appid)
+    if kind == 'memory':
+        return MemoryTokenStore()
+    raise ValueError(f'Unknown WECHAT_TOKEN_STORE: {kind!r} (database, redis or memory)')
+